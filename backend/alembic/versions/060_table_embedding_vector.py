@@ -0,0 +1,47 @@
+"""060_table_embedding_vector
+
+Revision ID: 3f6a1c9d2e47
+Revises: db1a95567cbb
+Create Date: 2025-10-17 10:12:41.218604
+
+"""
+from alembic import op
+import sqlalchemy as sa
+import pgvector
+
+# revision identifiers, used by Alembic.
+revision = '3f6a1c9d2e47'
+down_revision = 'db1a95567cbb'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    op.execute("CREATE EXTENSION IF NOT EXISTS vector;")
+    # embeddings were stored as json text ("[0.1, 0.2, ...]"), which is also valid vector input
+    op.alter_column('core_table', 'embedding',
+                    existing_type=sa.Text(),
+                    type_=pgvector.sqlalchemy.vector.VECTOR(),
+                    existing_nullable=True,
+                    postgresql_using="NULLIF(embedding, '')::vector")
+    op.alter_column('core_datasource', 'embedding',
+                    existing_type=sa.Text(),
+                    type_=pgvector.sqlalchemy.vector.VECTOR(),
+                    existing_nullable=True,
+                    postgresql_using="NULLIF(embedding, '')::vector")
+    # table ranking is an exact nearest-neighbour scan over the tables of one datasource
+    op.create_index(op.f('ix_core_table_ds_id'), 'core_table', ['ds_id'], unique=False)
+
+
+def downgrade():
+    op.drop_index(op.f('ix_core_table_ds_id'), table_name='core_table')
+    op.alter_column('core_datasource', 'embedding',
+                    existing_type=pgvector.sqlalchemy.vector.VECTOR(),
+                    type_=sa.Text(),
+                    existing_nullable=True,
+                    postgresql_using="embedding::text")
+    op.alter_column('core_table', 'embedding',
+                    existing_type=pgvector.sqlalchemy.vector.VECTOR(),
+                    type_=sa.Text(),
+                    existing_nullable=True,
+                    postgresql_using="embedding::text")
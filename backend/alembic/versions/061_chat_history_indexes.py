@@ -0,0 +1,37 @@
+"""061_chat_history_indexes
+
+Revision ID: 8c2d4e7f1a93
+Revises: 3f6a1c9d2e47
+Create Date: 2025-10-17 15:40:12.518264
+
+"""
+from alembic import op
+
+# revision identifiers, used by Alembic.
+revision = '8c2d4e7f1a93'
+down_revision = '3f6a1c9d2e47'
+branch_labels = None
+depends_on = None
+
+# name, table, columns
+indexes = [
+    ('ix_chat_record_chat_id_create_time', 'chat_record', ['chat_id', 'create_time']),
+    ('ix_chat_record_datasource_create_time', 'chat_record', ['datasource', 'create_time']),
+    ('ix_chat_log_pid_type_operate', 'chat_log', ['pid', 'type', 'operate']),
+    ('ix_chat_create_by_oid_create_time', 'chat', ['create_by', 'oid', 'create_time']),
+    ('ix_chat_datasource', 'chat', ['datasource']),
+]
+
+
+def upgrade():
+    # history tables can be large, build without blocking chat writes
+    with op.get_context().autocommit_block():
+        for name, table, columns in indexes:
+            op.create_index(name, table, columns, unique=False, if_not_exists=True,
+                            postgresql_concurrently=True)
+
+
+def downgrade():
+    with op.get_context().autocommit_block():
+        for name, table, _ in reversed(indexes):
+            op.drop_index(name, table_name=table, if_exists=True, postgresql_concurrently=True)
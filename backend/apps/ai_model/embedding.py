@@ -1,5 +1,7 @@
 import os.path
 import threading
+import time
+from collections import OrderedDict
 from typing import Optional
 
 from langchain_core.embeddings import Embeddings
@@ -26,6 +28,15 @@ locks = {}
 
 _embedding_model: dict[str, Optional[Embeddings]] = {}
 
+# (model key, normalized text) -> (embedding, create time), most recently used last
+_query_cache: OrderedDict[tuple[str, str], tuple[list[float], float]] = OrderedDict()
+_query_cache_lock = threading.Lock()
+_query_cache_stats = {'hits': 0, 'misses': 0, 'evictions': 0}
+
+
+def _normalize_query(text: str) -> str:
+    return ' '.join(text.split())
+
 
 class EmbeddingModelCache:
 
@@ -61,3 +72,42 @@ class EmbeddingModelCache:
                     _embedding_model[key] = model_instance
 
         return model_instance
+
+    @staticmethod
+    def embed_query(text: str, key: str = settings.DEFAULT_EMBEDDING_MODEL,
+                    config: EmbeddingModelInfo = local_embedding_model) -> list[float]:
+        """
+        embed_query of the cached model, memoized by (model key, normalized text) with LRU and TTL eviction,
+        so the retrieval steps of one chat turn and repeated questions encode the text only once
+        """
+        cache_key = (key, _normalize_query(text))
+        if settings.EMBEDDING_QUERY_CACHE_SIZE > 0:
+            now = time.time()
+            with _query_cache_lock:
+                cached = _query_cache.get(cache_key)
+                if cached is not None and now - cached[1] < settings.EMBEDDING_QUERY_CACHE_TTL:
+                    _query_cache.move_to_end(cache_key)
+                    _query_cache_stats['hits'] += 1
+                    return list(cached[0])
+                _query_cache_stats['misses'] += 1
+
+        embedding = EmbeddingModelCache.get_model(key, config).embed_query(cache_key[1])
+
+        if settings.EMBEDDING_QUERY_CACHE_SIZE > 0:
+            with _query_cache_lock:
+                _query_cache[cache_key] = (embedding, time.time())
+                _query_cache.move_to_end(cache_key)
+                while len(_query_cache) > settings.EMBEDDING_QUERY_CACHE_SIZE:
+                    _query_cache.popitem(last=False)
+                    _query_cache_stats['evictions'] += 1
+        return list(embedding)
+
+    @staticmethod
+    def query_cache_stats() -> dict:
+        with _query_cache_lock:
+            return {**_query_cache_stats, 'size': len(_query_cache)}
+
+    @staticmethod
+    def clear_query_cache():
+        with _query_cache_lock:
+            _query_cache.clear()
@@ -1,17 +1,22 @@
-from functools import lru_cache
+import hashlib
 import json
+import threading
+import time
 from abc import ABC, abstractmethod
+from collections import OrderedDict
 from typing import Optional, Dict, Any, Type
 
+import orjson
 from langchain.chat_models.base import BaseChatModel
 from pydantic import BaseModel
 from sqlmodel import Session, select
 
 from apps.ai_model.openai.llm import BaseChatOpenAI
 from apps.system.models.system_model import AiModelDetail
+from common.core.config import settings
 from common.core.db import engine
 from common.utils.crypto import sqlbot_decrypt
-from common.utils.utils import prepare_model_arg
+from common.utils.utils import prepare_model_arg, SQLBotLogUtil
 from langchain_community.llms import VLLMOpenAI
 from langchain_openai import AzureChatOpenAI
 # from langchain_community.llms import Tongyi, VLLM
@@ -73,12 +78,10 @@ class OpenAIvLLM(BaseLLM):
 
 class OpenAIAzureLLM(BaseLLM):
     def _init_llm(self) -> AzureChatOpenAI:
-        api_version = self.config.additional_params.get("api_version")
-        deployment_name = self.config.additional_params.get("deployment_name")
-        if api_version:
-            self.config.additional_params.pop("api_version")
-        if deployment_name:
-            self.config.additional_params.pop("deployment_name")
+        # the config is shared by cached clients, leave its params untouched
+        additional_params = dict(self.config.additional_params)
+        api_version = additional_params.pop("api_version", None)
+        deployment_name = additional_params.pop("deployment_name", None)
         return AzureChatOpenAI(
             azure_endpoint=self.config.api_base_url,
             api_key=self.config.api_key or 'Empty',
@@ -86,7 +89,7 @@ class OpenAIAzureLLM(BaseLLM):
             api_version=api_version,
             deployment_name=deployment_name,
             streaming=True,
-            **self.config.additional_params,
+            **additional_params,
         )
 class OpenAILLM(BaseLLM):
     def _init_llm(self) -> BaseChatModel:
@@ -113,8 +116,8 @@ class LLMFactory:
     }
 
     @classmethod
-    @lru_cache(maxsize=32)
     def create_llm(cls, config: LLMConfig) -> BaseLLM:
+        """new client on every call, see llm_registry.get_llm for the cached one"""
         llm_class = cls._llm_types.get(config.model_type)
         if not llm_class:
             raise ValueError(f"Unsupported LLM type: {config.model_type}")
@@ -138,7 +141,7 @@ class LLMFactory:
     return config """
 
 
-async def get_default_config() -> LLMConfig:
+async def load_default_config() -> LLMConfig:
     with Session(engine) as session:
         db_model = session.exec(
             select(AiModelDetail).where(AiModelDetail.default_model == True)
@@ -168,3 +171,100 @@ async def get_default_config() -> LLMConfig:
             api_base_url=db_model.api_domain,
             additional_params=additional_params,
         )
+
+
+def config_hash(config: LLMConfig) -> str:
+    raw = orjson.dumps(config.model_dump(), option=orjson.OPT_SORT_KEYS | orjson.OPT_NON_STR_KEYS, default=str)
+    return hashlib.sha256(raw).hexdigest()
+
+
+class LLMRegistry:
+    """
+    process-wide registry of the decrypted default model config and of llm clients keyed by (model id, config
+    hash), a reused client keeps its http connection pool. both are dropped by invalidate() from the aimodel
+    apis, the default config is also reloaded after LLM_CONFIG_CACHE_TTL seconds (bounds staleness across
+    worker processes)
+    """
+
+    def __init__(self, max_size: int = 32):
+        self.max_size = max_size
+        self._default: Optional[tuple[LLMConfig, float]] = None
+        self._version = 0
+        self._clients: OrderedDict[tuple[Optional[int], str], BaseLLM] = OrderedDict()
+        self._counters: dict[Optional[int], dict[str, int]] = {}
+        self._lock = threading.Lock()
+        self.config_hits = 0
+        self.config_loads = 0
+        self.invalidations = 0
+
+    async def get_default_config(self) -> LLMConfig:
+        ttl = settings.LLM_CONFIG_CACHE_TTL
+        with self._lock:
+            if self._default is not None and time.time() - self._default[1] < ttl:
+                self.config_hits += 1
+                return self._default[0]
+            version = self._version
+        config = await load_default_config()
+        with self._lock:
+            self.config_loads += 1
+            # skip storing a config that raced with an invalidate
+            if ttl > 0 and version == self._version:
+                self._default = (config, time.time())
+        return config
+
+    def _count(self, model_id: Optional[int], name: str):
+        counters = self._counters.setdefault(model_id, {'creates': 0, 'reuses': 0})
+        counters[name] += 1
+
+    def get_llm(self, config: LLMConfig) -> BaseLLM:
+        key = (config.model_id, config_hash(config))
+        with self._lock:
+            llm = self._clients.get(key)
+            if llm is not None:
+                self._clients.move_to_end(key)
+                self._count(config.model_id, 'reuses')
+                return llm
+
+        # build outside the lock, constructing the client does not connect
+        new_llm = LLMFactory.create_llm(config)
+        with self._lock:
+            llm = self._clients.get(key)
+            if llm is not None:
+                self._count(config.model_id, 'reuses')
+                return llm
+            self._clients[key] = new_llm
+            self._count(config.model_id, 'creates')
+            while len(self._clients) > self.max_size:
+                self._clients.popitem(last=False)
+        SQLBotLogUtil.info(f"llm client created for model {config.model_id} ({config.model_name})")
+        return new_llm
+
+    def invalidate(self, model_id: Optional[int] = None):
+        """
+        drop the default config and the clients of model_id (all clients when None)
+        """
+        with self._lock:
+            self._default = None
+            self._version += 1
+            self.invalidations += 1
+            for key in [key for key in self._clients if model_id is None or key[0] == model_id]:
+                del self._clients[key]
+
+    def stats(self) -> dict:
+        with self._lock:
+            return {
+                'default_config_cached': self._default is not None,
+                'config_hits': self.config_hits,
+                'config_loads': self.config_loads,
+                'invalidations': self.invalidations,
+                'clients': len(self._clients),
+                'max_clients': self.max_size,
+                'models': {str(model_id): dict(counters) for model_id, counters in self._counters.items()},
+            }
+
+
+llm_registry = LLMRegistry()
+
+
+async def get_default_config() -> LLMConfig:
+    return await llm_registry.get_default_config()
@@ -1,25 +1,36 @@
 import asyncio
-import io
+import os
+import tempfile
 import traceback
-from typing import Optional, List
+from contextlib import closing
+from types import SimpleNamespace
+from itertools import chain
+from typing import Optional, List, Literal
+from urllib.parse import quote
 
 import orjson
-import pandas as pd
-from fastapi import APIRouter, HTTPException, Path
-from fastapi.responses import StreamingResponse
+from fastapi import APIRouter, HTTPException, Path, Query
+from fastapi.responses import FileResponse, StreamingResponse
 from sqlalchemy import and_, select
+from starlette.background import BackgroundTask
 from starlette.responses import JSONResponse
 
 from apps.chat.curd.chat import delete_chat_with_user, get_chart_data_with_user, get_chat_predict_data_with_user, list_chats, get_chat_with_records, create_chat, rename_chat, \
     delete_chat, get_chat_chart_data, get_chat_predict_data, get_chat_with_records_with_data, get_chat_record_by_id, \
+    get_chat_record_reasoning, dynamic_ds_types, \
     format_json_data, format_json_list_data, get_chart_config, list_recent_questions,get_chat as get_chat_exec, rename_chat_with_user
 from apps.chat.models.chat_model import CreateChat, ChatRecord, RenameChat, ChatQuestion, AxisObj, QuickCommand, \
     ChatInfo, Chat, ChatFinishStep
 from apps.chat.task.llm import LLMService
+from apps.datasource.models.datasource import CoreDatasource
+from apps.db.db import iter_sql_result
 from apps.swagger.i18n import PLACEHOLDER_PREFIX
+from apps.system.crud.assistant import get_assistant_ds
 from apps.system.schemas.permission import SqlbotPermission, require_permissions
+from common.core.config import settings
 from common.core.deps import CurrentAssistant, SessionDep, CurrentUser, Trans
 from common.utils.command_utils import parse_quick_command
+from common.utils.data_export import csv_stream, write_xlsx
 from common.utils.data_format import DataFormat
 from common.audit.models.log_model import OperationType, OperationModules
 from common.audit.schemas.logger_decorator import LogConfig, system_log
@@ -34,20 +45,35 @@ async def chats(session: SessionDep, current_user: CurrentUser):
 
 @router.get("/{chart_id}", response_model=ChatInfo, summary=f"{PLACEHOLDER_PREFIX}get_chat")
 async def get_chat(session: SessionDep, current_user: CurrentUser, chart_id: int, current_assistant: CurrentAssistant,
-                   trans: Trans):
+                   trans: Trans,
+                   limit: Optional[int] = Query(None, ge=1, le=200, description=f"{PLACEHOLDER_PREFIX}chat_page_limit"),
+                   before: Optional[int] = Query(None, description=f"{PLACEHOLDER_PREFIX}chat_page_before"),
+                   compact: bool = Query(False, description=f"{PLACEHOLDER_PREFIX}chat_page_compact")):
     def inner():
         return get_chat_with_records(chart_id=chart_id, session=session, current_user=current_user,
-                                     current_assistant=current_assistant, trans=trans)
+                                     current_assistant=current_assistant, trans=trans, limit=limit, before=before,
+                                     compact=compact)
 
     return await asyncio.to_thread(inner)
 
 
 @router.get("/{chart_id}/with_data", response_model=ChatInfo, summary=f"{PLACEHOLDER_PREFIX}get_chat_with_data")
 async def get_chat_with_data(session: SessionDep, current_user: CurrentUser, chart_id: int,
-                             current_assistant: CurrentAssistant):
+                             current_assistant: CurrentAssistant,
+                             limit: Optional[int] = Query(None, ge=1, le=200,
+                                                          description=f"{PLACEHOLDER_PREFIX}chat_page_limit"),
+                             before: Optional[int] = Query(None, description=f"{PLACEHOLDER_PREFIX}chat_page_before")):
     def inner():
         return get_chat_with_records_with_data(chart_id=chart_id, session=session, current_user=current_user,
-                                               current_assistant=current_assistant)
+                                               current_assistant=current_assistant, limit=limit, before=before)
+
+    return await asyncio.to_thread(inner)
+
+
+@router.get("/record/{chat_record_id}/reasoning", summary=f"{PLACEHOLDER_PREFIX}get_chat_record_reasoning")
+async def chat_record_reasoning(session: SessionDep, current_user: CurrentUser, chat_record_id: int):
+    def inner():
+        return get_chat_record_reasoning(session=session, current_user=current_user, chat_record_id=chat_record_id)
 
     return await asyncio.to_thread(inner)
 
@@ -355,9 +381,8 @@ async def stream_sql(session: SessionDep, current_user: CurrentUser, request_que
     if stream:
         return StreamingResponse(llm_service.await_result(), media_type="text/event-stream")
     else:
-        res = llm_service.await_result()
         raw_data = {}
-        for chunk in res:
+        async for chunk in llm_service.await_result():
             if chunk:
                 raw_data = chunk
         status_code = 200
@@ -426,9 +451,8 @@ async def analysis_or_predict(session: SessionDep, current_user: CurrentUser, ch
     if stream:
         return StreamingResponse(llm_service.await_result(), media_type="text/event-stream")
     else:
-        res = llm_service.await_result()
         raw_data = {}
-        for chunk in res:
+        async for chunk in llm_service.await_result():
             if chunk:
                 raw_data = chunk
         status_code = 200
@@ -441,9 +465,50 @@ async def analysis_or_predict(session: SessionDep, current_user: CurrentUser, ch
         )
 
 
+def _export_sql_data(ds: CoreDatasource, sql: str):
+    """
+    rows of the record's sql, read batch by batch and formatted like the data stored with the record
+    """
+    count = 0
+    # closed right away at the cap, so the rest of the result is not read (see iter_sql_result)
+    with closing(iter_sql_result(ds, sql)) as results:
+        for result in results:
+            batch = orjson.loads(orjson.dumps(result.convert_large_numbers().prepare_for_json().rows()))
+            for row in format_json_list_data(batch):
+                if settings.CHAT_EXPORT_MAX_ROWS and count >= settings.CHAT_EXPORT_MAX_ROWS:
+                    return
+                count += 1
+                yield row
+
+
+def _export_ds(session: SessionDep, current_user: CurrentUser, current_assistant: CurrentAssistant,
+               ds_id: int) -> CoreDatasource:
+    # the record may outlive the access to its datasource, checked as LLMService.validate_history_ds does
+    ds = session.get(CoreDatasource, ds_id)
+    if not current_assistant or current_assistant.type == 4:
+        allowed = ds is not None and ds.oid == (current_user.oid if current_user.oid is not None else 1)
+    else:
+        _ds_list = get_assistant_ds(session=session, llm_service=SimpleNamespace(current_assistant=current_assistant))
+        allowed = ds is not None and any(item.get("id") == ds_id for item in _ds_list)
+    if not allowed:
+        raise HTTPException(
+            status_code=500,
+            detail=f"Datasource with id {ds_id} is not available to the current user"
+        )
+    return ds
+
+
+def _attachment(filename: str) -> str:
+    return f"attachment; filename*=utf-8''{quote(filename)}"
+
+
 @router.get("/record/{chat_record_id}/excel/export/{chat_id}", summary=f"{PLACEHOLDER_PREFIX}export_chart_data")
 @system_log(LogConfig(operation_type=OperationType.EXPORT,module=OperationModules.CHAT,resource_id_expr="chat_id",))
-async def export_excel(session: SessionDep, current_user: CurrentUser, chat_record_id: int,chat_id: int,  trans: Trans):
+async def export_excel(session: SessionDep, current_user: CurrentUser, chat_record_id: int, chat_id: int, trans: Trans,
+                       current_assistant: CurrentAssistant,
+                       file_format: Literal['xlsx', 'csv'] = Query('xlsx', alias='format',
+                                                                   description=f"{PLACEHOLDER_PREFIX}export_format"),
+                       full: bool = Query(False, description=f"{PLACEHOLDER_PREFIX}export_full")):
     chat_record = session.get(ChatRecord, chat_record_id)
     if not chat_record:
         raise HTTPException(
@@ -457,16 +522,22 @@ async def export_excel(session: SessionDep, current_user: CurrentUser, chat_reco
         )
     is_predict_data = chat_record.predict_record_id is not None
 
-    _origin_data = format_json_data(get_chat_chart_data(chat_record_id=chat_record_id, session=session))
+    # full re-runs the stored sql (already filtered by row permissions) instead of the preview kept with the
+    # record, the sql of a dynamic assistant datasource is not runnable on its own
+    ds = None
+    if full and chat_record.sql and chat_record.datasource and not (
+            current_assistant and current_assistant.type in dynamic_ds_types):
+        ds = _export_ds(session, current_user, current_assistant, chat_record.datasource)
 
-    _base_field = _origin_data.get('fields')
-    _data = _origin_data.get('data')
+    _data = []
+    if not ds:
+        _data = format_json_data(get_chat_chart_data(chat_record_id=chat_record_id, session=session)).get('data')
 
-    if not _data:
-        raise HTTPException(
-            status_code=500,
-            detail=trans("i18n_excel_export.data_is_empty")
-        )
+        if not _data:
+            raise HTTPException(
+                status_code=500,
+                detail=trans("i18n_excel_export.data_is_empty")
+            )
 
     chart_info = get_chart_config(session, chat_record_id)
 
@@ -486,34 +557,24 @@ async def export_excel(session: SessionDep, current_user: CurrentUser, chat_reco
     if is_predict_data:
         _predict_data = format_json_list_data(get_chat_predict_data(chat_record_id=chat_record_id, session=session))
 
-    def inner():
-
-        data_list = DataFormat.convert_large_numbers_in_object_array(_data + _predict_data)
+    sql = chat_record.sql
+    header = [field.name for field in fields]
 
-        md_data, _fields_list = DataFormat.convert_object_array_for_pandas(fields, data_list)
+    def rows():
+        for row in chain(_export_sql_data(ds, sql) if ds else _data, _predict_data):
+            row = DataFormat.convert_large_numbers_in_object_array([row])[0]
+            yield [row.get(field.value) for field in fields]
 
-        # data, _fields_list, col_formats = LLMService.format_pd_data(fields, _data + _predict_data)
+    if file_format == 'csv':
+        return StreamingResponse(csv_stream(header, rows()), media_type="text/csv; charset=utf-8",
+                                 headers={'Content-Disposition': _attachment(f'{_title}.csv')})
 
-        df = pd.DataFrame(md_data, columns=_fields_list)
-
-        buffer = io.BytesIO()
-
-        with pd.ExcelWriter(buffer, engine='xlsxwriter',
-                            engine_kwargs={'options': {'strings_to_numbers': False}}) as writer:
-            df.to_excel(writer, sheet_name='Sheet1', index=False)
-
-            # 获取 xlsxwriter 的工作簿和工作表对象
-            # workbook = writer.book
-            # worksheet = writer.sheets['Sheet1']
-            #
-            # for col_idx, fmt_type in col_formats.items():
-            #     if fmt_type == 'text':
-            #         worksheet.set_column(col_idx, col_idx, None, workbook.add_format({'num_format': '@'}))
-            #     elif fmt_type == 'number':
-            #         worksheet.set_column(col_idx, col_idx, None, workbook.add_format({'num_format': '0'}))
-
-        buffer.seek(0)
-        return io.BytesIO(buffer.getvalue())
-
-    result = await asyncio.to_thread(inner)
-    return StreamingResponse(result, media_type="application/vnd.openxmlformats-officedocument.spreadsheetml.sheet")
+    fd, path = tempfile.mkstemp(suffix='.xlsx')
+    os.close(fd)
+    try:
+        await asyncio.to_thread(write_xlsx, path, header, rows())
+    except Exception:
+        os.remove(path)
+        raise
+    return FileResponse(path, media_type="application/vnd.openxmlformats-officedocument.spreadsheetml.sheet",
+                        filename=f'{_title}.xlsx', background=BackgroundTask(os.remove, path))
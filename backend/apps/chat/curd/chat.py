@@ -1,9 +1,9 @@
 import datetime
-from typing import List, Optional
+from typing import Any, List, Optional
 
 import orjson
 import sqlparse
-from sqlalchemy import and_, select, update
+from sqlalchemy import and_, or_, select, update
 from sqlalchemy import desc, func
 from sqlalchemy.orm import aliased
 
@@ -241,16 +241,50 @@ def get_chat_predict_data(session: SessionDep, chat_record_id: int):
 
 
 def get_chat_with_records_with_data(session: SessionDep, chart_id: int, current_user: CurrentUser,
-                                    current_assistant: CurrentAssistant) -> ChatInfo:
-    return get_chat_with_records(session, chart_id, current_user, current_assistant, True)
+                                    current_assistant: CurrentAssistant, limit: Optional[int] = None,
+                                    before: Optional[int] = None) -> ChatInfo:
+    return get_chat_with_records(session, chart_id, current_user, current_assistant, True, limit=limit,
+                                 before=before)
 
 
 dynamic_ds_types = [1, 3]
 
 
+# reasoning content and query results of a record, left out of compact records and fetched per record
+lazy_record_keys = ['sql_answer', 'chart_answer', 'analysis_thinking', 'predict', 'data', 'predict_data',
+                    'sql_reasoning_content', 'chart_reasoning_content', 'analysis_reasoning_content',
+                    'predict_reasoning_content']
+
+
+def _reasoning_log_joins(stmt):
+    # reasoning content of the sql, chart, analysis and predict logs of each record
+    sql_alias_log = aliased(ChatLog)
+    chart_alias_log = aliased(ChatLog)
+    analysis_alias_log = aliased(ChatLog)
+    predict_alias_log = aliased(ChatLog)
+    stmt = stmt.add_columns(sql_alias_log.reasoning_content.label('sql_reasoning_content'),
+                            chart_alias_log.reasoning_content.label('chart_reasoning_content'),
+                            analysis_alias_log.reasoning_content.label('analysis_reasoning_content'),
+                            predict_alias_log.reasoning_content.label('predict_reasoning_content'))
+    for alias_log, operate in ((sql_alias_log, OperationEnum.GENERATE_SQL),
+                               (chart_alias_log, OperationEnum.GENERATE_CHART),
+                               (analysis_alias_log, OperationEnum.ANALYSIS),
+                               (predict_alias_log, OperationEnum.PREDICT_DATA)):
+        stmt = stmt.outerjoin(alias_log, and_(alias_log.pid == ChatRecord.id, alias_log.type == TypeEnum.CHAT,
+                                              alias_log.operate == operate))
+    return stmt
+
+
 def get_chat_with_records(session: SessionDep, chart_id: int, current_user: CurrentUser,
                           current_assistant: CurrentAssistant, with_data: bool = False,
-                          trans: Trans = None) -> ChatInfo:
+                          trans: Trans = None, limit: Optional[int] = None, before: Optional[int] = None,
+                          compact: bool = False) -> ChatInfo:
+    """
+    records of the chat, oldest first. with limit only the newest limit records older than the record id before
+    are returned, next_cursor is the before of the next (older) page.
+    compact records leave out reasoning content, answers and data (lazy_record_keys), fetched per record by
+    get_chat_record_reasoning and the record data apis
+    """
     chat = session.get(Chat, chart_id)
     if not chat:
         raise Exception(f"Chat with id {chart_id} not found")
@@ -272,83 +306,44 @@ def get_chat_with_records(session: SessionDep, chart_id: int, current_user: Curr
         chat_info.datasource_name = ds.name
         chat_info.ds_type = ds.type
 
-    sql_alias_log = aliased(ChatLog)
-    chart_alias_log = aliased(ChatLog)
-    analysis_alias_log = aliased(ChatLog)
-    predict_alias_log = aliased(ChatLog)
-
-    stmt = (select(ChatRecord.id, ChatRecord.chat_id, ChatRecord.create_time, ChatRecord.finish_time,
-                   ChatRecord.question, ChatRecord.sql_answer, ChatRecord.sql,
-                   ChatRecord.chart_answer, ChatRecord.chart, ChatRecord.analysis, ChatRecord.predict,
-                   ChatRecord.datasource_select_answer, ChatRecord.analysis_record_id, ChatRecord.predict_record_id,
-                   ChatRecord.regenerate_record_id,
-                   ChatRecord.recommended_question, ChatRecord.first_chat,
-                   ChatRecord.finish, ChatRecord.error,
-                   sql_alias_log.reasoning_content.label('sql_reasoning_content'),
-                   chart_alias_log.reasoning_content.label('chart_reasoning_content'),
-                   analysis_alias_log.reasoning_content.label('analysis_reasoning_content'),
-                   predict_alias_log.reasoning_content.label('predict_reasoning_content')
-                   )
-    .outerjoin(sql_alias_log, and_(sql_alias_log.pid == ChatRecord.id,
-                                   sql_alias_log.type == TypeEnum.CHAT,
-                                   sql_alias_log.operate == OperationEnum.GENERATE_SQL))
-    .outerjoin(chart_alias_log, and_(chart_alias_log.pid == ChatRecord.id,
-                                     chart_alias_log.type == TypeEnum.CHAT,
-                                     chart_alias_log.operate == OperationEnum.GENERATE_CHART))
-    .outerjoin(analysis_alias_log, and_(analysis_alias_log.pid == ChatRecord.id,
-                                        analysis_alias_log.type == TypeEnum.CHAT,
-                                        analysis_alias_log.operate == OperationEnum.ANALYSIS))
-    .outerjoin(predict_alias_log, and_(predict_alias_log.pid == ChatRecord.id,
-                                       predict_alias_log.type == TypeEnum.CHAT,
-                                       predict_alias_log.operate == OperationEnum.PREDICT_DATA))
-    .where(and_(ChatRecord.create_by == current_user.id, ChatRecord.chat_id == chart_id)).order_by(
-        ChatRecord.create_time))
-    if with_data:
-        stmt = select(ChatRecord.id, ChatRecord.chat_id, ChatRecord.create_time, ChatRecord.finish_time,
-                      ChatRecord.question, ChatRecord.sql_answer, ChatRecord.sql,
-                      ChatRecord.chart_answer, ChatRecord.chart, ChatRecord.analysis, ChatRecord.predict,
-                      ChatRecord.datasource_select_answer, ChatRecord.analysis_record_id, ChatRecord.predict_record_id,
-                      ChatRecord.regenerate_record_id,
-                      ChatRecord.recommended_question, ChatRecord.first_chat,
-                      ChatRecord.finish, ChatRecord.error, ChatRecord.data, ChatRecord.predict_data).where(
-            and_(ChatRecord.create_by == current_user.id, ChatRecord.chat_id == chart_id)).order_by(
-            ChatRecord.create_time)
+    summary_columns = (ChatRecord.id, ChatRecord.chat_id, ChatRecord.create_time, ChatRecord.finish_time,
+                       ChatRecord.question, ChatRecord.sql, ChatRecord.chart, ChatRecord.analysis,
+                       ChatRecord.predict, ChatRecord.datasource_select_answer, ChatRecord.analysis_record_id,
+                       ChatRecord.predict_record_id, ChatRecord.regenerate_record_id,
+                       ChatRecord.recommended_question, ChatRecord.first_chat, ChatRecord.finish, ChatRecord.error)
+    if compact:
+        stmt = select(*summary_columns)
+    elif with_data:
+        stmt = select(*summary_columns, ChatRecord.sql_answer, ChatRecord.chart_answer, ChatRecord.data,
+                      ChatRecord.predict_data)
+    else:
+        stmt = _reasoning_log_joins(select(*summary_columns, ChatRecord.sql_answer, ChatRecord.chart_answer))
+
+    stmt = stmt.where(and_(ChatRecord.create_by == current_user.id, ChatRecord.chat_id == chart_id))
+    if before:
+        cursor_time = select(ChatRecord.create_time).where(ChatRecord.id == before).scalar_subquery()
+        stmt = stmt.where(or_(ChatRecord.create_time < cursor_time,
+                              and_(ChatRecord.create_time == cursor_time, ChatRecord.id < before)))
+    if limit:
+        # newest records first, one more than asked tells whether an older page exists
+        stmt = stmt.order_by(ChatRecord.create_time.desc(), ChatRecord.id.desc()).limit(limit + 1)
+    else:
+        stmt = stmt.order_by(ChatRecord.create_time)
 
     result = session.execute(stmt).all()
-    record_list: list[ChatRecordResult] = []
-    for row in result:
-        if not with_data:
-            record_list.append(
-                ChatRecordResult(id=row.id, chat_id=row.chat_id, create_time=row.create_time,
-                                 finish_time=row.finish_time,
-                                 question=row.question, sql_answer=row.sql_answer, sql=row.sql,
-                                 chart_answer=row.chart_answer, chart=row.chart,
-                                 analysis=row.analysis, predict=row.predict,
-                                 datasource_select_answer=row.datasource_select_answer,
-                                 analysis_record_id=row.analysis_record_id, predict_record_id=row.predict_record_id,
-                                 regenerate_record_id=row.regenerate_record_id,
-                                 recommended_question=row.recommended_question, first_chat=row.first_chat,
-                                 finish=row.finish, error=row.error,
-                                 sql_reasoning_content=row.sql_reasoning_content,
-                                 chart_reasoning_content=row.chart_reasoning_content,
-                                 analysis_reasoning_content=row.analysis_reasoning_content,
-                                 predict_reasoning_content=row.predict_reasoning_content,
-                                 ))
-        else:
-            record_list.append(
-                ChatRecordResult(id=row.id, chat_id=row.chat_id, create_time=row.create_time,
-                                 finish_time=row.finish_time,
-                                 question=row.question, sql_answer=row.sql_answer, sql=row.sql,
-                                 chart_answer=row.chart_answer, chart=row.chart,
-                                 analysis=row.analysis, predict=row.predict,
-                                 datasource_select_answer=row.datasource_select_answer,
-                                 analysis_record_id=row.analysis_record_id, predict_record_id=row.predict_record_id,
-                                 regenerate_record_id=row.regenerate_record_id,
-                                 recommended_question=row.recommended_question, first_chat=row.first_chat,
-                                 finish=row.finish, error=row.error, data=row.data, predict_data=row.predict_data))
+    if limit:
+        chat_info.has_more = len(result) > limit
+        result = list(reversed(result[:limit]))
+        if chat_info.has_more:
+            chat_info.next_cursor = result[0].id
+    record_list: list[ChatRecordResult] = [ChatRecordResult(**row._mapping) for row in result]
 
     result = list(map(format_record, record_list))
 
+    if compact:
+        for row in result:
+            for key in lazy_record_keys:
+                row.pop(key, None)
     for row in result:
         try:
             data_value = row.get('data')
@@ -362,6 +357,21 @@ def get_chat_with_records(session: SessionDep, chart_id: int, current_user: Curr
     return chat_info
 
 
+def get_chat_record_reasoning(session: SessionDep, current_user: CurrentUser, chat_record_id: int) -> dict:
+    """
+    reasoning content and answers of one record, the part left out of compact chat records
+    """
+    stmt = _reasoning_log_joins(
+        select(ChatRecord.id, ChatRecord.sql_answer, ChatRecord.chart_answer, ChatRecord.analysis,
+               ChatRecord.predict)).where(
+        and_(ChatRecord.id == chat_record_id, ChatRecord.create_by == current_user.id))
+    row = session.execute(stmt).first()
+    if not row:
+        raise Exception(f"Chat record with id {chat_record_id} not found")
+    record = format_record(ChatRecordResult(**row._mapping))
+    return {key: record.get(key) for key in ['id', 'sql_answer', 'chart_answer', 'analysis_thinking', 'predict']}
+
+
 def format_record(record: ChatRecordResult):
     _dict = record.model_dump()
 
@@ -538,8 +548,8 @@ def save_question(session: SessionDep, current_user: CurrentUser, question: Chat
     result = ChatRecord(**record.model_dump())
 
     session.add(record)
+    # the identity id is returned by the insert itself
     session.flush()
-    session.refresh(record)
     result.id = record.id
     session.commit()
 
@@ -566,8 +576,8 @@ def save_analysis_predict_record(session: SessionDep, base_record: ChatRecord, a
     result = ChatRecord(**record.model_dump())
 
     session.add(record)
+    # the identity id is returned by the insert itself
     session.flush()
-    session.refresh(record)
     result.id = record.id
     session.commit()
 
@@ -582,8 +592,8 @@ def start_log(session: SessionDep, ai_modal_id: int, ai_modal_name: str, operate
     result = ChatLog(**log.model_dump())
 
     session.add(log)
+    # the identity id is returned by the insert itself
     session.flush()
-    session.refresh(log)
     result.id = log.id
     session.commit()
 
@@ -879,6 +889,65 @@ def finish_record(session: SessionDep, record_id: int) -> ChatRecord:
     return result
 
 
+class ChatRecordWriter:
+    """
+    collects the chat_record columns and chat_log ends of one chat turn and writes them at flush() with one
+    update per row and a single commit, instead of a select, an update and a commit per saved field.
+    the record passed in is kept up to date, pending values stay queued until a flush succeeds
+    """
+
+    def __init__(self, record: ChatRecord):
+        self.record = record
+        self.changes: dict[str, Any] = {}
+        self.logs: dict[int, dict[str, Any]] = {}
+
+    def set(self, **values):
+        for key, value in values.items():
+            setattr(self.record, key, value)
+        self.changes.update(values)
+
+    def error(self, message: str):
+        self.set(error=message, finish=True, finish_time=datetime.datetime.now())
+
+    def finish(self):
+        self.set(finish=True, finish_time=datetime.datetime.now())
+
+    def end_log(self, log: ChatLog, full_message: list[dict], reasoning_content: str = None,
+                token_usage=None) -> ChatLog:
+        log.messages = full_message
+        log.token_usage = token_usage if token_usage is not None else {}
+        log.finish_time = datetime.datetime.now()
+        log.reasoning_content = reasoning_content if reasoning_content and len(reasoning_content.strip()) > 0 else None
+        self.logs[log.id] = {'messages': log.messages, 'token_usage': log.token_usage,
+                             'finish_time': log.finish_time, 'reasoning_content': log.reasoning_content}
+        return log
+
+    def _write(self, session: SessionDep):
+        if self.changes:
+            session.execute(update(ChatRecord).where(and_(ChatRecord.id == self.record.id)).values(**self.changes))
+        for log_id, values in self.logs.items():
+            session.execute(update(ChatLog).where(and_(ChatLog.id == log_id)).values(**values))
+        session.commit()
+
+    def flush(self, session: SessionDep):
+        if not self.changes and not self.logs:
+            return
+        if not self.record.id:
+            raise Exception("Record id cannot be None")
+        try:
+            self._write(session)
+        except Exception:
+            # the session may still hold a failed statement of the turn, retry once on a clean transaction
+            session.rollback()
+            try:
+                self._write(session)
+            except Exception:
+                session.rollback()
+                raise
+        self.changes = {}
+        self.logs = {}
+
+
 def get_old_questions(session: SessionDep, datasource: int):
     records = []
     if not datasource:
@@ -4,7 +4,7 @@ from typing import List, Optional, Union
 
 from fastapi import Body
 from pydantic import BaseModel
-from sqlalchemy import Column, Integer, Text, BigInteger, DateTime, Identity, Boolean
+from sqlalchemy import Column, Integer, Text, BigInteger, DateTime, Identity, Boolean, Index
 from sqlalchemy import Enum as SQLAlchemyEnum
 from sqlalchemy.dialects.postgresql import JSONB
 from sqlmodel import SQLModel, Field
@@ -58,6 +58,8 @@ class QuickCommand(Enum):
 
 class ChatLog(SQLModel, table=True):
     __tablename__ = "chat_log"
+    # reasoning content of a record is joined by (pid, type, operate)
+    __table_args__ = (Index('ix_chat_log_pid_type_operate', 'pid', 'type', 'operate'),)
     id: Optional[int] = Field(sa_column=Column(BigInteger, Identity(always=True), primary_key=True))
     type: TypeEnum = Field(
         sa_column=Column(SQLAlchemyEnum(TypeEnum, native_enum=False, values_callable=enum_values, length=3)))
@@ -75,6 +77,8 @@ class ChatLog(SQLModel, table=True):
 
 class Chat(SQLModel, table=True):
     __tablename__ = "chat"
+    __table_args__ = (Index('ix_chat_create_by_oid_create_time', 'create_by', 'oid', 'create_time'),
+                      Index('ix_chat_datasource', 'datasource'))
     id: Optional[int] = Field(sa_column=Column(BigInteger, Identity(always=True), primary_key=True))
     oid: Optional[int] = Field(sa_column=Column(BigInteger, nullable=True, default=1))
     create_time: datetime = Field(sa_column=Column(DateTime(timezone=False), nullable=True))
@@ -93,6 +97,9 @@ class Chat(SQLModel, table=True):
 
 class ChatRecord(SQLModel, table=True):
     __tablename__ = "chat_record"
+    # records of a chat and recent questions of a datasource, both ordered by create_time
+    __table_args__ = (Index('ix_chat_record_chat_id_create_time', 'chat_id', 'create_time'),
+                      Index('ix_chat_record_datasource_create_time', 'datasource', 'create_time'))
     id: Optional[int] = Field(sa_column=Column(BigInteger, Identity(always=True), primary_key=True))
     chat_id: int = Field(sa_column=Column(BigInteger, nullable=False))
     ai_modal_id: Optional[int] = Field(sa_column=Column(BigInteger))
@@ -178,6 +185,9 @@ class ChatInfo(BaseModel):
     recommended_question: Optional[str]  = None
     recommended_generate: Optional[bool]  = False
     records: List[ChatRecord | dict] = []
+    # paged records only: older records exist, passed as before to load them
+    has_more: bool = False
+    next_cursor: Optional[int] = None
 
 
 class AiModelQuestion(BaseModel):
@@ -0,0 +1,87 @@
+# Author: Junjun
+# Date: 2025/10/17
+import hashlib
+import re
+import threading
+import time
+from collections import OrderedDict
+from dataclasses import dataclass
+from datetime import date
+from typing import Optional
+
+from common.core.config import settings
+
+
+@dataclass
+class CachedAnswer:
+    sql_answer: str  # full answer of the sql generation, also carries brief and chart type
+    sql: str  # sql after the row permission filter, as executed
+    chart_answer: Optional[str] = None  # full answer of the chart generation, None until a chart was generated
+    store_time: float = 0.0
+
+
+def normalize_question(question: Optional[str]) -> str:
+    question = re.sub(r'\s+', ' ', question or '').strip().lower()
+    return question.rstrip('?？。.!！ ')
+
+
+def answer_cache_key(ds_id: int, question: str, schema_fingerprint: str, permission_fingerprint: str,
+                     model_id) -> tuple:
+    """
+    the prompt carries the current time, so relative dates in a cached sql are only reused on the same day
+    """
+    return (ds_id, normalize_question(question), hashlib.sha256(schema_fingerprint.encode()).hexdigest(),
+            permission_fingerprint, model_id, date.today().isoformat())
+
+
+class AnswerCache:
+    """
+    process-local LRU of generated sql and chart answers, opt-in by CHAT_ANSWER_CACHE_ENABLED.
+    entries expire after CHAT_ANSWER_CACHE_TTL seconds and are dropped per datasource by invalidate()
+    when its tables are synced or its connection changes; schema, prompt and permission edits change the key
+    """
+
+    def __init__(self):
+        self._entries: OrderedDict[tuple, CachedAnswer] = OrderedDict()
+        self._versions: dict[int, int] = {}
+        self._lock = threading.Lock()
+
+    def version(self, ds_id: int) -> int:
+        with self._lock:
+            return self._versions.get(ds_id, 0)
+
+    def get(self, key: tuple) -> Optional[CachedAnswer]:
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None:
+                return None
+            if time.time() - entry.store_time >= settings.CHAT_ANSWER_CACHE_TTL:
+                del self._entries[key]
+                return None
+            self._entries.move_to_end(key)
+            return entry
+
+    def put(self, key: tuple, answer: CachedAnswer, version: int):
+        answer.store_time = time.time()
+        with self._lock:
+            # skip storing an answer that raced with an invalidate
+            if self._versions.get(key[0], 0) != version:
+                return
+            self._entries[key] = answer
+            self._entries.move_to_end(key)
+            while len(self._entries) > settings.CHAT_ANSWER_CACHE_MAX_SIZE:
+                self._entries.popitem(last=False)
+
+    def invalidate(self, ds_id: int):
+        with self._lock:
+            self._versions[ds_id] = self._versions.get(ds_id, 0) + 1
+            for key in [key for key in self._entries if key[0] == ds_id]:
+                del self._entries[key]
+
+
+answer_cache = AnswerCache()
+
+
+def invalidate_answer_cache(ds_ids: list[int]):
+    for ds_id in set(ds_ids):
+        answer_cache.invalidate(ds_id)
@@ -1,4 +1,4 @@
-import concurrent
+import asyncio
 import json
 import os
 import traceback
@@ -6,7 +6,8 @@ import urllib.parse
 import warnings
 from concurrent.futures import ThreadPoolExecutor, Future
 from datetime import datetime
-from typing import Any, List, Optional, Union, Dict, Iterator
+from functools import partial
+from typing import Any, Callable, List, Optional, Union, Dict, AsyncIterator
 
 import orjson
 import pandas as pd
@@ -16,30 +17,32 @@ from langchain.chat_models.base import BaseChatModel
 from langchain_community.utilities import SQLDatabase
 from langchain_core.messages import BaseMessage, SystemMessage, HumanMessage, AIMessage, BaseMessageChunk
 from sqlalchemy import and_, select
-from sqlalchemy.orm import sessionmaker, scoped_session
 from sqlbot_xpack.config.model import SysArgModel
 from sqlbot_xpack.custom_prompt.curd.custom_prompt import find_custom_prompts
 from sqlbot_xpack.custom_prompt.models.custom_prompt_model import CustomPromptTypeEnum
 from sqlbot_xpack.license.license_manage import SQLBotLicenseUtil
 from sqlmodel import Session
 
-from apps.ai_model.model_factory import LLMConfig, LLMFactory, get_default_config
-from apps.chat.curd.chat import save_question, save_sql_answer, save_sql, \
-    save_error_message, save_sql_exec_data, save_chart_answer, save_chart, \
-    finish_record, save_analysis_answer, save_predict_answer, save_predict_data, \
-    save_select_datasource_answer, save_recommend_question_answer, \
+from apps.ai_model.model_factory import LLMConfig, get_default_config, llm_registry
+from apps.chat.curd.chat import save_question, ChatRecordWriter, save_recommend_question_answer, \
     get_old_questions, save_analysis_predict_record, rename_chat, get_chart_config, \
     get_chat_chart_data, list_generate_sql_logs, list_generate_chart_logs, start_log, end_log, \
     get_last_execute_sql_error, format_json_data, format_chart_fields, get_chat_brief_generate, get_chat_predict_data, \
     get_chat_chart_config
 from apps.chat.models.chat_model import ChatQuestion, ChatRecord, Chat, RenameChat, ChatLog, OperationEnum, \
-    ChatFinishStep, AxisObj
+    ChatFinishStep
+from apps.chat.task.answer_cache import CachedAnswer, answer_cache, answer_cache_key
+from apps.chat.task.prepare import PrepareStep, run_prepare_steps
+from apps.chat.task.stream_channel import StreamChannel
+from apps.chat.task.stream_parser import aprocess_stream, coalesce_chunks
 from apps.data_training.curd.data_training import get_training_template
 from apps.datasource.crud.datasource import get_table_schema
-from apps.datasource.crud.permission import get_row_permission_filters, is_normal_user
+from apps.datasource.crud.permission import get_row_permission_filters, is_normal_user, \
+    get_permission_fingerprint
 from apps.datasource.embedding.ds_embedding import get_ds_embedding
 from apps.datasource.models.datasource import CoreDatasource
-from apps.db.db import exec_sql, get_version, check_connection
+from apps.db.db import exec_sql_result, get_cached_version, check_cached_connection
+from apps.db.result import ColumnarResult
 from apps.system.crud.assistant import AssistantOutDs, AssistantOutDsFactory, get_assistant_ds
 from apps.system.crud.parameter_manage import get_groups
 from apps.system.schemas.system_schema import AssistantOutDsSchema
@@ -50,7 +53,7 @@ from common.core.deps import CurrentAssistant, CurrentUser
 from common.error import SingleMessageError, SQLBotDBError, ParseSQLResultError, SQLBotDBConnectionError
 from common.utils.data_format import DataFormat
 from common.utils.locale import I18n, I18nHelper
-from common.utils.utils import SQLBotLogUtil, extract_nested_json, prepare_for_orjson
+from common.utils.utils import SQLBotLogUtil, extract_nested_json
 
 warnings.filterwarnings("ignore")
 
@@ -58,11 +61,12 @@ base_message_count_limit = 6
 
 executor = ThreadPoolExecutor(max_workers=200)
 
+# blocking steps of chat tasks running on the event loop, see LLMService.run_blocking
+db_executor = ThreadPoolExecutor(max_workers=settings.CHAT_DB_WORKERS, thread_name_prefix='chat-db')
+
 dynamic_ds_types = [1, 3]
 dynamic_subsql_prefix = 'select * from sqlbot_dynamic_temp_table_'
 
-session_maker = scoped_session(sessionmaker(bind=engine, class_=Session))
-
 i18n = I18n()
 
 
@@ -86,8 +90,12 @@ class LLMService:
 
     current_logs: dict[OperationEnum, ChatLog] = {}
 
-    chunk_list: List[str] = []
+    channel: Optional[StreamChannel] = None
     future: Future
+    # task generator consumed directly by the response when CHAT_ASYNC_PIPELINE_ENABLED
+    pipeline: Optional[AsyncIterator[Any]] = None
+    # blocking steps run inline while the task has a worker thread of its own
+    inline_blocking: bool = True
 
     trans: I18nHelper = None
 
@@ -96,16 +104,28 @@ class LLMService:
 
     enable_sql_row_limit: bool = settings.GENERATE_SQL_QUERY_LIMIT_ENABLED
 
+    # seconds per prompt assembly step, see run_prepare_steps
+    prepare_timings: dict[str, float] = {}
+
     def __init__(self, session: Session, current_user: CurrentUser, chat_question: ChatQuestion,
                  current_assistant: Optional[CurrentAssistant] = None, no_reasoning: bool = False,
                  embedding: bool = False, config: LLMConfig = None):
-        self.chunk_list = []
+        self.channel = None
+        self.pipeline = None
         self.current_user = current_user
         self.current_assistant = current_assistant
         chat_id = chat_question.chat_id
         chat: Chat | None = session.get(Chat, chat_id)
         if not chat:
             raise SingleMessageError(f"Chat with id {chat_id} not found")
+
+        # independent lookups run concurrently, each with its own session
+        steps = [
+            PrepareStep('sql_logs', lambda _session: list_generate_sql_logs(session=_session, chart_id=chat_id)),
+            PrepareStep('chart_logs', lambda _session: list_generate_chart_logs(session=_session, chart_id=chat_id)),
+            PrepareStep('brief_generate', lambda _session: get_chat_brief_generate(session=_session, chat_id=chat_id)),
+            PrepareStep('last_execute_sql_error', lambda _session: get_last_execute_sql_error(_session, chat_id)),
+        ]
         ds: CoreDatasource | AssistantOutDsSchema | None = None
         if chat.datasource:
             # Get available datasource
@@ -114,20 +134,30 @@ class LLMService:
                 ds = self.out_ds_instance.get_ds(chat.datasource)
                 if not ds:
                     raise SingleMessageError("No available datasource configuration found")
-                chat_question.engine = ds.type + get_version(ds)
-                chat_question.db_schema = self.out_ds_instance.get_db_schema(ds.id, chat_question.question)
+                steps.append(PrepareStep('version', lambda: get_cached_version(ds), session=False))
+                steps.append(PrepareStep('db_schema', lambda: self.out_ds_instance.get_db_schema(
+                    ds.id, chat_question.question), session=False))
             else:
                 ds = session.get(CoreDatasource, chat.datasource)
                 if not ds:
                     raise SingleMessageError("No available datasource configuration found")
-                chat_question.engine = (ds.type_name if ds.type != 'excel' else 'PostgreSQL') + get_version(ds)
-                chat_question.db_schema = get_table_schema(session=session, current_user=current_user, ds=ds,
-                                                           question=chat_question.question, embedding=embedding)
+                steps.append(PrepareStep('version', lambda: get_cached_version(ds), session=False))
+                steps.append(PrepareStep('db_schema', lambda _session: get_table_schema(
+                    session=_session, current_user=current_user, ds=ds, question=chat_question.question,
+                    embedding=embedding)))
+        results, self.prepare_timings = run_prepare_steps(steps)
+
+        if ds:
+            if self.out_ds_instance:
+                chat_question.engine = ds.type + results['version']
+            else:
+                chat_question.engine = (ds.type_name if ds.type != 'excel' else 'PostgreSQL') + results['version']
+            chat_question.db_schema = results['db_schema']
 
-        self.generate_sql_logs = list_generate_sql_logs(session=session, chart_id=chat_id)
-        self.generate_chart_logs = list_generate_chart_logs(session=session, chart_id=chat_id)
+        self.generate_sql_logs = results['sql_logs']
+        self.generate_chart_logs = results['chart_logs']
 
-        self.change_title = not get_chat_brief_generate(session=session, chat_id=chat_id)
+        self.change_title = not results['brief_generate']
 
         chat_question.lang = get_lang_name(current_user.language)
         self.trans = i18n(lang=current_user.language)
@@ -135,23 +165,24 @@ class LLMService:
         self.ds = (
             ds if isinstance(ds, AssistantOutDsSchema) else CoreDatasource(**ds.model_dump())) if ds else None
         self.chat_question = chat_question
-        self.config = config
         if no_reasoning:
-            # only work while using qwen
-            if self.config.additional_params:
-                if self.config.additional_params.get('extra_body'):
-                    if self.config.additional_params.get('extra_body').get('enable_thinking'):
-                        del self.config.additional_params['extra_body']['enable_thinking']
+            # only work while using qwen, the default config is cached and shared, change a copy of it
+            extra_body = (config.additional_params or {}).get('extra_body')
+            if extra_body and extra_body.get('enable_thinking'):
+                extra_body = {k: v for k, v in extra_body.items() if k != 'enable_thinking'}
+                config = config.model_copy(
+                    update={'additional_params': {**config.additional_params, 'extra_body': extra_body}})
+        self.config = config
 
         self.chat_question.ai_modal_id = self.config.model_id
         self.chat_question.ai_modal_name = self.config.model_name
 
-        # Create LLM instance through factory
-        llm_instance = LLMFactory.create_llm(self.config)
+        # reuse the client of this config, with its http connection pool
+        llm_instance = llm_registry.get_llm(self.config)
         self.llm = llm_instance.llm
 
         # get last_execute_sql_error
-        last_execute_sql_error = get_last_execute_sql_error(session, self.chat_question.chat_id)
+        last_execute_sql_error = results['last_execute_sql_error']
         if last_execute_sql_error:
             self.chat_question.error_msg = f'''<error-msg>
 {last_execute_sql_error}
@@ -162,7 +193,9 @@ class LLMService:
     @classmethod
     async def create(cls, *args, **kwargs):
         config: LLMConfig = await get_default_config()
-        instance = cls(*args, **kwargs, config=config)
+        # the constructor queries history, schema and datasource version, keep it off the event loop
+        instance = await asyncio.get_running_loop().run_in_executor(db_executor,
+                                                                    partial(cls, *args, **kwargs, config=config))
 
         chat_params: list[SysArgModel] = await get_groups(args[0], "chat")
         for config in chat_params:
@@ -173,16 +206,6 @@ class LLMService:
                     instance.enable_sql_row_limit = False
         return instance
 
-    def is_running(self, timeout=0.5):
-        try:
-            r = concurrent.futures.wait([self.future], timeout)
-            if len(r.not_done) > 0:
-                return True
-            else:
-                return False
-        except Exception as e:
-            return True
-
     def init_messages(self):
         last_sql_messages: List[dict[str, Any]] = self.generate_sql_logs[-1].messages if len(
             self.generate_sql_logs) > 0 else []
@@ -229,7 +252,7 @@ class LLMService:
                     self.chart_message.append(_msg)
 
     def init_record(self, session: Session) -> ChatRecord:
-        self.record = save_question(session=session, current_user=self.current_user, question=self.chat_question)
+        self.set_record(save_question(session=session, current_user=self.current_user, question=self.chat_question))
         return self.record
 
     def get_record(self):
@@ -237,6 +260,8 @@ class LLMService:
 
     def set_record(self, record: ChatRecord):
         self.record = record
+        # answers, results and log ends of this turn are queued and written at the stage boundaries
+        self.record_writer = ChatRecordWriter(record)
 
     def set_articles_number(self, articles_number: int):
         self.articles_number = articles_number
@@ -245,12 +270,11 @@ class LLMService:
         chart_info = get_chart_config(_session, self.record.id)
         return format_chart_fields(chart_info)
 
-    def generate_analysis(self, _session: Session):
+    def prepare_analysis(self, _session: Session):
         fields = self.get_fields_from_chart(_session)
         self.chat_question.fields = orjson.dumps(fields).decode()
         data = get_chat_chart_data(_session, self.record.id)
         self.chat_question.data = orjson.dumps(data.get('data')).decode()
-        analysis_msg: List[Union[BaseMessage, dict[str, Any]]] = []
 
         ds_id = self.ds.id if isinstance(self.ds, CoreDatasource) else None
         self.chat_question.terminologies = get_terminology_template(_session, self.chat_question.question,
@@ -259,24 +283,22 @@ class LLMService:
             self.chat_question.custom_prompt = find_custom_prompts(_session, CustomPromptTypeEnum.ANALYSIS,
                                                                    self.current_user.oid, ds_id)
 
+    async def generate_analysis(self, _session: Session):
+        await self.run_blocking(self.prepare_analysis, _session)
+        analysis_msg: List[Union[BaseMessage, dict[str, Any]]] = []
+
         analysis_msg.append(SystemMessage(content=self.chat_question.analysis_sys_question()))
         analysis_msg.append(HumanMessage(content=self.chat_question.analysis_user_question()))
 
-        self.current_logs[OperationEnum.ANALYSIS] = start_log(session=_session,
-                                                              ai_modal_id=self.chat_question.ai_modal_id,
-                                                              ai_modal_name=self.chat_question.ai_modal_name,
-                                                              operate=OperationEnum.ANALYSIS,
-                                                              record_id=self.record.id,
-                                                              full_message=[
-                                                                  {'type': msg.type,
-                                                                   'content': msg.content} for
-                                                                  msg
-                                                                  in analysis_msg])
+        self.current_logs[OperationEnum.ANALYSIS] = await self.run_blocking(
+            start_log, session=_session, ai_modal_id=self.chat_question.ai_modal_id,
+            ai_modal_name=self.chat_question.ai_modal_name, operate=OperationEnum.ANALYSIS, record_id=self.record.id,
+            full_message=[{'type': msg.type, 'content': msg.content} for msg in analysis_msg])
         full_thinking_text = ''
         full_analysis_text = ''
         token_usage = {}
-        res = process_stream(self.llm.stream(analysis_msg), token_usage)
-        for chunk in res:
+        res = self.stream_answer(analysis_msg, token_usage)
+        async for chunk in res:
             if chunk.get('content'):
                 full_analysis_text += chunk.get('content')
             if chunk.get('reasoning_content'):
@@ -285,19 +307,13 @@ class LLMService:
 
         analysis_msg.append(AIMessage(full_analysis_text))
 
-        self.current_logs[OperationEnum.ANALYSIS] = end_log(session=_session,
-                                                            log=self.current_logs[
-                                                                OperationEnum.ANALYSIS],
-                                                            full_message=[
-                                                                {'type': msg.type,
-                                                                 'content': msg.content}
-                                                                for msg in analysis_msg],
-                                                            reasoning_content=full_thinking_text,
-                                                            token_usage=token_usage)
-        self.record = save_analysis_answer(session=_session, record_id=self.record.id,
-                                           answer=orjson.dumps({'content': full_analysis_text}).decode())
-
-    def generate_predict(self, _session: Session):
+        self.current_logs[OperationEnum.ANALYSIS] = self.record_writer.end_log(
+            log=self.current_logs[OperationEnum.ANALYSIS],
+            full_message=[{'type': msg.type, 'content': msg.content} for msg in analysis_msg],
+            reasoning_content=full_thinking_text, token_usage=token_usage)
+        self.record_writer.set(analysis=orjson.dumps({'content': full_analysis_text}).decode())
+
+    def prepare_predict(self, _session: Session):
         fields = self.get_fields_from_chart(_session)
         self.chat_question.fields = orjson.dumps(fields).decode()
         data = get_chat_chart_data(_session, self.record.id)
@@ -308,25 +324,22 @@ class LLMService:
             self.chat_question.custom_prompt = find_custom_prompts(_session, CustomPromptTypeEnum.PREDICT_DATA,
                                                                    self.current_user.oid, ds_id)
 
+    async def generate_predict(self, _session: Session):
+        await self.run_blocking(self.prepare_predict, _session)
+
         predict_msg: List[Union[BaseMessage, dict[str, Any]]] = []
         predict_msg.append(SystemMessage(content=self.chat_question.predict_sys_question()))
         predict_msg.append(HumanMessage(content=self.chat_question.predict_user_question()))
 
-        self.current_logs[OperationEnum.PREDICT_DATA] = start_log(session=_session,
-                                                                  ai_modal_id=self.chat_question.ai_modal_id,
-                                                                  ai_modal_name=self.chat_question.ai_modal_name,
-                                                                  operate=OperationEnum.PREDICT_DATA,
-                                                                  record_id=self.record.id,
-                                                                  full_message=[
-                                                                      {'type': msg.type,
-                                                                       'content': msg.content} for
-                                                                      msg
-                                                                      in predict_msg])
+        self.current_logs[OperationEnum.PREDICT_DATA] = await self.run_blocking(
+            start_log, session=_session, ai_modal_id=self.chat_question.ai_modal_id,
+            ai_modal_name=self.chat_question.ai_modal_name, operate=OperationEnum.PREDICT_DATA,
+            record_id=self.record.id, full_message=[{'type': msg.type, 'content': msg.content} for msg in predict_msg])
         full_thinking_text = ''
         full_predict_text = ''
         token_usage = {}
-        res = process_stream(self.llm.stream(predict_msg), token_usage)
-        for chunk in res:
+        res = self.stream_answer(predict_msg, token_usage)
+        async for chunk in res:
             if chunk.get('content'):
                 full_predict_text += chunk.get('content')
             if chunk.get('reasoning_content'):
@@ -334,20 +347,13 @@ class LLMService:
             yield chunk
 
         predict_msg.append(AIMessage(full_predict_text))
-        self.record = save_predict_answer(session=_session, record_id=self.record.id,
-                                          answer=orjson.dumps({'content': full_predict_text}).decode())
-        self.current_logs[OperationEnum.PREDICT_DATA] = end_log(session=_session,
-                                                                log=self.current_logs[
-                                                                    OperationEnum.PREDICT_DATA],
-                                                                full_message=[
-                                                                    {'type': msg.type,
-                                                                     'content': msg.content}
-                                                                    for msg in predict_msg],
-                                                                reasoning_content=full_thinking_text,
-                                                                token_usage=token_usage)
-
-    def generate_recommend_questions_task(self, _session: Session):
+        self.record_writer.set(predict=orjson.dumps({'content': full_predict_text}).decode())
+        self.current_logs[OperationEnum.PREDICT_DATA] = self.record_writer.end_log(
+            log=self.current_logs[OperationEnum.PREDICT_DATA],
+            full_message=[{'type': msg.type, 'content': msg.content} for msg in predict_msg],
+            reasoning_content=full_thinking_text, token_usage=token_usage)
 
+    def prepare_recommend_questions(self, _session: Session) -> list[str]:
         # get schema
         if self.ds and not self.chat_question.db_schema:
             self.chat_question.db_schema = self.out_ds_instance.get_db_schema(
@@ -357,28 +363,26 @@ class LLMService:
                 question=self.chat_question.question,
                 embedding=False)
 
+        return list(map(lambda q: q.strip(), get_old_questions(_session, self.record.datasource)))
+
+    async def generate_recommend_questions_task(self, _session: Session):
+        old_questions = await self.run_blocking(self.prepare_recommend_questions, _session)
+
         guess_msg: List[Union[BaseMessage, dict[str, Any]]] = []
         guess_msg.append(SystemMessage(content=self.chat_question.guess_sys_question(self.articles_number)))
 
-        old_questions = list(map(lambda q: q.strip(), get_old_questions(_session, self.record.datasource)))
         guess_msg.append(
             HumanMessage(content=self.chat_question.guess_user_question(orjson.dumps(old_questions).decode())))
 
-        self.current_logs[OperationEnum.GENERATE_RECOMMENDED_QUESTIONS] = start_log(session=_session,
-                                                                                    ai_modal_id=self.chat_question.ai_modal_id,
-                                                                                    ai_modal_name=self.chat_question.ai_modal_name,
-                                                                                    operate=OperationEnum.GENERATE_RECOMMENDED_QUESTIONS,
-                                                                                    record_id=self.record.id,
-                                                                                    full_message=[
-                                                                                        {'type': msg.type,
-                                                                                         'content': msg.content} for
-                                                                                        msg
-                                                                                        in guess_msg])
+        self.current_logs[OperationEnum.GENERATE_RECOMMENDED_QUESTIONS] = await self.run_blocking(
+            start_log, session=_session, ai_modal_id=self.chat_question.ai_modal_id,
+            ai_modal_name=self.chat_question.ai_modal_name, operate=OperationEnum.GENERATE_RECOMMENDED_QUESTIONS,
+            record_id=self.record.id, full_message=[{'type': msg.type, 'content': msg.content} for msg in guess_msg])
         full_thinking_text = ''
         full_guess_text = ''
         token_usage = {}
-        res = process_stream(self.llm.stream(guess_msg), token_usage)
-        for chunk in res:
+        res = self.stream_answer(guess_msg, token_usage)
+        async for chunk in res:
             if chunk.get('content'):
                 full_guess_text += chunk.get('content')
             if chunk.get('reasoning_content'):
@@ -387,23 +391,17 @@ class LLMService:
 
         guess_msg.append(AIMessage(full_guess_text))
 
-        self.current_logs[OperationEnum.GENERATE_RECOMMENDED_QUESTIONS] = end_log(session=_session,
-                                                                                  log=self.current_logs[
-                                                                                      OperationEnum.GENERATE_RECOMMENDED_QUESTIONS],
-                                                                                  full_message=[
-                                                                                      {'type': msg.type,
-                                                                                       'content': msg.content}
-                                                                                      for msg in guess_msg],
-                                                                                  reasoning_content=full_thinking_text,
-                                                                                  token_usage=token_usage)
-        self.record = save_recommend_question_answer(session=_session, record_id=self.record.id,
-                                                     answer={'content': full_guess_text}, articles_number=self.articles_number)
+        self.current_logs[OperationEnum.GENERATE_RECOMMENDED_QUESTIONS] = await self.run_blocking(
+            end_log, session=_session, log=self.current_logs[OperationEnum.GENERATE_RECOMMENDED_QUESTIONS],
+            full_message=[{'type': msg.type, 'content': msg.content} for msg in guess_msg],
+            reasoning_content=full_thinking_text, token_usage=token_usage)
+        self.record = await self.run_blocking(
+            save_recommend_question_answer, session=_session, record_id=self.record.id,
+            answer={'content': full_guess_text}, articles_number=self.articles_number)
 
         yield {'recommended_question': self.record.recommended_question}
 
-    def select_datasource(self, _session: Session):
-        datasource_msg: List[Union[BaseMessage, dict[str, Any]]] = []
-        datasource_msg.append(SystemMessage(self.chat_question.datasource_sys_question()))
+    def list_datasource_candidates(self, _session: Session) -> tuple[list, bool]:
         if self.current_assistant and self.current_assistant.type != 4:
             _ds_list = get_assistant_ds(session=_session, llm_service=self)
         else:
@@ -421,35 +419,38 @@ class LLMService:
             raise SingleMessageError('No available datasource configuration found')
         ignore_auto_select = _ds_list and len(_ds_list) == 1
         # ignore auto select ds
-
-        full_thinking_text = ''
-        full_text = ''
         if not ignore_auto_select:
             if settings.TABLE_EMBEDDING_ENABLED and (
                     not self.current_assistant or (self.current_assistant and self.current_assistant.type != 1)):
                 _ds_list = get_ds_embedding(_session, self.current_user, _ds_list, self.out_ds_instance,
                                             self.chat_question.question, self.current_assistant)
                 # yield {'content': '{"id":' + str(ds.get('id')) + '}'}
+        return _ds_list, ignore_auto_select
 
+    async def select_datasource(self, _session: Session):
+        datasource_msg: List[Union[BaseMessage, dict[str, Any]]] = []
+        datasource_msg.append(SystemMessage(self.chat_question.datasource_sys_question()))
+        _ds_list, ignore_auto_select = await self.run_blocking(self.list_datasource_candidates, _session)
+
+        full_thinking_text = ''
+        full_text = ''
+        ds = None
+        if not ignore_auto_select:
             _ds_list_dict = []
             for _ds in _ds_list:
                 _ds_list_dict.append(_ds)
             datasource_msg.append(
                 HumanMessage(self.chat_question.datasource_user_question(orjson.dumps(_ds_list_dict).decode())))
 
-            self.current_logs[OperationEnum.CHOOSE_DATASOURCE] = start_log(session=_session,
-                                                                           ai_modal_id=self.chat_question.ai_modal_id,
-                                                                           ai_modal_name=self.chat_question.ai_modal_name,
-                                                                           operate=OperationEnum.CHOOSE_DATASOURCE,
-                                                                           record_id=self.record.id,
-                                                                           full_message=[{'type': msg.type,
-                                                                                          'content': msg.content}
-                                                                                         for
-                                                                                         msg in datasource_msg])
+            self.current_logs[OperationEnum.CHOOSE_DATASOURCE] = await self.run_blocking(
+                start_log, session=_session, ai_modal_id=self.chat_question.ai_modal_id,
+                ai_modal_name=self.chat_question.ai_modal_name, operate=OperationEnum.CHOOSE_DATASOURCE,
+                record_id=self.record.id,
+                full_message=[{'type': msg.type, 'content': msg.content} for msg in datasource_msg])
 
             token_usage = {}
-            res = process_stream(self.llm.stream(datasource_msg), token_usage)
-            for chunk in res:
+            res = self.stream_answer(datasource_msg, token_usage)
+            async for chunk in res:
                 if chunk.get('content'):
                     full_text += chunk.get('content')
                 if chunk.get('reasoning_content'):
@@ -457,26 +458,37 @@ class LLMService:
                 yield chunk
             datasource_msg.append(AIMessage(full_text))
 
-            self.current_logs[OperationEnum.CHOOSE_DATASOURCE] = end_log(session=_session,
-                                                                         log=self.current_logs[
-                                                                             OperationEnum.CHOOSE_DATASOURCE],
-                                                                         full_message=[
-                                                                             {'type': msg.type,
-                                                                              'content': msg.content}
-                                                                             for msg in datasource_msg],
-                                                                         reasoning_content=full_thinking_text,
-                                                                         token_usage=token_usage)
+            self.current_logs[OperationEnum.CHOOSE_DATASOURCE] = self.record_writer.end_log(
+                log=self.current_logs[OperationEnum.CHOOSE_DATASOURCE],
+                full_message=[{'type': msg.type, 'content': msg.content} for msg in datasource_msg],
+                reasoning_content=full_thinking_text, token_usage=token_usage)
 
             json_str = extract_nested_json(full_text)
             if json_str is None:
                 raise SingleMessageError(f'Cannot parse datasource from answer: {full_text}')
             ds = orjson.loads(json_str)
 
+        data: dict = _ds_list[0] if ignore_auto_select else ds
+        _datasource, _engine_type, _error = await self.run_blocking(self.use_datasource, _session, data)
+
+        if not ignore_auto_select and not settings.TABLE_EMBEDDING_ENABLED:
+            self.record_writer.set(datasource_select_answer=orjson.dumps({'content': full_text}).decode())
+            if _datasource:
+                self.record_writer.set(datasource=_datasource, engine_type=_engine_type)
+        if self.ds:
+            await self.run_blocking(self.prepare_sql_prompt, _session)
+
+        if _error:
+            raise _error
+
+    def use_datasource(self, _session: Session, data: dict) -> tuple[Optional[int], Optional[str], Optional[Exception]]:
+        """
+        switch the chat to the datasource chosen by select_datasource, returns its id, engine type and the error if any
+        """
         _error: Exception | None = None
         _datasource: int | None = None
         _engine_type: str | None = None
         try:
-            data: dict = _ds_list[0] if ignore_auto_select else ds
 
             if data.get('id') and data.get('id') != 0:
                 _datasource = data['id']
@@ -485,7 +497,7 @@ class LLMService:
                 if self.current_assistant and self.current_assistant.type in dynamic_ds_types:
                     _ds = self.out_ds_instance.get_ds(data['id'])
                     self.ds = _ds
-                    self.chat_question.engine = _ds.type + get_version(self.ds)
+                    self.chat_question.engine = _ds.type + get_cached_version(self.ds)
                     self.chat_question.db_schema = self.out_ds_instance.get_db_schema(self.ds.id,
                                                                                       self.chat_question.question)
                     _engine_type = self.chat_question.engine
@@ -496,8 +508,8 @@ class LLMService:
                         _datasource = None
                         raise SingleMessageError(f"Datasource configuration with id {_datasource} not found")
                     self.ds = CoreDatasource(**_ds.model_dump())
-                    self.chat_question.engine = (_ds.type_name if _ds.type != 'excel' else 'PostgreSQL') + get_version(
-                        self.ds)
+                    self.chat_question.engine = (_ds.type_name if _ds.type != 'excel' else 'PostgreSQL') + \
+                                                get_cached_version(self.ds)
                     self.chat_question.db_schema = get_table_schema(session=_session,
                                                                     current_user=self.current_user, ds=self.ds,
                                                                     question=self.chat_question.question)
@@ -522,52 +534,68 @@ class LLMService:
 
         except Exception as e:
             _error = e
+        return _datasource, _engine_type, _error
 
-        if not ignore_auto_select and not settings.TABLE_EMBEDDING_ENABLED:
-            self.record = save_select_datasource_answer(session=_session, record_id=self.record.id,
-                                                        answer=orjson.dumps({'content': full_text}).decode(),
-                                                        datasource=_datasource,
-                                                        engine_type=_engine_type)
-        if self.ds:
-            oid = self.ds.oid if isinstance(self.ds, CoreDatasource) else 1
-            ds_id = self.ds.id if isinstance(self.ds, CoreDatasource) else None
-
-            self.chat_question.terminologies = get_terminology_template(_session, self.chat_question.question, oid,
-                                                                        ds_id)
-            if self.current_assistant and self.current_assistant.type == 1:
-                self.chat_question.data_training = get_training_template(_session, self.chat_question.question,
-                                                                         oid, None, self.current_assistant.id)
-            else:
-                self.chat_question.data_training = get_training_template(_session, self.chat_question.question,
-                                                                         oid, ds_id)
-            if SQLBotLicenseUtil.valid():
-                self.chat_question.custom_prompt = find_custom_prompts(_session, CustomPromptTypeEnum.GENERATE_SQL,
-                                                                       oid, ds_id)
+    def prepare_sql_prompt(self, _session: Session):
+        oid = self.ds.oid if isinstance(self.ds, CoreDatasource) else 1
+        ds_id = self.ds.id if isinstance(self.ds, CoreDatasource) else None
 
-            self.init_messages()
+        self.chat_question.terminologies = get_terminology_template(_session, self.chat_question.question, oid,
+                                                                    ds_id)
+        if self.current_assistant and self.current_assistant.type == 1:
+            self.chat_question.data_training = get_training_template(_session, self.chat_question.question,
+                                                                     oid, None, self.current_assistant.id)
+        else:
+            self.chat_question.data_training = get_training_template(_session, self.chat_question.question,
+                                                                     oid, ds_id)
+        if SQLBotLicenseUtil.valid():
+            self.chat_question.custom_prompt = find_custom_prompts(_session, CustomPromptTypeEnum.GENERATE_SQL,
+                                                                   oid, ds_id)
 
-        if _error:
-            raise _error
+        self.init_messages()
 
-    def generate_sql(self, _session: Session):
+    def get_answer_cache_key(self, _session: Session) -> Optional[tuple]:
+        """
+        key of the current question in the answer cache, None when the answer depends on more than the question
+        and the prompt: follow-up questions, regenerate, retry after an error or datasources of an assistant
+        """
+        if not settings.CHAT_ANSWER_CACHE_ENABLED or not isinstance(self.ds, CoreDatasource):
+            return None
+        if len(self.sql_message) > 1 or self.chat_question.regenerate_record_id or self.chat_question.error_msg:
+            return None
+        if self.current_assistant and self.current_assistant.type in dynamic_ds_types:
+            return None
+        if (not self.current_assistant or self.current_assistant.type == 4) and is_normal_user(self.current_user):
+            permission_fingerprint = get_permission_fingerprint(_session, self.current_user, self.ds, 'row')
+        else:
+            permission_fingerprint = 'none'
+        schema_fingerprint = '\n'.join(
+            str(item) for item in [self.chat_question.engine, self.chat_question.db_schema,
+                                   self.chat_question.terminologies, self.chat_question.data_training,
+                                   self.chat_question.custom_prompt, self.chat_question.lang,
+                                   self.enable_sql_row_limit])
+        return answer_cache_key(self.ds.id, self.chat_question.question, schema_fingerprint, permission_fingerprint,
+                                self.config.model_id)
+
+    async def generate_sql(self, _session: Session, cached_answer: Optional[str] = None):
         # append current question
         self.sql_message.append(HumanMessage(
             self.chat_question.sql_user_question(current_time=datetime.now().strftime('%Y-%m-%d %H:%M:%S'),
                                                  change_title=self.change_title)))
 
-        self.current_logs[OperationEnum.GENERATE_SQL] = start_log(session=_session,
-                                                                  ai_modal_id=self.chat_question.ai_modal_id,
-                                                                  ai_modal_name=self.chat_question.ai_modal_name,
-                                                                  operate=OperationEnum.GENERATE_SQL,
-                                                                  record_id=self.record.id,
-                                                                  full_message=[
-                                                                      {'type': msg.type, 'content': msg.content} for msg
-                                                                      in self.sql_message])
+        self.current_logs[OperationEnum.GENERATE_SQL] = await self.run_blocking(
+            start_log, session=_session, ai_modal_id=self.chat_question.ai_modal_id,
+            ai_modal_name=self.chat_question.ai_modal_name, operate=OperationEnum.GENERATE_SQL,
+            record_id=self.record.id,
+            full_message=[{'type': msg.type, 'content': msg.content} for msg in self.sql_message])
         full_thinking_text = ''
         full_sql_text = ''
         token_usage = {}
-        res = process_stream(self.llm.stream(self.sql_message), token_usage)
-        for chunk in res:
+        if cached_answer is not None:
+            res = replay_answer(cached_answer)
+        else:
+            res = self.stream_answer(self.sql_message, token_usage)
+        async for chunk in res:
             if chunk.get('content'):
                 full_sql_text += chunk.get('content')
             if chunk.get('reasoning_content'):
@@ -576,16 +604,13 @@ class LLMService:
 
         self.sql_message.append(AIMessage(full_sql_text))
 
-        self.current_logs[OperationEnum.GENERATE_SQL] = end_log(session=_session,
-                                                                log=self.current_logs[OperationEnum.GENERATE_SQL],
-                                                                full_message=[{'type': msg.type, 'content': msg.content}
-                                                                              for msg in self.sql_message],
-                                                                reasoning_content=full_thinking_text,
-                                                                token_usage=token_usage)
-        self.record = save_sql_answer(session=_session, record_id=self.record.id,
-                                      answer=orjson.dumps({'content': full_sql_text}).decode())
+        self.current_logs[OperationEnum.GENERATE_SQL] = self.record_writer.end_log(
+            log=self.current_logs[OperationEnum.GENERATE_SQL],
+            full_message=[{'type': msg.type, 'content': msg.content} for msg in self.sql_message],
+            reasoning_content=full_thinking_text, token_usage=token_usage)
+        self.record_writer.set(sql_answer=orjson.dumps({'content': full_sql_text}).decode())
 
-    def generate_with_sub_sql(self, session: Session, sql, sub_mappings: list):
+    async def generate_with_sub_sql(self, session: Session, sql, sub_mappings: list):
         sub_query = json.dumps(sub_mappings, ensure_ascii=False)
         self.chat_question.sql = sql
         self.chat_question.sub_query = sub_query
@@ -593,21 +618,17 @@ class LLMService:
         dynamic_sql_msg.append(SystemMessage(content=self.chat_question.dynamic_sys_question()))
         dynamic_sql_msg.append(HumanMessage(content=self.chat_question.dynamic_user_question()))
 
-        self.current_logs[OperationEnum.GENERATE_DYNAMIC_SQL] = start_log(session=session,
-                                                                          ai_modal_id=self.chat_question.ai_modal_id,
-                                                                          ai_modal_name=self.chat_question.ai_modal_name,
-                                                                          operate=OperationEnum.GENERATE_DYNAMIC_SQL,
-                                                                          record_id=self.record.id,
-                                                                          full_message=[{'type': msg.type,
-                                                                                         'content': msg.content}
-                                                                                        for
-                                                                                        msg in dynamic_sql_msg])
+        self.current_logs[OperationEnum.GENERATE_DYNAMIC_SQL] = await self.run_blocking(
+            start_log, session=session, ai_modal_id=self.chat_question.ai_modal_id,
+            ai_modal_name=self.chat_question.ai_modal_name, operate=OperationEnum.GENERATE_DYNAMIC_SQL,
+            record_id=self.record.id,
+            full_message=[{'type': msg.type, 'content': msg.content} for msg in dynamic_sql_msg])
 
         full_thinking_text = ''
         full_dynamic_text = ''
         token_usage = {}
-        res = process_stream(self.llm.stream(dynamic_sql_msg), token_usage)
-        for chunk in res:
+        res = aprocess_stream(self.stream_llm(dynamic_sql_msg), token_usage)
+        async for chunk in res:
             if chunk.get('content'):
                 full_dynamic_text += chunk.get('content')
             if chunk.get('reasoning_content'):
@@ -615,20 +636,15 @@ class LLMService:
 
         dynamic_sql_msg.append(AIMessage(full_dynamic_text))
 
-        self.current_logs[OperationEnum.GENERATE_DYNAMIC_SQL] = end_log(session=session,
-                                                                        log=self.current_logs[
-                                                                            OperationEnum.GENERATE_DYNAMIC_SQL],
-                                                                        full_message=[
-                                                                            {'type': msg.type,
-                                                                             'content': msg.content}
-                                                                            for msg in dynamic_sql_msg],
-                                                                        reasoning_content=full_thinking_text,
-                                                                        token_usage=token_usage)
+        self.current_logs[OperationEnum.GENERATE_DYNAMIC_SQL] = self.record_writer.end_log(
+            log=self.current_logs[OperationEnum.GENERATE_DYNAMIC_SQL],
+            full_message=[{'type': msg.type, 'content': msg.content} for msg in dynamic_sql_msg],
+            reasoning_content=full_thinking_text, token_usage=token_usage)
 
         SQLBotLogUtil.info(full_dynamic_text)
         return full_dynamic_text
 
-    def generate_assistant_dynamic_sql(self, _session: Session, sql, tables: List):
+    async def generate_assistant_dynamic_sql(self, _session: Session, sql, tables: List):
         ds: AssistantOutDsSchema = self.ds
         sub_query = []
         result_dict = {}
@@ -639,11 +655,11 @@ class LLMService:
                 sub_query.append({"table": table.name, "query": f'{dynamic_subsql_prefix}{table.name}'})
         if not sub_query:
             return None
-        temp_sql_text = self.generate_with_sub_sql(session=_session, sql=sql, sub_mappings=sub_query)
+        temp_sql_text = await self.generate_with_sub_sql(session=_session, sql=sql, sub_mappings=sub_query)
         result_dict['sqlbot_temp_sql_text'] = temp_sql_text
         return result_dict
 
-    def build_table_filter(self, session: Session, sql: str, filters: list):
+    async def build_table_filter(self, session: Session, sql: str, filters: list):
         filter = json.dumps(filters, ensure_ascii=False)
         self.chat_question.sql = sql
         self.chat_question.filter = filter
@@ -651,21 +667,16 @@ class LLMService:
         permission_sql_msg.append(SystemMessage(content=self.chat_question.filter_sys_question()))
         permission_sql_msg.append(HumanMessage(content=self.chat_question.filter_user_question()))
 
-        self.current_logs[OperationEnum.GENERATE_SQL_WITH_PERMISSIONS] = start_log(session=session,
-                                                                                   ai_modal_id=self.chat_question.ai_modal_id,
-                                                                                   ai_modal_name=self.chat_question.ai_modal_name,
-                                                                                   operate=OperationEnum.GENERATE_SQL_WITH_PERMISSIONS,
-                                                                                   record_id=self.record.id,
-                                                                                   full_message=[
-                                                                                       {'type': msg.type,
-                                                                                        'content': msg.content} for
-                                                                                       msg
-                                                                                       in permission_sql_msg])
+        self.current_logs[OperationEnum.GENERATE_SQL_WITH_PERMISSIONS] = await self.run_blocking(
+            start_log, session=session, ai_modal_id=self.chat_question.ai_modal_id,
+            ai_modal_name=self.chat_question.ai_modal_name, operate=OperationEnum.GENERATE_SQL_WITH_PERMISSIONS,
+            record_id=self.record.id,
+            full_message=[{'type': msg.type, 'content': msg.content} for msg in permission_sql_msg])
         full_thinking_text = ''
         full_filter_text = ''
         token_usage = {}
-        res = process_stream(self.llm.stream(permission_sql_msg), token_usage)
-        for chunk in res:
+        res = aprocess_stream(self.stream_llm(permission_sql_msg), token_usage)
+        async for chunk in res:
             if chunk.get('content'):
                 full_filter_text += chunk.get('content')
             if chunk.get('reasoning_content'):
@@ -673,27 +684,22 @@ class LLMService:
 
         permission_sql_msg.append(AIMessage(full_filter_text))
 
-        self.current_logs[OperationEnum.GENERATE_SQL_WITH_PERMISSIONS] = end_log(session=session,
-                                                                                 log=self.current_logs[
-                                                                                     OperationEnum.GENERATE_SQL_WITH_PERMISSIONS],
-                                                                                 full_message=[
-                                                                                     {'type': msg.type,
-                                                                                      'content': msg.content}
-                                                                                     for msg in permission_sql_msg],
-                                                                                 reasoning_content=full_thinking_text,
-                                                                                 token_usage=token_usage)
+        self.current_logs[OperationEnum.GENERATE_SQL_WITH_PERMISSIONS] = self.record_writer.end_log(
+            log=self.current_logs[OperationEnum.GENERATE_SQL_WITH_PERMISSIONS],
+            full_message=[{'type': msg.type, 'content': msg.content} for msg in permission_sql_msg],
+            reasoning_content=full_thinking_text, token_usage=token_usage)
 
         SQLBotLogUtil.info(full_filter_text)
         return full_filter_text
 
-    def generate_filter(self, _session: Session, sql: str, tables: List):
-        filters = get_row_permission_filters(session=_session, current_user=self.current_user, ds=self.ds,
-                                             tables=tables)
+    async def generate_filter(self, _session: Session, sql: str, tables: List):
+        filters = await self.run_blocking(get_row_permission_filters, session=_session, current_user=self.current_user,
+                                          ds=self.ds, tables=tables)
         if not filters:
             return None
-        return self.build_table_filter(session=_session, sql=sql, filters=filters)
+        return await self.build_table_filter(session=_session, sql=sql, filters=filters)
 
-    def generate_assistant_filter(self, _session: Session, sql, tables: List):
+    async def generate_assistant_filter(self, _session: Session, sql, tables: List):
         ds: AssistantOutDsSchema = self.ds
         filters = []
         for table in ds.tables:
@@ -701,26 +707,25 @@ class LLMService:
                 filters.append({"table": table.name, "filter": table.rule})
         if not filters:
             return None
-        return self.build_table_filter(session=_session, sql=sql, filters=filters)
+        return await self.build_table_filter(session=_session, sql=sql, filters=filters)
 
-    def generate_chart(self, _session: Session, chart_type: Optional[str] = ''):
+    async def generate_chart(self, _session: Session, chart_type: Optional[str] = '', cached_answer: Optional[str] = None):
         # append current question
         self.chart_message.append(HumanMessage(self.chat_question.chart_user_question(chart_type)))
 
-        self.current_logs[OperationEnum.GENERATE_CHART] = start_log(session=_session,
-                                                                    ai_modal_id=self.chat_question.ai_modal_id,
-                                                                    ai_modal_name=self.chat_question.ai_modal_name,
-                                                                    operate=OperationEnum.GENERATE_CHART,
-                                                                    record_id=self.record.id,
-                                                                    full_message=[
-                                                                        {'type': msg.type, 'content': msg.content} for
-                                                                        msg
-                                                                        in self.chart_message])
+        self.current_logs[OperationEnum.GENERATE_CHART] = await self.run_blocking(
+            start_log, session=_session, ai_modal_id=self.chat_question.ai_modal_id,
+            ai_modal_name=self.chat_question.ai_modal_name, operate=OperationEnum.GENERATE_CHART,
+            record_id=self.record.id,
+            full_message=[{'type': msg.type, 'content': msg.content} for msg in self.chart_message])
         full_thinking_text = ''
         full_chart_text = ''
         token_usage = {}
-        res = process_stream(self.llm.stream(self.chart_message), token_usage)
-        for chunk in res:
+        if cached_answer is not None:
+            res = replay_answer(cached_answer)
+        else:
+            res = self.stream_answer(self.chart_message, token_usage)
+        async for chunk in res:
             if chunk.get('content'):
                 full_chart_text += chunk.get('content')
             if chunk.get('reasoning_content'):
@@ -729,15 +734,11 @@ class LLMService:
 
         self.chart_message.append(AIMessage(full_chart_text))
 
-        self.record = save_chart_answer(session=_session, record_id=self.record.id,
-                                        answer=orjson.dumps({'content': full_chart_text}).decode())
-        self.current_logs[OperationEnum.GENERATE_CHART] = end_log(session=_session,
-                                                                  log=self.current_logs[OperationEnum.GENERATE_CHART],
-                                                                  full_message=[
-                                                                      {'type': msg.type, 'content': msg.content}
-                                                                      for msg in self.chart_message],
-                                                                  reasoning_content=full_thinking_text,
-                                                                  token_usage=token_usage)
+        self.record_writer.set(chart_answer=orjson.dumps({'content': full_chart_text}).decode())
+        self.current_logs[OperationEnum.GENERATE_CHART] = self.record_writer.end_log(
+            log=self.current_logs[OperationEnum.GENERATE_CHART],
+            full_message=[{'type': msg.type, 'content': msg.content} for msg in self.chart_message],
+            reasoning_content=full_thinking_text, token_usage=token_usage)
 
     @staticmethod
     def check_sql(res: str) -> tuple[str, Optional[list]]:
@@ -805,15 +806,15 @@ class LLMService:
 
         return brief
 
-    def check_save_sql(self, session: Session, res: str) -> str:
+    def check_save_sql(self, res: str) -> str:
         sql, *_ = self.check_sql(res=res)
-        save_sql(session=session, sql=sql, record_id=self.record.id)
+        self.record_writer.set(sql=sql)
 
         self.chat_question.sql = sql
 
         return sql
 
-    def check_save_chart(self, session: Session, res: str) -> Dict[str, Any]:
+    def check_save_chart(self, res: str) -> Dict[str, Any]:
 
         json_str = extract_nested_json(res)
         if json_str is None:
@@ -853,7 +854,7 @@ class LLMService:
         if error:
             raise SingleMessageError(message)
 
-        save_chart(session=session, chart=orjson.dumps(chart).decode(), record_id=self.record.id)
+        self.record_writer.set(chart=orjson.dumps(chart).decode())
 
         return chart
 
@@ -864,7 +865,9 @@ class LLMService:
         if not json_str:
             json_str = ''
 
-        save_predict_data(session=session, record_id=self.record.id, data=json_str)
+        # read back by the client once predict-success is sent
+        self.record_writer.set(predict_data=json_str)
+        self.record_writer.flush(session)
 
         if json_str == '':
             return False
@@ -872,26 +875,57 @@ class LLMService:
         return True
 
     def save_error(self, session: Session, message: str):
-        return save_error_message(session=session, record_id=self.record.id, message=message)
+        self.record_writer.error(message)
+        self.record_writer.flush(session)
 
-    def save_sql_data(self, session: Session, data_obj: Dict[str, Any]):
+    def save_sql_data(self, session: Session, data_obj: ColumnarResult):
         try:
-            data_result = data_obj.get('data')
             limit = 1000
-            if data_result:
-                data_result = prepare_for_orjson(data_result)
-                if data_result and len(data_result) > limit and self.enable_sql_row_limit:
-                    data_obj['data'] = data_result[:limit]
-                    data_obj['limit'] = limit
-                else:
-                    data_obj['data'] = data_result
-            return save_sql_exec_data(session=session, record_id=self.record.id,
-                                      data=orjson.dumps(data_obj).decode())
+            data_obj.prepare_for_json()
+            if data_obj.row_count > limit and self.enable_sql_row_limit:
+                data_obj = data_obj.to_dict(limit)
+                data_obj['limit'] = limit
+            else:
+                row_count = data_obj.row_count
+                data_obj = data_obj.to_dict()
+                if data_obj.get('truncated'):
+                    # stopped at SQL_RESULT_MAX_ROWS/SQL_RESULT_MAX_BYTES, shown as over limit too
+                    data_obj['limit'] = row_count
+            # read back by the client once execute-success is sent
+            self.record_writer.set(data=orjson.dumps(data_obj).decode())
+            self.record_writer.flush(session)
         except Exception as e:
             raise e
 
+    def save_sql_result(self, session: Session, result: ColumnarResult):
+        result.convert_large_numbers()
+        return self.save_sql_data(session=session, data_obj=result)
+
     def finish(self, session: Session):
-        return finish_record(session=session, record_id=self.record.id)
+        self.record_writer.finish()
+        self.record_writer.flush(session)
+
+    def finish_and_close(self, session: Session):
+        try:
+            self.finish(session)
+        finally:
+            session.close()
+
+    def flush_and_close(self, session: Session):
+        try:
+            self.record_writer.flush(session)
+        finally:
+            session.close()
+
+    def get_predict_result(self, session: Session) -> tuple[dict, dict, list]:
+        return (get_chat_chart_config(session, self.record.id), get_chat_chart_data(session, self.record.id),
+                get_chat_predict_data(session, self.record.id))
+
+    def get_result_cache_scope(self) -> str:
+        # row permissions are already part of the sql, credentials of assistant datasources may differ per user
+        if isinstance(self.ds, CoreDatasource):
+            return 'ds'
+        return f'user:{self.current_user.id}'
 
     def execute_sql(self, sql: str):
         """Execute SQL query
@@ -903,9 +937,12 @@ class LLMService:
         Returns:
             Query results
         """
-        SQLBotLogUtil.info(f"Executing SQL on ds_id {self.ds.id}: {sql}")
+        SQLBotLogUtil.info("Executing SQL on ds_id %s: %s", self.ds.id, sql)
         try:
-            return exec_sql(ds=self.ds, sql=sql, origin_column=False)
+            return exec_sql_result(ds=self.ds, sql=sql, origin_column=False,
+                                   max_rows=settings.SQL_RESULT_MAX_ROWS or None,
+                                   max_bytes=settings.SQL_RESULT_MAX_BYTES or None,
+                                   cache_scope=self.get_result_cache_scope())
         except Exception as e:
             if isinstance(e, ParseSQLResultError):
                 raise e
@@ -913,59 +950,108 @@ class LLMService:
                 err = traceback.format_exc(limit=1, chain=True)
                 raise SQLBotDBError(err)
 
-    def pop_chunk(self):
-        try:
-            chunk = self.chunk_list.pop(0)
-            return chunk
-        except IndexError as e:
-            return None
+    async def run_blocking(self, func: Callable[..., Any], *args, **kwargs) -> Any:
+        """
+        run a blocking step of the task (database, sql execution, http), inline while the task has a worker
+        thread of its own, on db_executor while it runs on the event loop
+        """
+        if self.inline_blocking:
+            return func(*args, **kwargs)
+        return await asyncio.get_running_loop().run_in_executor(db_executor, partial(func, *args, **kwargs))
+
+    async def stream_llm(self, messages: List[Union[BaseMessage, dict[str, Any]]]) -> AsyncIterator[BaseMessageChunk]:
+        # a worker thread keeps the sync client, its event loop only lives as long as the task
+        if self.inline_blocking:
+            for chunk in self.llm.stream(messages):
+                yield chunk
+        else:
+            async for chunk in self.llm.astream(messages):
+                yield chunk
 
-    def await_result(self):
-        while self.is_running():
-            while True:
-                chunk = self.pop_chunk()
-                if chunk is not None:
-                    yield chunk
-                else:
+    def stream_answer(self, messages: List[Union[BaseMessage, dict[str, Any]]],
+                      token_usage: Dict[str, Any]) -> AsyncIterator[Dict[str, str]]:
+        """
+        parsed llm answer shown to the user. on the event loop tiny chunks are merged into fewer frames, a worker
+        thread blocks its loop on the sync client and sends them as they come
+        """
+        chunks = aprocess_stream(self.stream_llm(messages), token_usage)
+        if self.inline_blocking:
+            return chunks
+        return coalesce_chunks(chunks)
+
+    def start(self, task: Callable[[], AsyncIterator[Any]]):
+        """
+        with CHAT_ASYNC_PIPELINE_ENABLED the task runs on the event loop as the response iterates it, otherwise
+        in a worker thread of the executor that publishes to a channel
+        """
+        if settings.CHAT_ASYNC_PIPELINE_ENABLED:
+            self.inline_blocking = False
+            self.pipeline = task()
+        else:
+            self.channel = StreamChannel()
+            self.future = executor.submit(self.publish, task)
+
+    def publish(self, task: Callable[[], AsyncIterator[Any]]):
+        """
+        run in the executor, forward chunks to the channel until done or the consumer is gone
+        """
+        asyncio.run(self.forward(task()))
+
+    async def forward(self, chunks: AsyncIterator[Any]):
+        channel = self.channel
+        try:
+            async for chunk in chunks:
+                if not channel.put(chunk):
+                    SQLBotLogUtil.info('stream consumer is gone, stop task')
                     break
-        while True:
-            chunk = self.pop_chunk()
-            if chunk is None:
-                break
-            yield chunk
+        finally:
+            # closes the task generator early when the loop was broken
+            await chunks.aclose()
+            channel.close()
+
+    def await_result(self) -> AsyncIterator[Any]:
+        if self.pipeline is not None:
+            return self.pipeline
+        return self.channel.stream()
 
     def run_task_async(self, in_chat: bool = True, stream: bool = True,
                        finish_step: ChatFinishStep = ChatFinishStep.GENERATE_CHART):
         if in_chat:
             stream = True
-        self.future = executor.submit(self.run_task_cache, in_chat, stream, finish_step)
+        self.start(lambda: self.run_task(in_chat, stream, finish_step))
 
-    def run_task_cache(self, in_chat: bool = True, stream: bool = True,
+    async def run_task(self, in_chat: bool = True, stream: bool = True,
                        finish_step: ChatFinishStep = ChatFinishStep.GENERATE_CHART):
-        for chunk in self.run_task(in_chat, stream, finish_step):
-            self.chunk_list.append(chunk)
-
-    def run_task(self, in_chat: bool = True, stream: bool = True,
-                 finish_step: ChatFinishStep = ChatFinishStep.GENERATE_CHART):
         json_result: Dict[str, Any] = {'success': True}
         _session = None
         try:
-            _session = session_maker()
+            _session = Session(engine)
+            connected = None
             if self.ds:
                 oid = self.ds.oid if isinstance(self.ds, CoreDatasource) else 1
                 ds_id = self.ds.id if isinstance(self.ds, CoreDatasource) else None
-                self.chat_question.terminologies = get_terminology_template(_session, self.chat_question.question,
-                                                                            oid, ds_id)
+                question = self.chat_question.question
                 if self.current_assistant and self.current_assistant.type == 1:
-                    self.chat_question.data_training = get_training_template(_session, self.chat_question.question,
-                                                                             oid, None, self.current_assistant.id)
+                    assistant_id = self.current_assistant.id
+                    training_step = lambda session: get_training_template(session, question, oid, None, assistant_id)
                 else:
-                    self.chat_question.data_training = get_training_template(_session, self.chat_question.question,
-                                                                             oid, ds_id)
+                    training_step = lambda session: get_training_template(session, question, oid, ds_id)
+                steps = [
+                    PrepareStep('terminologies',
+                                lambda session: get_terminology_template(session, question, oid, ds_id)),
+                    PrepareStep('data_training', training_step),
+                    PrepareStep('connection', lambda: check_cached_connection(self.ds), session=False),
+                ]
                 if SQLBotLicenseUtil.valid():
-                    self.chat_question.custom_prompt = find_custom_prompts(_session,
-                                                                           CustomPromptTypeEnum.GENERATE_SQL,
-                                                                           oid, ds_id)
+                    steps.append(PrepareStep('custom_prompt', lambda session: find_custom_prompts(
+                        session, CustomPromptTypeEnum.GENERATE_SQL, oid, ds_id)))
+                results, timings = await self.run_blocking(run_prepare_steps, steps)
+                self.prepare_timings = {**self.prepare_timings, **timings}
+                self.chat_question.terminologies = results['terminologies']
+                self.chat_question.data_training = results['data_training']
+                if 'custom_prompt' in results:
+                    self.chat_question.custom_prompt = results['custom_prompt']
+                connected = results['connection']
                 self.init_messages()
 
             # return id
@@ -987,8 +1073,7 @@ class LLMService:
             if not self.ds:
                 ds_res = self.select_datasource(_session)
 
-                for chunk in ds_res:
-                    SQLBotLogUtil.info(chunk)
+                async for chunk in ds_res:
                     if in_chat:
                         yield 'data:' + orjson.dumps(
                             {'content': chunk.get('content'), 'reasoning_content': chunk.get('reasoning_content'),
@@ -998,24 +1083,33 @@ class LLMService:
                                                   'engine_type': self.ds.type_name or self.ds.type,
                                                   'type': 'datasource'}).decode() + '\n\n'
 
-                self.chat_question.db_schema = self.out_ds_instance.get_db_schema(
-                    self.ds.id, self.chat_question.question) if self.out_ds_instance else get_table_schema(
-                    session=_session,
-                    current_user=self.current_user,
-                    ds=self.ds,
-                    question=self.chat_question.question)
+                if self.out_ds_instance:
+                    self.chat_question.db_schema = await self.run_blocking(
+                        self.out_ds_instance.get_db_schema, self.ds.id, self.chat_question.question)
+                else:
+                    self.chat_question.db_schema = await self.run_blocking(
+                        get_table_schema, session=_session, current_user=self.current_user, ds=self.ds,
+                        question=self.chat_question.question)
             else:
-                self.validate_history_ds(_session)
+                await self.run_blocking(self.validate_history_ds, _session)
 
             # check connection
-            connected = check_connection(ds=self.ds, trans=None)
+            if connected is None:
+                connected = await self.run_blocking(check_cached_connection, self.ds)
             if not connected:
                 raise SQLBotDBConnectionError('Connect DB failed')
 
+            # a repeated question replays the cached answers instead of asking the llm, the sql is still executed
+            answer_key = await self.run_blocking(self.get_answer_cache_key, _session)
+            answer_version = answer_cache.version(self.ds.id) if answer_key else None
+            cached_answer = answer_cache.get(answer_key) if answer_key else None
+            if cached_answer:
+                SQLBotLogUtil.info(f"answer cache hit on ds_id {self.ds.id}")
+
             # generate sql
-            sql_res = self.generate_sql(_session)
+            sql_res = self.generate_sql(_session, cached_answer.sql_answer if cached_answer else None)
             full_sql_text = ''
-            for chunk in sql_res:
+            async for chunk in sql_res:
                 full_sql_text += chunk.get('content')
                 if in_chat:
                     yield 'data:' + orjson.dumps(
@@ -1035,9 +1129,10 @@ class LLMService:
                 if llm_brief_generated or (self.chat_question.question and self.chat_question.question.strip() != ''):
                     save_brief = llm_brief if (llm_brief and llm_brief != '') else self.chat_question.question.strip()[
                                                                                    :20]
-                    brief = rename_chat(session=_session,
-                                        rename_object=RenameChat(id=self.get_record().chat_id,
-                                                                 brief=save_brief, brief_generate=llm_brief_generated))
+                    brief = await self.run_blocking(
+                        rename_chat, session=_session,
+                        rename_object=RenameChat(id=self.get_record().chat_id, brief=save_brief,
+                                                 brief_generate=llm_brief_generated))
                     if in_chat:
                         yield 'data:' + orjson.dumps({'type': 'brief', 'brief': brief}).decode() + '\n\n'
                     if not stream:
@@ -1048,29 +1143,34 @@ class LLMService:
             dynamic_sql_result = None
             sqlbot_temp_sql_text = None
             assistant_dynamic_sql = None
+            if cached_answer:
+                # already filtered by the row permissions of the cache key
+                sql = cached_answer.sql
+                self.record_writer.set(sql=sql)
+                self.chat_question.sql = sql
             # row permission
-            if ((not self.current_assistant or is_page_embedded) and is_normal_user(
+            elif ((not self.current_assistant or is_page_embedded) and is_normal_user(
                     self.current_user)) or use_dynamic_ds:
                 sql, tables = self.check_sql(res=full_sql_text)
                 sql_result = None
 
                 if use_dynamic_ds:
-                    dynamic_sql_result = self.generate_assistant_dynamic_sql(_session, sql, tables)
+                    dynamic_sql_result = await self.generate_assistant_dynamic_sql(_session, sql, tables)
                     sqlbot_temp_sql_text = dynamic_sql_result.get(
                         'sqlbot_temp_sql_text') if dynamic_sql_result else None
                     # sql_result = self.generate_assistant_filter(sql, tables)
                 else:
-                    sql_result = self.generate_filter(_session, sql, tables)  # maybe no sql and tables
+                    sql_result = await self.generate_filter(_session, sql, tables)  # maybe no sql and tables
 
                 if sql_result:
                     SQLBotLogUtil.info(sql_result)
-                    sql = self.check_save_sql(session=_session, res=sql_result)
+                    sql = self.check_save_sql(res=sql_result)
                 elif dynamic_sql_result and sqlbot_temp_sql_text:
-                    assistant_dynamic_sql = self.check_save_sql(session=_session, res=sqlbot_temp_sql_text)
+                    assistant_dynamic_sql = self.check_save_sql(res=sqlbot_temp_sql_text)
                 else:
-                    sql = self.check_save_sql(session=_session, res=full_sql_text)
+                    sql = self.check_save_sql(res=full_sql_text)
             else:
-                sql = self.check_save_sql(session=_session, res=full_sql_text)
+                sql = self.check_save_sql(res=full_sql_text)
 
             SQLBotLogUtil.info('sql: ' + sql)
 
@@ -1100,46 +1200,36 @@ class LLMService:
                     yield json_result
                 return
 
-            result = self.execute_sql(sql=real_execute_sql)
+            # answers, sql and generation logs so far are stored before the query runs
+            await self.run_blocking(self.record_writer.flush, _session)
+            result = await self.run_blocking(self.execute_sql, sql=real_execute_sql)
+            if answer_key and not cached_answer:
+                answer_cache.put(answer_key, CachedAnswer(sql_answer=full_sql_text, sql=sql), answer_version)
 
-            _data = DataFormat.convert_large_numbers_in_object_array(result.get('data'))
-            result["data"] = _data
-
-            self.save_sql_data(session=_session, data_obj=result)
+            await self.run_blocking(self.save_sql_result, session=_session, result=result)
             if in_chat:
                 yield 'data:' + orjson.dumps({'content': 'execute-success', 'type': 'sql-data'}).decode() + '\n\n'
             if not stream:
-                json_result['data'] = get_chat_chart_data(_session, self.record.id)
+                json_result['data'] = await self.run_blocking(get_chat_chart_data, _session, self.record.id)
 
             if finish_step.value <= ChatFinishStep.QUERY_DATA.value:
                 if stream:
                     if in_chat:
                         yield 'data:' + orjson.dumps({'type': 'finish'}).decode() + '\n\n'
                     else:
-                        _column_list = []
-                        for field in result.get('fields'):
-                            _column_list.append(AxisObj(name=field, value=field))
-
-                        md_data, _fields_list = DataFormat.convert_object_array_for_pandas(_column_list,
-                                                                                           result.get('data'))
-
-                        # data, _fields_list, col_formats = self.format_pd_data(_column_list, result.get('data'))
-
-                        if not _data or not _fields_list:
+                        if result.row_count == 0 or not result.fields:
                             yield 'The SQL execution result is empty.\n\n'
                         else:
-                            df = pd.DataFrame(_data, columns=_fields_list)
-                            df_safe = DataFormat.safe_convert_to_string(df)
-                            markdown_table = df_safe.to_markdown(index=False)
-                            yield markdown_table + '\n\n'
+                            yield await self.run_blocking(to_markdown_table, result) + '\n\n'
                 else:
                     yield json_result
                 return
 
             # generate chart
-            chart_res = self.generate_chart(_session, chart_type)
+            chart_res = self.generate_chart(_session, chart_type,
+                                            cached_answer.chart_answer if cached_answer else None)
             full_chart_text = ''
-            for chunk in chart_res:
+            async for chunk in chart_res:
                 full_chart_text += chunk.get('content')
                 if in_chat:
                     yield 'data:' + orjson.dumps(
@@ -1150,8 +1240,11 @@ class LLMService:
 
             # filter chart
             SQLBotLogUtil.info(full_chart_text)
-            chart = self.check_save_chart(session=_session, res=full_chart_text)
+            chart = self.check_save_chart(res=full_chart_text)
             SQLBotLogUtil.info(chart)
+            if answer_key and not (cached_answer and cached_answer.chart_answer):
+                answer_cache.put(answer_key, CachedAnswer(sql_answer=full_sql_text, sql=sql,
+                                                          chart_answer=full_chart_text), answer_version)
 
             if not stream:
                 json_result['chart'] = chart
@@ -1161,17 +1254,11 @@ class LLMService:
                     {'content': orjson.dumps(chart).decode(), 'type': 'chart'}).decode() + '\n\n'
             else:
                 if stream:
-                    md_data, _fields_list = DataFormat.convert_data_fields_for_pandas(chart, result.get('fields'),
-                                                                                      result.get('data'))
-                    # data, _fields_list, col_formats = self.format_pd_data(_column_list, result.get('data'))
-
-                    if not md_data or not _fields_list:
+                    if result.row_count == 0 or not result.fields:
                         yield 'The SQL execution result is empty.\n\n'
                     else:
-                        df = pd.DataFrame(md_data, columns=_fields_list)
-                        df_safe = DataFormat.safe_convert_to_string(df)
-                        markdown_table = df_safe.to_markdown(index=False)
-                        yield markdown_table + '\n\n'
+                        yield await self.run_blocking(to_markdown_table, result,
+                                                      DataFormat.chart_field_names(chart, result.fields)) + '\n\n'
 
             if in_chat:
                 yield 'data:' + orjson.dumps({'type': 'finish'}).decode() + '\n\n'
@@ -1180,8 +1267,9 @@ class LLMService:
                 try:
                     if chart.get('type') != 'table':
                         # yield '### generated chart picture\n\n'
-                        image_url, error = request_picture(self.record.chat_id, self.record.id, chart,
-                                                           format_json_data(result))
+                        image_url, error = await self.run_blocking(request_picture, self.record.chat_id,
+                                                                   self.record.id, chart,
+                                                                   format_json_data(result.to_dict()))
                         SQLBotLogUtil.info(image_url)
                         if stream:
                             yield f'![{chart.get("type")}]({image_url})'
@@ -1212,7 +1300,7 @@ class LLMService:
             else:
                 error_msg = orjson.dumps({'message': str(e), 'traceback': traceback.format_exc(limit=1)}).decode()
             if _session:
-                self.save_error(session=_session, message=error_msg)
+                await self.run_blocking(self.save_error, session=_session, message=error_msg)
             if in_chat:
                 yield 'data:' + orjson.dumps({'content': error_msg, 'type': 'error'}).decode() + '\n\n'
             else:
@@ -1224,22 +1312,19 @@ class LLMService:
                     json_result['message'] = error_msg
                     yield json_result
         finally:
-            self.finish(_session)
-            session_maker.remove()
+            if _session:
+                await self.run_blocking(self.finish_and_close, _session)
 
     def run_recommend_questions_task_async(self):
-        self.future = executor.submit(self.run_recommend_questions_task_cache)
-
-    def run_recommend_questions_task_cache(self):
-        for chunk in self.run_recommend_questions_task():
-            self.chunk_list.append(chunk)
+        self.start(self.run_recommend_questions_task)
 
-    def run_recommend_questions_task(self):
+    async def run_recommend_questions_task(self):
+        _session = None
         try:
-            _session = session_maker()
+            _session = Session(engine)
             res = self.generate_recommend_questions_task(_session)
 
-            for chunk in res:
+            async for chunk in res:
                 if chunk.get('recommended_question'):
                     yield 'data:' + orjson.dumps(
                         {'content': chunk.get('recommended_question'),
@@ -1251,22 +1336,19 @@ class LLMService:
         except Exception:
             traceback.print_exc()
         finally:
-            session_maker.remove()
+            if _session:
+                await self.run_blocking(_session.close)
 
     def run_analysis_or_predict_task_async(self, session: Session, action_type: str, base_record: ChatRecord,
                                            in_chat: bool = True, stream: bool = True):
         self.set_record(save_analysis_predict_record(session, base_record, action_type))
-        self.future = executor.submit(self.run_analysis_or_predict_task_cache, action_type, in_chat, stream)
+        self.start(lambda: self.run_analysis_or_predict_task(action_type, in_chat, stream))
 
-    def run_analysis_or_predict_task_cache(self, action_type: str, in_chat: bool = True, stream: bool = True):
-        for chunk in self.run_analysis_or_predict_task(action_type, in_chat, stream):
-            self.chunk_list.append(chunk)
-
-    def run_analysis_or_predict_task(self, action_type: str, in_chat: bool = True, stream: bool = True):
+    async def run_analysis_or_predict_task(self, action_type: str, in_chat: bool = True, stream: bool = True):
         json_result: Dict[str, Any] = {'success': True}
         _session = None
         try:
-            _session = session_maker()
+            _session = Session(engine)
             if in_chat:
                 yield 'data:' + orjson.dumps({'type': 'id', 'id': self.get_record().id}).decode() + '\n\n'
             else:
@@ -1280,7 +1362,7 @@ class LLMService:
                 # generate analysis
                 analysis_res = self.generate_analysis(_session)
                 full_text = ''
-                for chunk in analysis_res:
+                async for chunk in analysis_res:
                     full_text += chunk.get('content')
                     if in_chat:
                         yield 'data:' + orjson.dumps(
@@ -1302,7 +1384,7 @@ class LLMService:
                 # generate predict
                 analysis_res = self.generate_predict(_session)
                 full_text = ''
-                for chunk in analysis_res:
+                async for chunk in analysis_res:
                     full_text += chunk.get('content')
                     if in_chat:
                         yield 'data:' + orjson.dumps(
@@ -1311,14 +1393,12 @@ class LLMService:
                 if in_chat:
                     yield 'data:' + orjson.dumps({'type': 'info', 'msg': 'predict generated'}).decode() + '\n\n'
 
-                has_data = self.check_save_predict_data(session=_session, res=full_text)
+                has_data = await self.run_blocking(self.check_save_predict_data, session=_session, res=full_text)
                 if has_data:
                     if in_chat:
                         yield 'data:' + orjson.dumps({'type': 'predict-success'}).decode() + '\n\n'
                     else:
-                        chart = get_chat_chart_config(_session, self.record.id)
-                        origin_data = get_chat_chart_data(_session, self.record.id)
-                        predict_data = get_chat_predict_data(_session, self.record.id)
+                        chart, origin_data, predict_data = await self.run_blocking(self.get_predict_result, _session)
 
                         if stream:
                             md_data, _fields_list = DataFormat.convert_data_fields_for_pandas(chart,
@@ -1329,7 +1409,7 @@ class LLMService:
                             else:
                                 df = pd.DataFrame(md_data, columns=_fields_list)
                                 df_safe = DataFormat.safe_convert_to_string(df)
-                                markdown_table = df_safe.to_markdown(index=False)
+                                markdown_table = await self.run_blocking(df_safe.to_markdown, index=False)
                                 yield markdown_table + '\n\n'
 
                         else:
@@ -1341,11 +1421,12 @@ class LLMService:
                             if chart.get('type') != 'table':
                                 # yield '### generated chart picture\n\n'
 
-                                _data = get_chat_chart_data(_session, self.record.id)
+                                _data = await self.run_blocking(get_chat_chart_data, _session, self.record.id)
                                 _data['data'] = _data.get('data') + predict_data
 
-                                image_url, error = request_picture(self.record.chat_id, self.record.id, chart,
-                                                                   format_json_data(_data))
+                                image_url, error = await self.run_blocking(request_picture, self.record.chat_id,
+                                                                           self.record.id, chart,
+                                                                           format_json_data(_data))
                                 SQLBotLogUtil.info(image_url)
                                 if stream:
                                     yield f'![{chart.get("type")}]({image_url})'
@@ -1370,7 +1451,7 @@ class LLMService:
                 if in_chat:
                     yield 'data:' + orjson.dumps({'type': 'predict_finish'}).decode() + '\n\n'
 
-            self.finish(_session)
+            await self.run_blocking(self.finish, _session)
 
             if not stream:
                 yield json_result
@@ -1382,7 +1463,7 @@ class LLMService:
             else:
                 error_msg = orjson.dumps({'message': str(e), 'traceback': traceback.format_exc(limit=1)}).decode()
             if _session:
-                self.save_error(session=_session, message=error_msg)
+                await self.run_blocking(self.save_error, session=_session, message=error_msg)
             if in_chat:
                 yield 'data:' + orjson.dumps({'content': error_msg, 'type': 'error'}).decode() + '\n\n'
             else:
@@ -1395,7 +1476,8 @@ class LLMService:
                     yield json_result
         finally:
             # end
-            session_maker.remove()
+            if _session:
+                await self.run_blocking(self.flush_and_close, _session)
 
     def validate_history_ds(self, session: Session):
         _ds = self.ds
@@ -1484,114 +1566,15 @@ def request_picture(chat_id: int, record_id: int, chart: dict, data: dict):
     return request_path, _error
 
 
-def get_token_usage(chunk: BaseMessageChunk, token_usage: dict = None):
-    try:
-        if chunk.usage_metadata:
-            if token_usage is None:
-                token_usage = {}
-            token_usage['input_tokens'] = chunk.usage_metadata.get('input_tokens')
-            token_usage['output_tokens'] = chunk.usage_metadata.get('output_tokens')
-            token_usage['total_tokens'] = chunk.usage_metadata.get('total_tokens')
-    except Exception:
-        pass
-
-
-def process_stream(res: Iterator[BaseMessageChunk],
-                   token_usage: Dict[str, Any] = None,
-                   enable_tag_parsing: bool = settings.PARSE_REASONING_BLOCK_ENABLED,
-                   start_tag: str = settings.DEFAULT_REASONING_CONTENT_START,
-                   end_tag: str = settings.DEFAULT_REASONING_CONTENT_END
-                   ):
-    if token_usage is None:
-        token_usage = {}
-    in_thinking_block = False  # 标记是否在思考过程块中
-    current_thinking = ''  # 当前收集的思考过程内容
-    pending_start_tag = ''  # 用于缓存可能被截断的开始标签部分
-
-    for chunk in res:
-        SQLBotLogUtil.info(chunk)
-        reasoning_content_chunk = ''
-        content = chunk.content
-        output_content = ''  # 实际要输出的内容
-
-        # 检查additional_kwargs中的reasoning_content
-        if 'reasoning_content' in chunk.additional_kwargs:
-            reasoning_content = chunk.additional_kwargs.get('reasoning_content', '')
-            if reasoning_content is None:
-                reasoning_content = ''
-
-            # 累积additional_kwargs中的思考内容到current_thinking
-            current_thinking += reasoning_content
-            reasoning_content_chunk = reasoning_content
-
-        # 只有当current_thinking不是空字符串时才跳过标签解析
-        if not in_thinking_block and current_thinking.strip() != '':
-            output_content = content  # 正常输出content
-            yield {
-                'content': output_content,
-                'reasoning_content': reasoning_content_chunk
-            }
-            get_token_usage(chunk, token_usage)
-            continue  # 跳过后续的标签解析逻辑
-
-        # 如果没有有效的思考内容，并且启用了标签解析，才执行标签解析逻辑
-        # 如果有缓存的开始标签部分，先拼接当前内容
-        if pending_start_tag:
-            content = pending_start_tag + content
-            pending_start_tag = ''
-
-        # 检查是否开始思考过程块（处理可能被截断的开始标签）
-        if enable_tag_parsing and not in_thinking_block and start_tag:
-            if start_tag in content:
-                start_idx = content.index(start_tag)
-                # 只有当开始标签前面没有其他文本时才认为是真正的思考块开始
-                if start_idx == 0 or content[:start_idx].strip() == '':
-                    # 完整标签存在且前面没有其他文本
-                    output_content += content[:start_idx]  # 输出开始标签之前的内容
-                    content = content[start_idx + len(start_tag):]  # 移除开始标签
-                    in_thinking_block = True
-                else:
-                    # 开始标签前面有其他文本，不认为是思考块开始
-                    output_content += content
-                    content = ''
-            else:
-                # 检查是否可能有部分开始标签
-                for i in range(1, len(start_tag)):
-                    if content.endswith(start_tag[:i]):
-                        # 只有当当前内容全是空白时才缓存部分标签
-                        if content[:-i].strip() == '':
-                            pending_start_tag = start_tag[:i]
-                            content = content[:-i]  # 移除可能的部分标签
-                            output_content += content
-                            content = ''
-                        break
-
-        # 处理思考块内容
-        if enable_tag_parsing and in_thinking_block and end_tag:
-            if end_tag in content:
-                # 找到结束标签
-                end_idx = content.index(end_tag)
-                current_thinking += content[:end_idx]  # 收集思考内容
-                reasoning_content_chunk += current_thinking  # 添加到当前块的思考内容
-                content = content[end_idx + len(end_tag):]  # 移除结束标签后的内容
-                current_thinking = ''  # 重置当前思考内容
-                in_thinking_block = False
-                output_content += content  # 输出结束标签之后的内容
-            else:
-                # 在遇到结束标签前，持续收集思考内容
-                current_thinking += content
-                reasoning_content_chunk += content
-                content = ''
+def to_markdown_table(result: ColumnarResult, columns: Optional[list[str]] = None) -> str:
+    df = result.to_dataframe(columns)
+    df_safe = DataFormat.safe_convert_to_string(df)
+    return df_safe.to_markdown(index=False)
 
-        else:
-            # 不在思考块中或标签解析未启用，正常输出
-            output_content += content
-
-        yield {
-            'content': output_content,
-            'reasoning_content': reasoning_content_chunk
-        }
-        get_token_usage(chunk, token_usage)
+
+async def replay_answer(answer: str) -> AsyncIterator[Dict[str, str]]:
+    # a cached answer streamed as a single chunk
+    yield {'content': answer}
 
 
 def get_lang_name(lang: str):
@@ -0,0 +1,68 @@
+# Author: Junjun
+# Date: 2025/10/17
+import time
+from concurrent.futures import ThreadPoolExecutor, Future, FIRST_COMPLETED, wait
+from dataclasses import dataclass
+from typing import Any, Callable
+
+from sqlmodel import Session
+
+from common.core.config import settings
+from common.core.db import engine
+from common.utils.utils import SQLBotLogUtil
+
+# separate from the chat task executor, steps are submitted from tasks running there
+prepare_executor = ThreadPoolExecutor(max_workers=settings.CHAT_PREPARE_WORKERS, thread_name_prefix='chat-prepare')
+
+
+@dataclass
+class PrepareStep:
+    """
+    one independent piece of prompt assembly. func gets its own session as first argument (unless session is
+    False) and the results of deps as keyword arguments
+    """
+    name: str
+    func: Callable[..., Any]
+    deps: tuple[str, ...] = ()
+    session: bool = True
+
+
+def _run_step(step: PrepareStep, dep_results: dict[str, Any]) -> tuple[Any, float]:
+    start = time.perf_counter()
+    if step.session:
+        with Session(engine) as session:
+            result = step.func(session, **dep_results)
+    else:
+        result = step.func(**dep_results)
+    return result, time.perf_counter() - start
+
+
+def run_prepare_steps(steps: list[PrepareStep]) -> tuple[dict[str, Any], dict[str, float]]:
+    """
+    run every step on prepare_executor as soon as its deps are done, returns results and seconds per step name.
+    the first failing step raises its exception, steps not started yet are cancelled
+    """
+    pending = {step.name: step for step in steps}
+    running: dict[Future, str] = {}
+    results: dict[str, Any] = {}
+    timings: dict[str, float] = {}
+    start = time.perf_counter()
+    try:
+        while pending or running:
+            for name, step in list(pending.items()):
+                if all(dep in results for dep in step.deps):
+                    del pending[name]
+                    future = prepare_executor.submit(_run_step, step, {dep: results[dep] for dep in step.deps})
+                    running[future] = name
+            if not running:
+                raise ValueError(f'prepare steps with unknown deps: {list(pending)}')
+            done, _ = wait(running, return_when=FIRST_COMPLETED)
+            for future in done:
+                name = running.pop(future)
+                results[name], timings[name] = future.result()
+    finally:
+        for future in running:
+            future.cancel()
+    SQLBotLogUtil.info(f"prepare steps in {(time.perf_counter() - start) * 1000:.0f}ms: " + ', '.join(
+        f'{name} {cost * 1000:.0f}ms' for name, cost in timings.items()))
+    return results, timings
@@ -0,0 +1,74 @@
+import asyncio
+import threading
+from collections import deque
+from typing import Any, AsyncIterator, Optional
+
+from common.core.config import settings
+
+
+class StreamChannel:
+    """
+    bounded channel from a worker thread to an async consumer.
+    put() blocks the producer while maxsize chunks are pending (backpressure) and returns False once the
+    consumer has gone away, the consumer awaits without polling and cancels the channel when it is closed
+    (e.g. the client disconnected)
+    """
+
+    def __init__(self, maxsize: Optional[int] = None, loop: Optional[asyncio.AbstractEventLoop] = None):
+        self._loop = loop or asyncio.get_running_loop()
+        self._maxsize = maxsize or settings.CHAT_STREAM_QUEUE_SIZE
+        self._buffer: deque = deque()
+        self._cond = threading.Condition()
+        self._readable = asyncio.Event()
+        self._closed = False
+        self._cancelled = False
+
+    @property
+    def cancelled(self) -> bool:
+        return self._cancelled
+
+    def _notify(self):
+        try:
+            self._loop.call_soon_threadsafe(self._readable.set)
+        except RuntimeError:
+            # event loop already closed, nobody is listening anymore
+            self.cancel()
+
+    def put(self, item: Any) -> bool:
+        with self._cond:
+            while len(self._buffer) >= self._maxsize and not self._cancelled:
+                self._cond.wait()
+            if self._cancelled:
+                return False
+            self._buffer.append(item)
+        self._notify()
+        return True
+
+    def close(self):
+        with self._cond:
+            self._closed = True
+        self._notify()
+
+    def cancel(self):
+        with self._cond:
+            self._cancelled = True
+            self._buffer.clear()
+            self._cond.notify_all()
+
+    async def stream(self) -> AsyncIterator[Any]:
+        try:
+            while True:
+                await self._readable.wait()
+                with self._cond:
+                    self._readable.clear()
+                    items = list(self._buffer)
+                    self._buffer.clear()
+                    closed = self._closed
+                    self._cond.notify_all()
+                for item in items:
+                    yield item
+                if closed:
+                    return
+        finally:
+            # consumer finished or was cancelled, release a blocked producer
+            self.cancel()
@@ -0,0 +1,223 @@
+# Author: Junjun
+# Date: 2025/10/17
+import asyncio
+import time
+from typing import Any, AsyncIterator, Dict, Iterator, Optional
+
+from langchain_core.messages import BaseMessageChunk
+
+from common.core.config import settings
+from common.utils.utils import SQLBotLogUtil
+
+_BEFORE_REASONING = 0  # only whitespace so far, the answer may still open with start_tag
+_IN_REASONING = 1  # inside start_tag...end_tag
+_CONTENT = 2  # plain content until the end of the stream
+
+
+def get_token_usage(chunk: BaseMessageChunk, token_usage: dict = None):
+    try:
+        if chunk.usage_metadata:
+            if token_usage is None:
+                token_usage = {}
+            token_usage['input_tokens'] = chunk.usage_metadata.get('input_tokens')
+            token_usage['output_tokens'] = chunk.usage_metadata.get('output_tokens')
+            token_usage['total_tokens'] = chunk.usage_metadata.get('total_tokens')
+    except Exception:
+        pass
+
+
+def _partial_tag_length(text: str, tag: str) -> int:
+    # length of the longest tail of text that is the beginning of tag
+    for length in range(min(len(tag) - 1, len(text)), 0, -1):
+        if text.endswith(tag[:length]):
+            return length
+    return 0
+
+
+class ReasoningStreamParser:
+    """
+    splits llm chunks into content and reasoning_content, taken from additional_kwargs or from a
+    start_tag...end_tag block opening the answer (tags may be cut across chunks).
+    each chunk is scanned once, only a possibly cut tag is carried over to the next one
+    """
+
+    def __init__(self, token_usage: Dict[str, Any] = None,
+                 enable_tag_parsing: bool = settings.PARSE_REASONING_BLOCK_ENABLED,
+                 start_tag: str = settings.DEFAULT_REASONING_CONTENT_START,
+                 end_tag: str = settings.DEFAULT_REASONING_CONTENT_END):
+        self.token_usage = token_usage if token_usage is not None else {}
+        self.start_tag = start_tag
+        self.end_tag = end_tag
+        self.state = _BEFORE_REASONING if enable_tag_parsing and start_tag and end_tag else _CONTENT
+        self.pending = ''  # text held back as it may be the beginning of a tag
+        self.chunks = 0
+        self.content_length = 0
+        self.reasoning_length = 0
+
+    def _parse(self, text: str) -> tuple[str, str]:
+        text = self.pending + text
+        self.pending = ''
+        content = ''
+        if self.state == _BEFORE_REASONING:
+            stripped = text.lstrip()
+            leading = text[:len(text) - len(stripped)]
+            if stripped.startswith(self.start_tag):
+                content = leading
+                text = stripped[len(self.start_tag):]
+                self.state = _IN_REASONING
+            elif self.start_tag.startswith(stripped):
+                self.pending = stripped
+                return leading, ''
+            else:
+                self.state = _CONTENT
+                return text, ''
+
+        end_idx = text.find(self.end_tag)
+        if end_idx >= 0:
+            self.state = _CONTENT
+            return content + text[end_idx + len(self.end_tag):], text[:end_idx]
+        cut = _partial_tag_length(text, self.end_tag)
+        if cut:
+            self.pending = text[-cut:]
+            text = text[:-cut]
+        return content, text
+
+    def feed(self, chunk: BaseMessageChunk) -> Dict[str, str]:
+        self.chunks += 1
+        content = chunk.content or ''
+        reasoning = chunk.additional_kwargs.get('reasoning_content') or ''
+        if reasoning and self.state == _BEFORE_REASONING:
+            # reasoning is reported apart from the answer, no tags to look for
+            self.state = _CONTENT
+        if self.state != _CONTENT:
+            content, tag_reasoning = self._parse(content)
+            reasoning += tag_reasoning
+        elif self.pending:
+            content, self.pending = self.pending + content, ''
+
+        get_token_usage(chunk, self.token_usage)
+        self.content_length += len(content)
+        self.reasoning_length += len(reasoning)
+        return {'content': content, 'reasoning_content': reasoning}
+
+    def flush(self) -> Optional[Dict[str, str]]:
+        """
+        text still held back when the stream ended (a cut tag that never completed)
+        """
+        pending, self.pending = self.pending, ''
+        if not pending:
+            return None
+        if self.state == _IN_REASONING:
+            self.reasoning_length += len(pending)
+            return {'content': '', 'reasoning_content': pending}
+        self.content_length += len(pending)
+        return {'content': pending, 'reasoning_content': ''}
+
+    def log_summary(self, start: float, first_chunk: Optional[float]):
+        first = f'{(first_chunk - start) * 1000:.0f}ms' if first_chunk else '-'
+        SQLBotLogUtil.info(f"llm stream: {self.chunks} chunks, {self.content_length} content and "
+                           f"{self.reasoning_length} reasoning chars in {(time.perf_counter() - start) * 1000:.0f}ms, "
+                           f"first chunk after {first}, token usage {self.token_usage}")
+
+
+def process_stream(res: Iterator[BaseMessageChunk],
+                   token_usage: Dict[str, Any] = None,
+                   enable_tag_parsing: bool = settings.PARSE_REASONING_BLOCK_ENABLED,
+                   start_tag: str = settings.DEFAULT_REASONING_CONTENT_START,
+                   end_tag: str = settings.DEFAULT_REASONING_CONTENT_END
+                   ):
+    parser = ReasoningStreamParser(token_usage, enable_tag_parsing, start_tag, end_tag)
+    start = time.perf_counter()
+    first_chunk = None
+    for chunk in res:
+        if first_chunk is None:
+            first_chunk = time.perf_counter()
+        yield parser.feed(chunk)
+    rest = parser.flush()
+    if rest:
+        yield rest
+    parser.log_summary(start, first_chunk)
+
+
+async def aprocess_stream(res: AsyncIterator[BaseMessageChunk],
+                          token_usage: Dict[str, Any] = None,
+                          enable_tag_parsing: bool = settings.PARSE_REASONING_BLOCK_ENABLED,
+                          start_tag: str = settings.DEFAULT_REASONING_CONTENT_START,
+                          end_tag: str = settings.DEFAULT_REASONING_CONTENT_END
+                          ):
+    parser = ReasoningStreamParser(token_usage, enable_tag_parsing, start_tag, end_tag)
+    start = time.perf_counter()
+    first_chunk = None
+    async for chunk in res:
+        if first_chunk is None:
+            first_chunk = time.perf_counter()
+        yield parser.feed(chunk)
+    rest = parser.flush()
+    if rest:
+        yield rest
+    parser.log_summary(start, first_chunk)
+
+
+async def coalesce_chunks(chunks: AsyncIterator[Dict[str, str]],
+                          max_delay: float = settings.CHAT_STREAM_COALESCE_MS / 1000,
+                          max_chars: int = settings.CHAT_STREAM_COALESCE_CHARS) -> AsyncIterator[Dict[str, str]]:
+    """
+    merge parsed chunks into fewer frames, a frame is sent once it holds max_chars or its first chunk has
+    waited max_delay seconds. chunks are read by a task of their own, so the timer only costs once per frame
+    """
+    if max_delay <= 0:
+        async for chunk in chunks:
+            yield chunk
+        return
+
+    content: list[str] = []
+    reasoning: list[str] = []
+    size = 0
+    finished = False
+    has_data = asyncio.Event()  # buffer got its first chunk or the stream ended
+    full = asyncio.Event()  # buffer reached max_chars or the stream ended
+
+    async def read():
+        nonlocal size, finished
+        try:
+            async for chunk in chunks:
+                if chunk.get('content'):
+                    content.append(chunk['content'])
+                    size += len(chunk['content'])
+                if chunk.get('reasoning_content'):
+                    reasoning.append(chunk['reasoning_content'])
+                    size += len(chunk['reasoning_content'])
+                if content or reasoning:
+                    has_data.set()
+                if size >= max_chars:
+                    full.set()
+        finally:
+            finished = True
+            has_data.set()
+            full.set()
+
+    reader = asyncio.ensure_future(read())
+    try:
+        while True:
+            await has_data.wait()
+            if not full.is_set():
+                try:
+                    await asyncio.wait_for(full.wait(), max_delay)
+                except asyncio.TimeoutError:
+                    pass
+            if content or reasoning:
+                frame = {'content': ''.join(content), 'reasoning_content': ''.join(reasoning)}
+                content.clear()
+                reasoning.clear()
+                size = 0
+                if not finished:
+                    has_data.clear()
+                    full.clear()
+                yield frame
+            elif finished:
+                break
+        # raises the error of the llm stream if it failed
+        await reader
+    finally:
+        if not reader.done():
+            reader.cancel()
@@ -15,7 +15,7 @@ from apps.system.models.system_model import AssistantModel
 from apps.template.generate_chart.generator import get_base_data_training_template
 from common.core.config import settings
 from common.core.deps import SessionDep, Trans
-from common.utils.embedding_threads import run_save_data_training_embeddings
+from common.utils.embedding_threads import embed_and_save, run_save_data_training_embeddings
 
 
 def get_data_training_base_query(oid: int, name: Optional[str] = None):
@@ -462,17 +462,7 @@ def save_embeddings(session_maker, ids: List[int]):
         session = session_maker()
         _list = session.query(DataTraining).filter(and_(DataTraining.id.in_(ids))).all()
 
-        _question_list = [item.question for item in _list]
-
-        model = EmbeddingModelCache.get_model()
-
-        results = model.embed_documents(_question_list)
-
-        for index in range(len(results)):
-            item = results[index]
-            stmt = update(DataTraining).where(and_(DataTraining.id == _list[index].id)).values(embedding=item)
-            session.execute(stmt)
-            session.commit()
+        embed_and_save(session, DataTraining.__tablename__, [(item.id, item.question) for item in _list])
 
     except Exception:
         traceback.print_exc()
@@ -536,9 +526,7 @@ def select_training_by_question(session: SessionDep, question: str, oid: int, da
     if settings.EMBEDDING_ENABLED:
         with session.begin_nested():
             try:
-                model = EmbeddingModelCache.get_model()
-
-                embedding = model.embed_query(question)
+                embedding = EmbeddingModelCache.embed_query(question)
 
                 if advanced_application_id is not None:
                     results = session.execute(text(embedding_sql_in_advanced_application),
@@ -4,7 +4,6 @@ import io
 import os
 import traceback
 import uuid
-from io import StringIO
 from typing import List
 from urllib.parse import quote
 
@@ -16,6 +15,8 @@ from sqlalchemy import and_
 
 from apps.db.db import get_schema
 from apps.db.engine import get_engine_conn
+from apps.db.excel_loader import load_csv, load_dataframe
+from apps.db.engine_pool import get_ds_engine_stats
 from apps.swagger.i18n import PLACEHOLDER_PREFIX
 from apps.system.schemas.permission import SqlbotPermission, require_permissions
 from common.core.config import settings
@@ -25,6 +26,7 @@ from ..crud.datasource import get_datasource_list, check_status, create_ds, upda
     execSql, update_table_and_fields, getTablesByDs, chooseTables, preview, updateTable, updateField, get_ds, fieldEnum, \
     check_status_by_id, sync_single_fields
 from ..crud.field import get_fields_by_table_id
+from ..crud.schema_cache import invalidate_schema_prompt_cache
 from ..crud.table import get_tables_by_ds_id
 from ..models.datasource import CoreDatasource, CreateDatasource, TableObj, CoreTable, CoreField, FieldObj, \
     TableSchemaResponse, ColumnSchemaResponse, PreviewResponse
@@ -251,6 +253,12 @@ async def field_enum(session: SessionDep, id: int):
     return await asyncio.to_thread(inner)
 
 
+@router.get("/engineStats", include_in_schema=False)
+@require_permissions(permission=SqlbotPermission(role=['admin']))
+async def engine_stats():
+    return get_ds_engine_stats()
+
+
 # @router.post("/uploadExcel")
 # async def upload_excel(session: SessionDep, file: UploadFile = File(...)):
 #     ALLOWED_EXTENSIONS = {"xlsx", "xls", "csv"}
@@ -325,25 +333,31 @@ async def upload_excel(session: SessionDep, file: UploadFile = File(..., descrip
     filename = f"{file.filename.split('.')[0]}_{hashlib.sha256(uuid.uuid4().bytes).hexdigest()[:10]}.{file.filename.split('.')[1]}"
     save_path = os.path.join(path, filename)
     with open(save_path, "wb") as f:
-        f.write(await file.read())
+        while chunk := await file.read(1024 * 1024):
+            f.write(chunk)
 
     def inner():
         sheets = []
         engine = get_engine_conn()
-        if filename.endswith(".csv"):
-            df = pd.read_csv(save_path, engine='c')
-            tableName = f"sheet1_{hashlib.sha256(uuid.uuid4().bytes).hexdigest()[:10]}"
-            sheets.append({"tableName": tableName, "tableComment": ""})
-            insert_pg(df, tableName, engine)
-        else:
-            sheet_names = pd.ExcelFile(save_path).sheet_names
-            for sheet_name in sheet_names:
-                tableName = f"{sheet_name}_{hashlib.sha256(uuid.uuid4().bytes).hexdigest()[:10]}"
+        try:
+            if filename.endswith(".csv"):
+                tableName = f"sheet1_{hashlib.sha256(uuid.uuid4().bytes).hexdigest()[:10]}"
                 sheets.append({"tableName": tableName, "tableComment": ""})
-                # df_temp = pd.read_excel(save_path, nrows=5)
-                # non_empty_cols = df_temp.columns[df_temp.notna().any()].tolist()
-                df = pd.read_excel(save_path, sheet_name=sheet_name, engine='calamine')
-                insert_pg(df, tableName, engine)
+                load_csv(save_path, tableName, engine)
+            else:
+                sheet_names = pd.ExcelFile(save_path, engine='calamine').sheet_names
+                for sheet_name in sheet_names:
+                    tableName = f"{sheet_name}_{hashlib.sha256(uuid.uuid4().bytes).hexdigest()[:10]}"
+                    sheets.append({"tableName": tableName, "tableComment": ""})
+                    # df_temp = pd.read_excel(save_path, nrows=5)
+                    # non_empty_cols = df_temp.columns[df_temp.notna().any()].tolist()
+                    df = pd.read_excel(save_path, sheet_name=sheet_name, engine='calamine')
+                    load_dataframe(df, tableName, engine)
+        except Exception as e:
+            traceback.print_exc()
+            raise HTTPException(400, str(e))
+        finally:
+            engine.dispose()
 
         # os.remove(save_path)
         return {"filename": filename, "sheets": sheets}
@@ -351,40 +365,6 @@ async def upload_excel(session: SessionDep, file: UploadFile = File(..., descrip
     return await asyncio.to_thread(inner)
 
 
-def insert_pg(df, tableName, engine):
-    # fix field type
-    for i in range(len(df.dtypes)):
-        if str(df.dtypes[i]) == 'uint64':
-            df[str(df.columns[i])] = df[str(df.columns[i])].astype('string')
-
-    conn = engine.raw_connection()
-    cursor = conn.cursor()
-    try:
-        df.to_sql(
-            tableName,
-            engine,
-            if_exists='replace',
-            index=False
-        )
-        # trans csv
-        output = StringIO()
-        df.to_csv(output, sep='\t', header=False, index=False)
-        # output.seek(0)
-
-        # pg copy
-        cursor.copy_expert(
-            sql=f"""COPY "{tableName}" FROM STDIN WITH CSV DELIMITER E'\t'""",
-            file=output
-        )
-        conn.commit()
-    except Exception as e:
-        traceback.print_exc()
-        raise HTTPException(400, str(e))
-    finally:
-        cursor.close()
-        conn.close()
-
-
 t_sheet = "数据表列表"
 t_s_col = "Sheet名称"
 t_n_col = "表名"
@@ -522,6 +502,7 @@ async def upload_ds_schema(session: SessionDep, id: int = Path(..., description=
                                      CoreField.field_name == field[f_n_col])).update(
                                 {'custom_comment': field[f_c_col]})
         session.commit()
+        invalidate_schema_prompt_cache([id])
 
         return True
     except Exception as e:
@@ -4,6 +4,7 @@ from typing import List
 
 from fastapi import APIRouter, Path
 
+from apps.datasource.crud.schema_cache import invalidate_schema_prompt_cache
 from apps.datasource.models.datasource import CoreDatasource
 from apps.swagger.i18n import PLACEHOLDER_PREFIX
 from apps.system.schemas.permission import SqlbotPermission, require_permissions
@@ -22,6 +23,7 @@ async def save_relation(session: SessionDep, relation: List[dict],
     if ds:
         ds.table_relation = relation
         session.commit()
+        invalidate_schema_prompt_cache([ds_id])
     else:
         raise Exception("no datasource")
     return True
@@ -4,14 +4,20 @@ from typing import List, Optional
 
 from fastapi import HTTPException
 from sqlalchemy import and_, text
+from sqlalchemy.orm import defer
 from sqlbot_xpack.permissions.models.ds_rules import DsRules
 from sqlmodel import select
 
-from apps.datasource.crud.permission import get_column_permission_fields, get_row_permission_filters, is_normal_user
+from apps.chat.task.answer_cache import invalidate_answer_cache
+from apps.datasource.crud.permission import get_column_permission_fields, get_row_permission_filters, is_normal_user, \
+    get_permission_fingerprint
+from apps.datasource.crud.schema_cache import SchemaPrompt, schema_prompt_cache, invalidate_schema_prompt_cache
+from apps.datasource.embedding.embedding_cache import invalidate_table_embedding_cache
 from apps.datasource.embedding.table_embedding import calc_table_embedding
 from apps.datasource.utils.utils import aes_decrypt
 from apps.db.constant import DB
-from apps.db.db import get_tables, get_fields, exec_sql, check_connection
+from apps.db.db import get_tables, get_fields, exec_sql, check_connection, invalidate_ds_health
+from apps.db.engine_pool import invalidate_ds_engine
 from apps.db.engine import get_engine_config, get_engine_conn
 from common.core.config import settings
 from common.core.deps import SessionDep, CurrentUser, Trans
@@ -105,6 +111,10 @@ def update_ds(session: SessionDep, trans: Trans, user: CurrentUser, ds: CoreData
         setattr(record, field, value)
     session.add(record)
     session.commit()
+    invalidate_ds_engine(ds.id)
+    invalidate_ds_health(ds.id)
+    invalidate_schema_prompt_cache([ds.id])
+    invalidate_answer_cache([ds.id])
 
     run_save_ds_embeddings([ds.id])
     return ds
@@ -130,6 +140,11 @@ def delete_ds(session: SessionDep, id: int):
 
     session.delete(term)
     session.commit()
+    invalidate_ds_engine(id)
+    invalidate_ds_health(id)
+    invalidate_table_embedding_cache([id])
+    invalidate_schema_prompt_cache([id])
+    invalidate_answer_cache([id])
     delete_table_by_ds_id(session, id)
     delete_field_by_ds_id(session, id)
     return {
@@ -180,6 +195,8 @@ def sync_single_fields(session: SessionDep, trans: Trans, id: int):
     # sync field
     fields = getFieldsByDs(session, ds, table.table_name)
     sync_fields(session, ds, table, fields)
+    invalidate_schema_prompt_cache([ds.id])
+    invalidate_answer_cache([ds.id])
 
     # do table embedding
     run_save_table_embeddings([table.id])
@@ -224,6 +241,9 @@ def sync_table(session: SessionDep, ds: CoreDatasource, tables: List[CoreTable])
         session.query(CoreTable).filter(CoreTable.ds_id == ds.id).delete(synchronize_session=False)
         session.query(CoreField).filter(CoreField.ds_id == ds.id).delete(synchronize_session=False)
         session.commit()
+    invalidate_table_embedding_cache([ds.id])
+    invalidate_schema_prompt_cache([ds.id])
+    invalidate_answer_cache([ds.id])
 
     # do table embedding
     run_save_table_embeddings(id_list)
@@ -266,6 +286,7 @@ def update_table_and_fields(session: SessionDep, data: TableObj):
     update_table(session, data.table)
     for field in data.fields:
         update_field(session, field)
+    invalidate_schema_prompt_cache([data.table.ds_id])
 
     # do table embedding
     run_save_table_embeddings([data.table.id])
@@ -274,6 +295,7 @@ def update_table_and_fields(session: SessionDep, data: TableObj):
 
 def updateTable(session: SessionDep, table: CoreTable):
     update_table(session, table)
+    invalidate_schema_prompt_cache([table.ds_id])
 
     # do table embedding
     run_save_table_embeddings([table.id])
@@ -282,6 +304,7 @@ def updateTable(session: SessionDep, table: CoreTable):
 
 def updateField(session: SessionDep, field: CoreField):
     update_field(session, field)
+    invalidate_schema_prompt_cache([field.ds_id])
 
     # do table embedding
     run_save_table_embeddings([field.table_id])
@@ -396,7 +419,8 @@ def updateNum(session: SessionDep, ds: CoreDatasource):
 
 def get_table_obj_by_ds(session: SessionDep, current_user: CurrentUser, ds: CoreDatasource) -> List[TableAndFields]:
     _list: List = []
-    tables = session.query(CoreTable).filter(CoreTable.ds_id == ds.id).all()
+    # embedding is ranked in the database or from the cached matrix, skip loading the vector column
+    tables = session.query(CoreTable).options(defer(CoreTable.embedding)).filter(CoreTable.ds_id == ds.id).all()
     conf = DatasourceConf(**json.loads(aes_decrypt(ds.configuration))) if ds.type != "excel" else get_engine_config()
     schema = conf.dbSchema if conf.dbSchema is not None and conf.dbSchema != "" else conf.database
 
@@ -424,16 +448,12 @@ def get_table_obj_by_ds(session: SessionDep, current_user: CurrentUser, ds: Core
     return _list
 
 
-def get_table_schema(session: SessionDep, current_user: CurrentUser, ds: CoreDatasource, question: str,
-                     embedding: bool = True) -> str:
-    schema_str = ""
+def build_schema_prompt(session: SessionDep, current_user: CurrentUser, ds: CoreDatasource) -> SchemaPrompt:
     table_objs = get_table_obj_by_ds(session=session, current_user=current_user, ds=ds)
     if len(table_objs) == 0:
-        return schema_str
+        return SchemaPrompt(db_name='', tables=[])
     db_name = table_objs[0].schema
-    schema_str += f"【DB_ID】 {db_name}\n【Schema】\n"
     tables = []
-    all_tables = []  # temp save all tables
     for obj in table_objs:
         schema_table = ''
         schema_table += f"# Table: {db_name}.{obj.table.table_name}" if ds.type != "mysql" and ds.type != "es" else f"# Table: {obj.table.table_name}"
@@ -458,13 +478,41 @@ def get_table_schema(session: SessionDep, current_user: CurrentUser, ds: CoreDat
             schema_table += ",\n".join(field_list)
         schema_table += '\n]\n'
 
-        t_obj = {"id": obj.table.id, "schema_table": schema_table, "embedding": obj.table.embedding}
+        t_obj = {"id": obj.table.id, "schema_table": schema_table}
         tables.append(t_obj)
-        all_tables.append(t_obj)
+
+    # names used by the foreign keys part
+    table_names = {obj.table.id: obj.table.table_name for obj in table_objs}
+    field_names = {}
+    if ds.table_relation:
+        relation_field_ids = []
+        for relation in filter(lambda x: x.get('shape') == 'edge', ds.table_relation):
+            relation_field_ids.append(relation.get('source').get('port'))
+            relation_field_ids.append(relation.get('target').get('port'))
+        if relation_field_ids:
+            field_records = session.query(CoreField.id, CoreField.field_name).filter(
+                CoreField.id.in_(list(map(int, set(relation_field_ids))))).all()
+            field_names = {ele.id: ele.field_name for ele in field_records}
+    return SchemaPrompt(db_name=db_name, tables=tables, table_names=table_names, field_names=field_names)
+
+
+def get_table_schema(session: SessionDep, current_user: CurrentUser, ds: CoreDatasource, question: str,
+                     embedding: bool = True) -> str:
+    schema_str = ""
+    fingerprint = get_permission_fingerprint(session=session, current_user=current_user, ds=ds,
+                                             permission_type='column')
+    prompt = schema_prompt_cache.get(ds.id, fingerprint,
+                                     lambda: build_schema_prompt(session=session, current_user=current_user, ds=ds))
+    if len(prompt.tables) == 0:
+        return schema_str
+    db_name = prompt.db_name
+    schema_str += f"【DB_ID】 {db_name}\n【Schema】\n"
+    tables = list(prompt.tables)
+    all_tables = prompt.tables  # temp save all tables
 
     # do table embedding
     if embedding and tables and settings.TABLE_EMBEDDING_ENABLED:
-        tables = calc_table_embedding(tables, question)
+        tables = calc_table_embedding(tables, question, ds.id, session)
     # splice schema
     if tables:
         for s in tables:
@@ -488,10 +536,7 @@ def get_table_schema(session: SessionDep, current_user: CurrentUser, ds: CoreDat
                 relation_table_ids.append(r.get('target').get('cell'))
             relation_table_ids = list(set(relation_table_ids))
             # get table dict
-            table_records = session.query(CoreTable).filter(CoreTable.id.in_(list(map(int, relation_table_ids)))).all()
-            table_dict = {}
-            for ele in table_records:
-                table_dict[ele.id] = ele.table_name
+            table_dict = prompt.table_names
 
             # get lost table ids
             lost_table_ids = list(set(relation_table_ids) - set(embedding_table_ids))
@@ -502,15 +547,7 @@ def get_table_schema(session: SessionDep, current_user: CurrentUser, ds: CoreDat
                     schema_str += s.get('schema_table')
 
             # get field dict
-            relation_field_ids = []
-            for relation in all_relations:
-                relation_field_ids.append(relation.get('source').get('port'))
-                relation_field_ids.append(relation.get('target').get('port'))
-            relation_field_ids = list(set(relation_field_ids))
-            field_records = session.query(CoreField).filter(CoreField.id.in_(list(map(int, relation_field_ids)))).all()
-            field_dict = {}
-            for ele in field_records:
-                field_dict[ele.id] = ele.field_name
+            field_dict = prompt.field_names
 
             if all_relations:
                 schema_str += '【Foreign keys】\n'
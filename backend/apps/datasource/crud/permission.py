@@ -1,3 +1,4 @@
+import hashlib
 import json
 from typing import List, Optional
 
@@ -72,6 +73,31 @@ def get_column_permission_fields(session: SessionDep, current_user: CurrentUser,
     return fields
 
 
+def get_permission_fingerprint(session: SessionDep, current_user: CurrentUser, ds: CoreDatasource,
+                               permission_type: str) -> str:
+    """
+    identifies the permissions of permission_type ('row' or 'column') that apply to current_user on ds, users with
+    the same effective permissions get the same fingerprint and changed permissions get a new one
+    """
+    if not is_normal_user(current_user):
+        return 'all'
+    table_ids = session.query(CoreTable.id).filter(CoreTable.ds_id == ds.id)
+    permissions = session.query(DsPermission).filter(
+        and_(DsPermission.table_id.in_(table_ids), DsPermission.type == permission_type)).order_by(
+        DsPermission.id).all()
+    contain_rules = session.query(DsRules).all()
+    applied = []
+    for permission in permissions:
+        for r in contain_rules:
+            p_list = json.loads(r.permission_list)
+            u_list = json.loads(r.user_list)
+            if p_list is not None and u_list is not None and permission.id in p_list and (
+                    current_user.id in u_list or f'{current_user.id}' in u_list):
+                applied.append(f'{permission.id}:{permission.table_id}:{permission.model_dump_json()}')
+                break
+    return hashlib.sha256('\n'.join(applied).encode()).hexdigest()
+
+
 def is_normal_user(current_user: CurrentUser):
     return current_user.id != 1
 
@@ -0,0 +1,67 @@
+# Author: Junjun
+# Date: 2025/10/17
+import threading
+import time
+from collections import OrderedDict
+from dataclasses import dataclass, field
+from typing import Callable
+
+from common.core.config import settings
+
+
+@dataclass
+class SchemaPrompt:
+    db_name: str
+    tables: list[dict]  # [{"id", "schema_table"}], rendered block per table in table order
+    table_names: dict[int, str] = field(default_factory=dict)  # every table of the datasource, for relations
+    field_names: dict[int, str] = field(default_factory=dict)  # fields referenced by table relations
+    build_time: float = 0.0
+
+
+class SchemaPromptCache:
+    """
+    process-local LRU of rendered schema prompts keyed by (ds id, column permission fingerprint).
+    entries of a datasource are dropped by invalidate() whenever its tables, fields, comments or relations
+    change, and after SCHEMA_PROMPT_CACHE_TTL seconds (bounds staleness across worker processes);
+    permission edits change the fingerprint, so they need no invalidation
+    """
+
+    def __init__(self):
+        self._entries: OrderedDict[tuple[int, str], SchemaPrompt] = OrderedDict()
+        self._versions: dict[int, int] = {}
+        self._lock = threading.Lock()
+
+    def get(self, ds_id: int, fingerprint: str, build: Callable[[], SchemaPrompt]) -> SchemaPrompt:
+        key = (ds_id, fingerprint)
+        now = time.time()
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is not None and now - entry.build_time < settings.SCHEMA_PROMPT_CACHE_TTL:
+                self._entries.move_to_end(key)
+                return entry
+            version = self._versions.get(ds_id, 0)
+
+        entry = build()
+        entry.build_time = now
+        with self._lock:
+            # skip storing a build that raced with an invalidate
+            if self._versions.get(ds_id, 0) == version:
+                self._entries[key] = entry
+                self._entries.move_to_end(key)
+                while len(self._entries) > settings.SCHEMA_PROMPT_CACHE_MAX_SIZE:
+                    self._entries.popitem(last=False)
+        return entry
+
+    def invalidate(self, ds_id: int):
+        with self._lock:
+            self._versions[ds_id] = self._versions.get(ds_id, 0) + 1
+            for key in [key for key in self._entries if key[0] == ds_id]:
+                del self._entries[key]
+
+
+schema_prompt_cache = SchemaPromptCache()
+
+
+def invalidate_schema_prompt_cache(ds_ids: list[int]):
+    for ds_id in set(ds_ids):
+        schema_prompt_cache.invalidate(ds_id)
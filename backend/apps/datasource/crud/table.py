@@ -1,13 +1,14 @@
-import json
 import time
 import traceback
 from typing import List
 
-from sqlalchemy import and_, select, update
+from sqlalchemy import and_, select
+from sqlalchemy.orm import defer
 
-from apps.ai_model.embedding import EmbeddingModelCache
+from apps.datasource.embedding.embedding_cache import invalidate_table_embedding_cache, invalidate_ds_embedding_cache
 from common.core.config import settings
 from common.core.deps import SessionDep
+from common.utils.embedding_threads import embed_and_save
 from common.utils.utils import SQLBotLogUtil
 from ..models.datasource import CoreTable, CoreField, CoreDatasource
 
@@ -54,6 +55,39 @@ def run_fill_empty_table_and_ds_embedding(session_maker):
         session_maker.remove()
 
 
+def _table_embedding_text(table: CoreTable, fields: List[CoreField]) -> str:
+    schema_table = ''
+    schema_table += f"# Table: {table.table_name}"
+    table_comment = ''
+    if table.custom_comment:
+        table_comment = table.custom_comment.strip()
+    if table_comment == '':
+        schema_table += '\n[\n'
+    else:
+        schema_table += f", {table_comment}\n[\n"
+
+    if fields:
+        field_list = []
+        for field in fields:
+            field_comment = ''
+            if field.custom_comment:
+                field_comment = field.custom_comment.strip()
+            if field_comment == '':
+                field_list.append(f"({field.field_name}:{field.field_type})")
+            else:
+                field_list.append(f"({field.field_name}:{field.field_type}, {field_comment})")
+        schema_table += ",\n".join(field_list)
+    schema_table += '\n]\n'
+    return schema_table
+
+
+def _group_fields(fields: List[CoreField]) -> dict[int, List[CoreField]]:
+    fields_dict = {}
+    for field in fields:
+        fields_dict.setdefault(field.table_id, []).append(field)
+    return fields_dict
+
+
 def save_table_embedding(session_maker, ids: List[int]):
     if not settings.TABLE_EMBEDDING_ENABLED:
         return
@@ -63,40 +97,16 @@ def save_table_embedding(session_maker, ids: List[int]):
     try:
         SQLBotLogUtil.info('start table embedding')
         start_time = time.time()
-        model = EmbeddingModelCache.get_model()
         session = session_maker()
-        for _id in ids:
-            table = session.query(CoreTable).filter(CoreTable.id == _id).first()
-            fields = session.query(CoreField).filter(CoreField.table_id == table.id).all()
-
-            schema_table = ''
-            schema_table += f"# Table: {table.table_name}"
-            table_comment = ''
-            if table.custom_comment:
-                table_comment = table.custom_comment.strip()
-            if table_comment == '':
-                schema_table += '\n[\n'
-            else:
-                schema_table += f", {table_comment}\n[\n"
-
-            if fields:
-                field_list = []
-                for field in fields:
-                    field_comment = ''
-                    if field.custom_comment:
-                        field_comment = field.custom_comment.strip()
-                    if field_comment == '':
-                        field_list.append(f"({field.field_name}:{field.field_type})")
-                    else:
-                        field_list.append(f"({field.field_name}:{field.field_type}, {field_comment})")
-                schema_table += ",\n".join(field_list)
-            schema_table += '\n]\n'
-            # table_schema.append(schema_table)
-            emb = json.dumps(model.embed_query(schema_table))
-
-            stmt = update(CoreTable).where(and_(CoreTable.id == _id)).values(embedding=emb)
-            session.execute(stmt)
-            session.commit()
+        # prefetch tables and their fields with one query each
+        tables = session.query(CoreTable).options(defer(CoreTable.embedding)).filter(
+            CoreTable.id.in_(ids)).order_by(CoreTable.id).all()
+        fields_dict = _group_fields(session.query(CoreField).filter(
+            CoreField.table_id.in_([table.id for table in tables])).order_by(CoreField.id).all())
+        items = [(table.id, _table_embedding_text(table, fields_dict.get(table.id))) for table in tables]
+
+        embed_and_save(session, CoreTable.__tablename__, items)
+        invalidate_table_embedding_cache(list({table.ds_id for table in tables}))
 
         end_time = time.time()
         SQLBotLogUtil.info('table embedding finished in: ' + str(end_time - start_time) + ' seconds')
@@ -115,43 +125,27 @@ def save_ds_embedding(session_maker, ids: List[int]):
     try:
         SQLBotLogUtil.info('start datasource embedding')
         start_time = time.time()
-        model = EmbeddingModelCache.get_model()
         session = session_maker()
-        for _id in ids:
-            schema_table = ''
-            ds = session.query(CoreDatasource).filter(CoreDatasource.id == _id).first()
-            schema_table += f"{ds.name}, {ds.description}\n"
-            tables = session.query(CoreTable).filter(CoreTable.ds_id == ds.id).all()
-            for table in tables:
-                fields = session.query(CoreField).filter(CoreField.table_id == table.id).all()
-
-                schema_table += f"# Table: {table.table_name}"
-                table_comment = ''
-                if table.custom_comment:
-                    table_comment = table.custom_comment.strip()
-                if table_comment == '':
-                    schema_table += '\n[\n'
-                else:
-                    schema_table += f", {table_comment}\n[\n"
-
-                if fields:
-                    field_list = []
-                    for field in fields:
-                        field_comment = ''
-                        if field.custom_comment:
-                            field_comment = field.custom_comment.strip()
-                        if field_comment == '':
-                            field_list.append(f"({field.field_name}:{field.field_type})")
-                        else:
-                            field_list.append(f"({field.field_name}:{field.field_type}, {field_comment})")
-                    schema_table += ",\n".join(field_list)
-                schema_table += '\n]\n'
-            # table_schema.append(schema_table)
-            emb = json.dumps(model.embed_query(schema_table))
-
-            stmt = update(CoreDatasource).where(and_(CoreDatasource.id == _id)).values(embedding=emb)
-            session.execute(stmt)
-            session.commit()
+        # prefetch datasources, tables and fields with one query each
+        ds_list = session.query(CoreDatasource.id, CoreDatasource.name, CoreDatasource.description).filter(
+            CoreDatasource.id.in_(ids)).order_by(CoreDatasource.id).all()
+        tables = session.query(CoreTable).options(defer(CoreTable.embedding)).filter(
+            CoreTable.ds_id.in_(ids)).order_by(CoreTable.id).all()
+        fields_dict = _group_fields(
+            session.query(CoreField).filter(CoreField.ds_id.in_(ids)).order_by(CoreField.id).all())
+        tables_dict = {}
+        for table in tables:
+            tables_dict.setdefault(table.ds_id, []).append(table)
+
+        items = []
+        for ds in ds_list:
+            schema_table = f"{ds.name}, {ds.description}\n"
+            for table in tables_dict.get(ds.id, []):
+                schema_table += _table_embedding_text(table, fields_dict.get(table.id))
+            items.append((ds.id, schema_table))
+
+        embed_and_save(session, CoreDatasource.__tablename__, items)
+        invalidate_ds_embedding_cache()
 
         end_time = time.time()
         SQLBotLogUtil.info('datasource embedding finished in: ' + str(end_time - start_time) + ' seconds')
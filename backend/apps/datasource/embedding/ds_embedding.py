@@ -1,19 +1,28 @@
 # Author: Junjun
 # Date: 2025/9/18
-import json
 import time
 import traceback
 from typing import Optional
 
+from sqlalchemy import text, bindparam
+
 from apps.ai_model.embedding import EmbeddingModelCache
-from apps.datasource.embedding.utils import cosine_similarity
-from apps.datasource.models.datasource import CoreDatasource
+from apps.datasource.embedding.embedding_cache import ds_embedding_cache, ALL_DATASOURCE
+from apps.datasource.embedding.utils import rank_embeddings, rank_matrix_rows, rank_scored_ids
 from apps.system.crud.assistant import AssistantOutDs
 from common.core.config import settings
 from common.core.deps import CurrentAssistant
 from common.core.deps import SessionDep, CurrentUser
 from common.utils.utils import SQLBotLogUtil
 
+ds_embedding_sql = text("""
+SELECT id, ( 1 - (embedding <=> :embedding_array) ) AS similarity
+FROM core_datasource
+WHERE id IN :ids AND embedding IS NOT NULL
+ORDER BY embedding <=> :embedding_array
+LIMIT :top_count
+""").bindparams(bindparam('ids', expanding=True))
+
 
 def get_ds_embedding(session: SessionDep, current_user: CurrentUser, _ds_list, out_ds: AssistantOutDs,
                      question: str,
@@ -35,18 +44,13 @@ def get_ds_embedding(session: SessionDep, current_user: CurrentUser, _ds_list, o
                 model = EmbeddingModelCache.get_model()
                 results = model.embed_documents(text)
 
-                q_embedding = model.embed_query(question)
-                for index in range(len(results)):
-                    item = results[index]
-                    _list[index]['cosine_similarity'] = cosine_similarity(q_embedding, item)
-
-                _list.sort(key=lambda x: x['cosine_similarity'], reverse=True)
-                # print(len(_list))
-                _list = _list[:settings.DS_EMBEDDING_COUNT]
-                SQLBotLogUtil.info(json.dumps(
-                    [{"id": ele.get("id"), "name": ele.get("ds").name,
-                      "cosine_similarity": ele.get("cosine_similarity")}
-                     for ele in _list]))
+                q_embedding = EmbeddingModelCache.embed_query(question)
+                ranked = rank_embeddings(q_embedding, results, settings.DS_EMBEDDING_COUNT)
+                for index, score in ranked:
+                    _list[index]['cosine_similarity'] = score
+                _list = [_list[index] for index, _ in ranked]
+                SQLBotLogUtil.info('datasource embedding ranking: %s',
+                                   [(ele.get("id"), ele.get("ds").name, ele.get("cosine_similarity")) for ele in _list])
                 return [{"id": obj.get('ds').id, "name": obj.get('ds').name, "description": obj.get('ds').description}
                         for obj in _list]
             except Exception:
@@ -54,37 +58,34 @@ def get_ds_embedding(session: SessionDep, current_user: CurrentUser, _ds_list, o
     else:
         for _ds in _ds_list:
             if _ds.get('id'):
-                ds = session.get(CoreDatasource, _ds.get('id'))
-                # table_schema = get_table_schema(session, current_user, ds, question, embedding=False)
-                # ds_info = f"{ds.name}, {ds.description}\n"
-                # ds_schema = ds_info + table_schema
-                _list.append({"id": ds.id, "cosine_similarity": 0.0, "ds": ds, "embedding": ds.embedding})
+                _list.append({"id": _ds.get('id'), "name": _ds.get('name'), "description": _ds.get('description'),
+                              "cosine_similarity": 0.0})
 
         if _list:
             try:
-                # text = [s.get('ds_schema') for s in _list]
-
-                model = EmbeddingModelCache.get_model()
                 start_time = time.time()
-                # results = model.embed_documents(text)
-                results = [item.get('embedding') for item in _list]
-
-                q_embedding = model.embed_query(question)
-                for index in range(len(results)):
-                    item = results[index]
-                    if item:
-                        _list[index]['cosine_similarity'] = cosine_similarity(q_embedding, json.loads(item))
+                ids = [item.get('id') for item in _list]
 
-                _list.sort(key=lambda x: x['cosine_similarity'], reverse=True)
-                # print(len(_list))
+                q_embedding = EmbeddingModelCache.embed_query(question)
+                if settings.EMBEDDING_RANK_IN_DB:
+                    # nearest neighbours among the candidate datasources, ranked by pgvector
+                    results = session.execute(ds_embedding_sql,
+                                              {'embedding_array': str(q_embedding), 'ids': ids,
+                                               'top_count': settings.DS_EMBEDDING_COUNT})
+                    ranked = rank_scored_ids(ids, [(row.id, row.similarity) for row in results],
+                                             settings.DS_EMBEDDING_COUNT)
+                else:
+                    # stored datasource embeddings, cached as one matrix
+                    cached = ds_embedding_cache.get(ALL_DATASOURCE)
+                    ranked = rank_matrix_rows(q_embedding, cached.matrix, cached.rows(ids),
+                                              settings.DS_EMBEDDING_COUNT)
+                for index, score in ranked:
+                    _list[index]['cosine_similarity'] = score
+                _list = [_list[index] for index, _ in ranked]
                 end_time = time.time()
-                SQLBotLogUtil.info(str(end_time - start_time))
-                _list = _list[:settings.DS_EMBEDDING_COUNT]
-                SQLBotLogUtil.info(json.dumps(
-                    [{"id": ele.get("id"), "name": ele.get("ds").name,
-                      "cosine_similarity": ele.get("cosine_similarity")}
-                     for ele in _list]))
-                return [{"id": obj.get('ds').id, "name": obj.get('ds').name, "description": obj.get('ds').description}
+                SQLBotLogUtil.info('datasource embedding ranking in %.3fs: %s', end_time - start_time,
+                                   [(ele.get("id"), ele.get("name"), ele.get("cosine_similarity")) for ele in _list])
+                return [{"id": obj.get('id'), "name": obj.get('name'), "description": obj.get('description')}
                         for obj in _list]
             except Exception:
                 traceback.print_exc()
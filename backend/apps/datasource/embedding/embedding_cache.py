@@ -0,0 +1,115 @@
+# Author: Junjun
+# Date: 2025/10/17
+import threading
+import time
+from dataclasses import dataclass
+from typing import Optional
+
+import numpy as np
+from sqlalchemy import select
+from sqlmodel import Session
+
+from apps.datasource.embedding.utils import to_matrix
+from apps.datasource.models.datasource import CoreTable, CoreDatasource
+from common.core.config import settings
+from common.core.db import engine
+from common.utils.utils import SQLBotLogUtil
+
+# key of the datasource matrix, table matrices are keyed by datasource id
+ALL_DATASOURCE = 0
+
+
+@dataclass
+class EmbeddingMatrix:
+    ids: np.ndarray  # int64, row i belongs to ids[i]
+    matrix: np.ndarray  # float32, one normalized embedding per row
+    index: dict[int, int]  # id -> row
+    version: int
+    build_time: float
+
+    def rows(self, ids: list[int]) -> np.ndarray:
+        return np.fromiter((self.index.get(_id, -1) for _id in ids), dtype=np.int64, count=len(ids))
+
+
+def _build(rows) -> tuple[list[int], list[np.ndarray]]:
+    # pgvector columns are read back as numpy arrays, no parsing needed
+    ids = []
+    vectors = []
+    dim = None
+    for _id, emb in rows:
+        if emb is None or len(emb) == 0:
+            continue
+        if dim is None:
+            dim = len(emb)
+        if len(emb) != dim:
+            SQLBotLogUtil.warning(f"skip embedding of {_id} with dimension {len(emb)}, expected {dim}")
+            continue
+        vectors.append(emb)
+        ids.append(_id)
+    return ids, vectors
+
+
+class EmbeddingMatrixCache:
+    """
+    process-local cache of stored embeddings as contiguous float32 matrices.
+    entries are built lazily with one query, dropped on invalidate() and after EMBEDDING_MATRIX_CACHE_TTL
+    seconds (bounds staleness across worker processes); a build that raced with an invalidate is not stored
+    """
+
+    def __init__(self, name: str, load):
+        self.name = name
+        self._load = load
+        self._entries: dict[int, EmbeddingMatrix] = {}
+        self._versions: dict[int, int] = {}
+        self._lock = threading.Lock()
+
+    def get(self, key: int) -> EmbeddingMatrix:
+        now = time.time()
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is not None and now - entry.build_time < settings.EMBEDDING_MATRIX_CACHE_TTL:
+                return entry
+            version = self._versions.get(key, 0)
+
+        start_time = time.time()
+        with Session(engine) as session:
+            ids, vectors = _build(self._load(session, key))
+        dim = len(vectors[0]) if vectors else 0
+        entry = EmbeddingMatrix(ids=np.asarray(ids, dtype=np.int64),
+                                matrix=to_matrix(vectors) if vectors else np.zeros((0, dim), dtype=np.float32),
+                                index={_id: i for i, _id in enumerate(ids)},
+                                version=version, build_time=now)
+        SQLBotLogUtil.info(f"build {self.name} embedding matrix {key}: {len(ids)} rows in "
+                           f"{time.time() - start_time} seconds")
+        with self._lock:
+            if self._versions.get(key, 0) == version:
+                self._entries[key] = entry
+        return entry
+
+    def invalidate(self, key: Optional[int] = None):
+        with self._lock:
+            keys = [key] if key is not None else list(self._entries.keys())
+            for _key in keys:
+                self._versions[_key] = self._versions.get(_key, 0) + 1
+                self._entries.pop(_key, None)
+
+
+def _load_table_embeddings(session: Session, ds_id: int):
+    return session.execute(select(CoreTable.id, CoreTable.embedding).where(CoreTable.ds_id == ds_id)).all()
+
+
+def _load_ds_embeddings(session: Session, _key: int):
+    return session.execute(select(CoreDatasource.id, CoreDatasource.embedding)).all()
+
+
+table_embedding_cache = EmbeddingMatrixCache('table', _load_table_embeddings)
+ds_embedding_cache = EmbeddingMatrixCache('datasource', _load_ds_embeddings)
+
+
+def invalidate_table_embedding_cache(ds_ids: list[int]):
+    for ds_id in set(ds_ids):
+        table_embedding_cache.invalidate(ds_id)
+
+
+def invalidate_ds_embedding_cache():
+    ds_embedding_cache.invalidate(ALL_DATASOURCE)
@@ -1,14 +1,26 @@
 # Author: Junjun
 # Date: 2025/9/23
-import json
 import time
 import traceback
+from typing import Optional
+
+from sqlalchemy import text
+from sqlmodel import Session
 
 from apps.ai_model.embedding import EmbeddingModelCache
-from apps.datasource.embedding.utils import cosine_similarity
+from apps.datasource.embedding.embedding_cache import table_embedding_cache
+from apps.datasource.embedding.utils import rank_embeddings, rank_matrix_rows, rank_scored_ids
 from common.core.config import settings
 from common.utils.utils import SQLBotLogUtil
 
+table_embedding_sql = """
+SELECT id, ( 1 - (embedding <=> :embedding_array) ) AS similarity
+FROM core_table
+WHERE ds_id = :ds_id AND embedding IS NOT NULL
+ORDER BY embedding <=> :embedding_array
+LIMIT :top_count
+"""
+
 
 def get_table_embedding(tables: list[dict], question: str):
     _list = []
@@ -23,24 +35,23 @@ def get_table_embedding(tables: list[dict], question: str):
             start_time = time.time()
             results = model.embed_documents(text)
             end_time = time.time()
-            SQLBotLogUtil.info(str(end_time - start_time))
-
-            q_embedding = model.embed_query(question)
-            for index in range(len(results)):
-                item = results[index]
-                _list[index]['cosine_similarity'] = cosine_similarity(q_embedding, item)
+            SQLBotLogUtil.info('embed tables in %.3fs', end_time - start_time)
 
-            _list.sort(key=lambda x: x['cosine_similarity'], reverse=True)
-            _list = _list[:settings.TABLE_EMBEDDING_COUNT]
+            q_embedding = EmbeddingModelCache.embed_query(question)
+            ranked = rank_embeddings(q_embedding, results, settings.TABLE_EMBEDDING_COUNT)
+            for index, score in ranked:
+                _list[index]['cosine_similarity'] = score
+            _list = [_list[index] for index, _ in ranked]
             # print(len(_list))
-            SQLBotLogUtil.info(json.dumps(_list))
+            SQLBotLogUtil.info('table embedding ranking: %s', _list)
             return _list
         except Exception:
             traceback.print_exc()
     return _list
 
 
-def calc_table_embedding(tables: list[dict], question: str):
+def calc_table_embedding(tables: list[dict], question: str, ds_id: Optional[int] = None,
+                         session: Optional[Session] = None):
     _list = []
     for table in tables:
         _list.append(
@@ -51,27 +62,34 @@ def calc_table_embedding(tables: list[dict], question: str):
         try:
             # text = [s.get('schema_table') for s in _list]
             #
-            model = EmbeddingModelCache.get_model()
             start_time = time.time()
             # results = model.embed_documents(text)
             # end_time = time.time()
             # SQLBotLogUtil.info(str(end_time - start_time))
-            results = [item.get('embedding') for item in _list]
-
-            q_embedding = model.embed_query(question)
-            for index in range(len(results)):
-                item = results[index]
-                if item:
-                    _list[index]['cosine_similarity'] = cosine_similarity(q_embedding, json.loads(item))
-
-            _list.sort(key=lambda x: x['cosine_similarity'], reverse=True)
-            _list = _list[:settings.TABLE_EMBEDDING_COUNT]
+            q_embedding = EmbeddingModelCache.embed_query(question)
+            if ds_id is not None and session is not None and settings.EMBEDDING_RANK_IN_DB:
+                # nearest neighbours of this datasource, ranked by pgvector
+                results = session.execute(text(table_embedding_sql),
+                                          {'embedding_array': str(q_embedding), 'ds_id': ds_id,
+                                           'top_count': settings.TABLE_EMBEDDING_COUNT})
+                ranked = rank_scored_ids([item.get('id') for item in _list],
+                                         [(row.id, row.similarity) for row in results],
+                                         settings.TABLE_EMBEDDING_COUNT)
+            elif ds_id is not None:
+                # use the cached embedding matrix of this datasource
+                cached = table_embedding_cache.get(ds_id)
+                ranked = rank_matrix_rows(q_embedding, cached.matrix, cached.rows([item.get('id') for item in _list]),
+                                          settings.TABLE_EMBEDDING_COUNT)
+            else:
+                results = [item.get('embedding') for item in _list]
+                ranked = rank_embeddings(q_embedding, results, settings.TABLE_EMBEDDING_COUNT)
+            for index, score in ranked:
+                _list[index]['cosine_similarity'] = score
+            _list = [_list[index] for index, _ in ranked]
             # print(len(_list))
             end_time = time.time()
-            SQLBotLogUtil.info(str(end_time - start_time))
-            SQLBotLogUtil.info(json.dumps([{"id": ele.get('id'), "schema_table": ele.get('schema_table'),
-                                            "cosine_similarity": ele.get('cosine_similarity')}
-                                           for ele in _list]))
+            SQLBotLogUtil.info('table embedding ranking in %.3fs: %s', end_time - start_time,
+                               [(ele.get('id'), ele.get('schema_table'), ele.get('cosine_similarity')) for ele in _list])
             return _list
         except Exception:
             traceback.print_exc()
@@ -1,6 +1,9 @@
 # Author: Junjun
 # Date: 2025/9/23
 import math
+from typing import Sequence
+
+import numpy as np
 
 
 def cosine_similarity(vec_a, vec_b):
@@ -16,3 +19,95 @@ def cosine_similarity(vec_a, vec_b):
         return 0.0
 
     return dot_product / (norm_a * norm_b)
+
+
+def to_matrix(vectors: Sequence[Sequence[float]]) -> np.ndarray:
+    """
+    stack candidate vectors into a contiguous float32 matrix, one row per candidate
+    """
+    return np.ascontiguousarray(np.asarray(vectors, dtype=np.float32))
+
+
+def similarity_scores(query: Sequence[float] | np.ndarray, matrix: np.ndarray, normalized: bool = True) -> np.ndarray:
+    """
+    cosine similarity of query against every row of matrix.
+    the local embedding model is created with normalize_embeddings=True, so for its vectors the
+    cosine similarity is a single matmul; pass normalized=False for vectors of unknown origin
+    """
+    q = np.asarray(query, dtype=np.float32)
+    if matrix.size == 0:
+        return np.zeros(matrix.shape[0], dtype=np.float32)
+    if matrix.shape[1] != q.shape[0]:
+        raise ValueError("The vector dimension must be the same")
+    if normalized:
+        return matrix @ q
+    norms = np.linalg.norm(matrix, axis=1) * np.linalg.norm(q)
+    scores = matrix @ q
+    return np.divide(scores, norms, out=np.zeros_like(scores), where=norms != 0)
+
+
+def top_k_indices(scores: np.ndarray, k: int) -> np.ndarray:
+    """
+    indices of the k highest scores, highest first
+    """
+    n = scores.shape[0]
+    if k <= 0 or n == 0:
+        return np.empty(0, dtype=np.int64)
+    if k < n:
+        part = np.argpartition(-scores, k - 1)[:k]
+    else:
+        part = np.arange(n)
+    return part[np.argsort(-scores[part], kind='stable')]
+
+
+def rank_embeddings(query: Sequence[float], embeddings: Sequence[Sequence[float] | None], k: int,
+                    normalized: bool = True) -> list[tuple[int, float]]:
+    """
+    rank candidates by similarity to query, candidates without embedding score 0.0.
+    returns [(candidate index, score)] for the top k, highest first
+    """
+    if isinstance(embeddings, np.ndarray):
+        scores = similarity_scores(query, embeddings, normalized)
+    else:
+        scores = np.zeros(len(embeddings), dtype=np.float32)
+        valid = [i for i, item in enumerate(embeddings) if item is not None and len(item) > 0]
+        if valid:
+            scores[valid] = similarity_scores(query, to_matrix([embeddings[i] for i in valid]), normalized)
+    return [(int(i), float(scores[i])) for i in top_k_indices(scores, k)]
+
+
+def rank_matrix_rows(query: Sequence[float], matrix: np.ndarray, rows: np.ndarray, k: int,
+                     normalized: bool = True) -> list[tuple[int, float]]:
+    """
+    rank candidates whose embeddings are rows of a prebuilt matrix, rows[i] is the matrix row of
+    candidate i or -1 if it has no embedding (score 0.0).
+    returns [(candidate index, score)] for the top k, highest first
+    """
+    scores = np.zeros(rows.shape[0], dtype=np.float32)
+    valid = rows >= 0
+    if valid.any():
+        scores[valid] = similarity_scores(query, matrix[rows[valid]], normalized)
+    return [(int(i), float(scores[i])) for i in top_k_indices(scores, k)]
+
+
+def rank_scored_ids(ids: Sequence[int], scored: Sequence[tuple[int, float]], k: int) -> list[tuple[int, float]]:
+    """
+    map [(id, score)] already ranked elsewhere (e.g. by pgvector) back to candidate indexes, candidates
+    missing from scored fill the remaining slots with score 0.0 in their original order.
+    returns [(candidate index, score)] for the top k, highest first
+    """
+    position = {_id: i for i, _id in enumerate(ids)}
+    ranked = []
+    seen = set()
+    for _id, score in scored:
+        index = position.get(_id)
+        if index is None or index in seen:
+            continue
+        ranked.append((index, float(score)))
+        seen.add(index)
+    for index in range(len(ids)):
+        if len(ranked) >= k:
+            break
+        if index not in seen:
+            ranked.append((index, 0.0))
+    return ranked[:k]
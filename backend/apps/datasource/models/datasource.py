@@ -1,6 +1,7 @@
 from datetime import datetime
 from typing import List, Optional
 
+from pgvector.sqlalchemy import VECTOR
 from pydantic import BaseModel
 from sqlalchemy import Column, Text, BigInteger, DateTime, Identity
 from sqlalchemy.dialects.postgresql import JSONB
@@ -21,19 +22,19 @@ class CoreDatasource(SQLModel, table=True):
     num: str = Field(max_length=256, nullable=True)
     oid: int = Field(sa_column=Column(BigInteger()))
     table_relation: List = Field(sa_column=Column(JSONB, nullable=True))
-    embedding: str = Field(sa_column=Column(Text, nullable=True))
+    embedding: Optional[List[float]] = Field(sa_column=Column(VECTOR(), nullable=True), exclude=True)
     recommended_config: int = Field(sa_column=Column(BigInteger()))
 
 
 class CoreTable(SQLModel, table=True):
     __tablename__ = "core_table"
     id: int = Field(sa_column=Column(BigInteger, Identity(always=True), nullable=False, primary_key=True))
-    ds_id: int = Field(sa_column=Column(BigInteger()))
+    ds_id: int = Field(sa_column=Column(BigInteger(), index=True))
     checked: bool = Field(default=True)
     table_name: str = Field(sa_column=Column(Text))
     table_comment: str = Field(sa_column=Column(Text))
     custom_comment: str = Field(sa_column=Column(Text))
-    embedding: str = Field(sa_column=Column(Text, nullable=True))
+    embedding: Optional[List[float]] = Field(sa_column=Column(VECTOR(), nullable=True), exclude=True)
 
 
 class DsRecommendedProblem(SQLModel, table=True):
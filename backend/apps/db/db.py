@@ -3,8 +3,9 @@ import json
 import os
 import platform
 import urllib.parse
-from decimal import Decimal
-from typing import Optional
+import uuid
+from itertools import islice
+from typing import Any, Optional, Callable, Sequence, Iterator
 
 import oracledb
 import psycopg2
@@ -18,12 +19,17 @@ if platform.system() != "Darwin":
 import pymysql
 import redshift_connector
 from sqlalchemy import create_engine, text, Engine
-from sqlalchemy.orm import sessionmaker
+from sqlalchemy.exc import DBAPIError, OperationalError
+from sqlalchemy.orm import Session, sessionmaker
 
 from apps.datasource.models.datasource import DatasourceConf, CoreDatasource, TableSchema, ColumnSchema
 from apps.datasource.utils.utils import aes_decrypt
 from apps.db.constant import DB, ConnectType
 from apps.db.engine import get_engine_config
+from apps.db.engine_pool import engine_registry, config_hash, get_pool_args, native_connection
+from apps.db.health_cache import ds_health_cache
+from apps.db.result import ColumnarResult
+from apps.db.result_cache import sql_result_cache
 from apps.system.crud.assistant import get_out_ds_conf
 from apps.system.schemas.system_schema import AssistantOutDsSchema
 from common.core.deps import Trans
@@ -116,32 +122,73 @@ def get_origin_connect(type: str, conf: DatasourceConf):
         )
 
 
+def get_native_connect(type: str, conf: DatasourceConf, timeout: int):
+    extra_config_dict = get_extra_config(conf)
+    if equals_ignore_case(type, 'dm'):
+        return dmPython.connect(user=conf.username, password=conf.password, server=conf.host,
+                                port=conf.port, **extra_config_dict)
+    elif equals_ignore_case(type, 'doris', 'starrocks'):
+        return pymysql.connect(user=conf.username, passwd=conf.password, host=conf.host,
+                               port=conf.port, db=conf.database, connect_timeout=timeout,
+                               read_timeout=timeout, **extra_config_dict)
+    elif equals_ignore_case(type, 'redshift'):
+        return redshift_connector.connect(host=conf.host, port=conf.port, database=conf.database,
+                                          user=conf.username,
+                                          password=conf.password,
+                                          timeout=timeout, **extra_config_dict)
+    elif equals_ignore_case(type, 'kingbase'):
+        return psycopg2.connect(host=conf.host, port=conf.port, database=conf.database,
+                                user=conf.username,
+                                password=conf.password,
+                                connect_timeout=timeout,
+                                options=f"-c statement_timeout={timeout * 1000}",
+                                **extra_config_dict)
+    raise Exception(f'The datasource type {type} not support native connection.')
+
+
+# use py_driver, connections are pooled per datasource
+def get_native_connection(ds: CoreDatasource | AssistantOutDsSchema, conf: DatasourceConf, timeout: int):
+    return native_connection(ds.id, config_hash(ds.type, conf.model_dump_json(), timeout),
+                             lambda: get_native_connect(ds.type, conf, timeout), timeout)
+
+
 # use sqlalchemy
 def get_engine(ds: CoreDatasource, timeout: int = 0) -> Engine:
+    # unsaved datasource (e.g. check connection while editing) is not pooled
+    if not settings.DS_ENGINE_CACHE_ENABLED or ds.id is None:
+        return create_ds_engine(ds, timeout)
+    return engine_registry.get(ds.id, config_hash(ds.type, ds.configuration, timeout),
+                               lambda: create_ds_engine(ds, timeout, get_pool_args(ds.type)))
+
+
+def create_ds_engine(ds: CoreDatasource, timeout: int = 0, pool_args: Optional[dict] = None) -> Engine:
     conf = DatasourceConf(**json.loads(aes_decrypt(ds.configuration))) if not equals_ignore_case(ds.type,
                                                                                                  "excel") else get_engine_config()
     if conf.timeout is None:
         conf.timeout = timeout
     if timeout > 0:
         conf.timeout = timeout
+    if pool_args is None:
+        pool_args = {}
     if equals_ignore_case(ds.type, "pg"):
         if conf.dbSchema is not None and conf.dbSchema != "":
             engine = create_engine(get_uri(ds),
                                    connect_args={"options": f"-c search_path={urllib.parse.quote(conf.dbSchema)}",
                                                  "connect_timeout": conf.timeout},
-                                   pool_timeout=conf.timeout)
+                                   pool_timeout=conf.timeout, **pool_args)
         else:
             engine = create_engine(get_uri(ds),
                                    connect_args={"connect_timeout": conf.timeout},
-                                   pool_timeout=conf.timeout)
+                                   pool_timeout=conf.timeout, **pool_args)
     elif equals_ignore_case(ds.type, 'sqlServer'):
         engine = create_engine('mssql+pymssql://', creator=lambda: get_origin_connect(ds.type, conf),
-                               pool_timeout=conf.timeout)
+                               pool_timeout=conf.timeout, **pool_args)
     elif equals_ignore_case(ds.type, 'oracle'):
         engine = create_engine(get_uri(ds),
-                               pool_timeout=conf.timeout)
+                               pool_timeout=conf.timeout, **pool_args)
     else:  # mysql, ck
-        engine = create_engine(get_uri(ds), connect_args={"connect_timeout": conf.timeout}, pool_timeout=conf.timeout)
+        engine = create_engine(get_uri(ds), connect_args={"connect_timeout": conf.timeout}, pool_timeout=conf.timeout,
+                               **pool_args)
     return engine
 
 
@@ -176,10 +223,8 @@ def check_connection(trans: Optional[Trans], ds: CoreDatasource | AssistantOutDs
             return False
     else:
         conf = DatasourceConf(**json.loads(aes_decrypt(ds.configuration)))
-        extra_config_dict = get_extra_config(conf)
         if equals_ignore_case(ds.type, 'dm'):
-            with dmPython.connect(user=conf.username, password=conf.password, server=conf.host,
-                                  port=conf.port, **extra_config_dict) as conn, conn.cursor() as cursor:
+            with get_native_connection(ds, conf, 10) as conn, conn.cursor() as cursor:
                 try:
                     cursor.execute('select 1', timeout=10).fetchall()
                     SQLBotLogUtil.info("success")
@@ -190,9 +235,7 @@ def check_connection(trans: Optional[Trans], ds: CoreDatasource | AssistantOutDs
                         raise HTTPException(status_code=500, detail=trans('i18n_ds_invalid') + f': {e.args}')
                     return False
         elif equals_ignore_case(ds.type, 'doris', 'starrocks'):
-            with pymysql.connect(user=conf.username, passwd=conf.password, host=conf.host,
-                                 port=conf.port, db=conf.database, connect_timeout=10,
-                                 read_timeout=10, **extra_config_dict) as conn, conn.cursor() as cursor:
+            with get_native_connection(ds, conf, 10) as conn, conn.cursor() as cursor:
                 try:
                     cursor.execute('select 1')
                     SQLBotLogUtil.info("success")
@@ -203,10 +246,7 @@ def check_connection(trans: Optional[Trans], ds: CoreDatasource | AssistantOutDs
                         raise HTTPException(status_code=500, detail=trans('i18n_ds_invalid') + f': {e.args}')
                     return False
         elif equals_ignore_case(ds.type, 'redshift'):
-            with redshift_connector.connect(host=conf.host, port=conf.port, database=conf.database,
-                                            user=conf.username,
-                                            password=conf.password,
-                                            timeout=10, **extra_config_dict) as conn, conn.cursor() as cursor:
+            with get_native_connection(ds, conf, 10) as conn, conn.cursor() as cursor:
                 try:
                     cursor.execute('select 1')
                     SQLBotLogUtil.info("success")
@@ -217,10 +257,7 @@ def check_connection(trans: Optional[Trans], ds: CoreDatasource | AssistantOutDs
                         raise HTTPException(status_code=500, detail=trans('i18n_ds_invalid') + f': {e.args}')
                     return False
         elif equals_ignore_case(ds.type, 'kingbase'):
-            with psycopg2.connect(host=conf.host, port=conf.port, database=conf.database,
-                                  user=conf.username,
-                                  password=conf.password,
-                                  connect_timeout=10, **extra_config_dict) as conn, conn.cursor() as cursor:
+            with get_native_connection(ds, conf, 10) as conn, conn.cursor() as cursor:
                 try:
                     cursor.execute('select 1')
                     SQLBotLogUtil.info("success")
@@ -279,17 +316,13 @@ def get_version(ds: CoreDatasource | AssistantOutDsSchema):
                     res = result.fetchall()
                     version = res[0][0]
         else:
-            extra_config_dict = get_extra_config(conf)
             if equals_ignore_case(ds.type, 'dm'):
-                with dmPython.connect(user=conf.username, password=conf.password, server=conf.host,
-                                      port=conf.port) as conn, conn.cursor() as cursor:
-                    cursor.execute(sql, timeout=10, **extra_config_dict)
+                with get_native_connection(ds, conf, 10) as conn, conn.cursor() as cursor:
+                    cursor.execute(sql, timeout=10)
                     res = cursor.fetchall()
                     version = res[0][0]
             elif equals_ignore_case(ds.type, 'doris', 'starrocks'):
-                with pymysql.connect(user=conf.username, passwd=conf.password, host=conf.host,
-                                     port=conf.port, db=conf.database, connect_timeout=10,
-                                     read_timeout=10, **extra_config_dict) as conn, conn.cursor() as cursor:
+                with get_native_connection(ds, conf, 10) as conn, conn.cursor() as cursor:
                     cursor.execute(sql)
                     res = cursor.fetchall()
                     version = res[0][0]
@@ -301,6 +334,35 @@ def get_version(ds: CoreDatasource | AssistantOutDsSchema):
     return version.decode() if isinstance(version, bytes) else version
 
 
+def _health_key(ds: CoreDatasource | AssistantOutDsSchema) -> tuple[tuple, str]:
+    if isinstance(ds, AssistantOutDsSchema):
+        # configuration of an assistant datasource is unset until a connection check fills it in, with the timeout
+        # of that check (get_out_ds_conf), so it differs between calls. hash the plain connection fields instead
+        return ('assistant', ds.id), config_hash(ds.type, '|'.join(
+            str(item) for item in [ds.host, ds.port, ds.dataBase, ds.user, ds.password, ds.db_schema, ds.extraParams]))
+    return ('ds', ds.id), config_hash(ds.type, ds.configuration)
+
+
+def get_cached_version(ds: CoreDatasource | AssistantOutDsSchema) -> str:
+    key, config = _health_key(ds)
+    return ds_health_cache.get(key, config, 'version', lambda: get_version(ds))
+
+
+def check_cached_connection(ds: CoreDatasource | AssistantOutDsSchema) -> bool:
+    """
+    check_connection, skipped while a probe or query succeeded within DS_HEALTH_CACHE_TTL
+    """
+    if isinstance(ds, AssistantOutDsSchema):
+        # set by check_connection otherwise, the native drivers read it in exec_sql
+        ds.configuration = get_out_ds_conf(ds, 10)
+    key, config = _health_key(ds)
+    return ds_health_cache.get(key, config, 'connection', lambda: check_connection(trans=None, ds=ds))
+
+
+def invalidate_ds_health(ds_id: int):
+    ds_health_cache.invalidate(('ds', ds_id))
+
+
 def get_schema(ds: CoreDatasource):
     conf = DatasourceConf(**json.loads(aes_decrypt(ds.configuration))) if ds.type != "excel" else get_engine_config()
     db = DB.get_db(ds.type)
@@ -318,27 +380,20 @@ def get_schema(ds: CoreDatasource):
                 res_list = [item[0] for item in res]
                 return res_list
     else:
-        extra_config_dict = get_extra_config(conf)
         if equals_ignore_case(ds.type, 'dm'):
-            with dmPython.connect(user=conf.username, password=conf.password, server=conf.host,
-                                  port=conf.port, **extra_config_dict) as conn, conn.cursor() as cursor:
+            with get_native_connection(ds, conf, conf.timeout) as conn, conn.cursor() as cursor:
                 cursor.execute("""select OBJECT_NAME from dba_objects where object_type='SCH'""", timeout=conf.timeout)
                 res = cursor.fetchall()
                 res_list = [item[0] for item in res]
                 return res_list
         elif equals_ignore_case(ds.type, 'redshift'):
-            with redshift_connector.connect(host=conf.host, port=conf.port, database=conf.database, user=conf.username,
-                                            password=conf.password,
-                                            timeout=conf.timeout, **extra_config_dict) as conn, conn.cursor() as cursor:
+            with get_native_connection(ds, conf, conf.timeout) as conn, conn.cursor() as cursor:
                 cursor.execute("""SELECT nspname FROM pg_namespace""")
                 res = cursor.fetchall()
                 res_list = [item[0] for item in res]
                 return res_list
         elif equals_ignore_case(ds.type, 'kingbase'):
-            with psycopg2.connect(host=conf.host, port=conf.port, database=conf.database, user=conf.username,
-                                  password=conf.password,
-                                  options=f"-c statement_timeout={conf.timeout * 1000}",
-                                  **extra_config_dict) as conn, conn.cursor() as cursor:
+            with get_native_connection(ds, conf, conf.timeout) as conn, conn.cursor() as cursor:
                 cursor.execute("""SELECT nspname FROM pg_namespace""")
                 res = cursor.fetchall()
                 res_list = [item[0] for item in res]
@@ -357,35 +412,26 @@ def get_tables(ds: CoreDatasource):
                 res_list = [TableSchema(*item) for item in res]
                 return res_list
     else:
-        extra_config_dict = get_extra_config(conf)
         if equals_ignore_case(ds.type, 'dm'):
-            with dmPython.connect(user=conf.username, password=conf.password, server=conf.host,
-                                  port=conf.port, **extra_config_dict) as conn, conn.cursor() as cursor:
+            with get_native_connection(ds, conf, conf.timeout) as conn, conn.cursor() as cursor:
                 cursor.execute(sql, {"param": sql_param}, timeout=conf.timeout)
                 res = cursor.fetchall()
                 res_list = [TableSchema(*item) for item in res]
                 return res_list
         elif equals_ignore_case(ds.type, 'doris', 'starrocks'):
-            with pymysql.connect(user=conf.username, passwd=conf.password, host=conf.host,
-                                 port=conf.port, db=conf.database, connect_timeout=conf.timeout,
-                                 read_timeout=conf.timeout, **extra_config_dict) as conn, conn.cursor() as cursor:
+            with get_native_connection(ds, conf, conf.timeout) as conn, conn.cursor() as cursor:
                 cursor.execute(sql, (sql_param,))
                 res = cursor.fetchall()
                 res_list = [TableSchema(*item) for item in res]
                 return res_list
         elif equals_ignore_case(ds.type, 'redshift'):
-            with redshift_connector.connect(host=conf.host, port=conf.port, database=conf.database, user=conf.username,
-                                            password=conf.password,
-                                            timeout=conf.timeout, **extra_config_dict) as conn, conn.cursor() as cursor:
+            with get_native_connection(ds, conf, conf.timeout) as conn, conn.cursor() as cursor:
                 cursor.execute(sql, (sql_param,))
                 res = cursor.fetchall()
                 res_list = [TableSchema(*item) for item in res]
                 return res_list
         elif equals_ignore_case(ds.type, 'kingbase'):
-            with psycopg2.connect(host=conf.host, port=conf.port, database=conf.database, user=conf.username,
-                                  password=conf.password,
-                                  options=f"-c statement_timeout={conf.timeout * 1000}",
-                                  **extra_config_dict) as conn, conn.cursor() as cursor:
+            with get_native_connection(ds, conf, conf.timeout) as conn, conn.cursor() as cursor:
                 cursor.execute(sql.format(sql_param))
                 res = cursor.fetchall()
                 res_list = [TableSchema(*item) for item in res]
@@ -408,35 +454,26 @@ def get_fields(ds: CoreDatasource, table_name: str = None):
                 res_list = [ColumnSchema(*item) for item in res]
                 return res_list
     else:
-        extra_config_dict = get_extra_config(conf)
         if equals_ignore_case(ds.type, 'dm'):
-            with dmPython.connect(user=conf.username, password=conf.password, server=conf.host,
-                                  port=conf.port, **extra_config_dict) as conn, conn.cursor() as cursor:
+            with get_native_connection(ds, conf, conf.timeout) as conn, conn.cursor() as cursor:
                 cursor.execute(sql, {"param1": p1, "param2": p2}, timeout=conf.timeout)
                 res = cursor.fetchall()
                 res_list = [ColumnSchema(*item) for item in res]
                 return res_list
         elif equals_ignore_case(ds.type, 'doris', 'starrocks'):
-            with pymysql.connect(user=conf.username, passwd=conf.password, host=conf.host,
-                                 port=conf.port, db=conf.database, connect_timeout=conf.timeout,
-                                 read_timeout=conf.timeout, **extra_config_dict) as conn, conn.cursor() as cursor:
+            with get_native_connection(ds, conf, conf.timeout) as conn, conn.cursor() as cursor:
                 cursor.execute(sql, (p1, p2))
                 res = cursor.fetchall()
                 res_list = [ColumnSchema(*item) for item in res]
                 return res_list
         elif equals_ignore_case(ds.type, 'redshift'):
-            with redshift_connector.connect(host=conf.host, port=conf.port, database=conf.database, user=conf.username,
-                                            password=conf.password,
-                                            timeout=conf.timeout, **extra_config_dict) as conn, conn.cursor() as cursor:
+            with get_native_connection(ds, conf, conf.timeout) as conn, conn.cursor() as cursor:
                 cursor.execute(sql, (p1, p2))
                 res = cursor.fetchall()
                 res_list = [ColumnSchema(*item) for item in res]
                 return res_list
         elif equals_ignore_case(ds.type, 'kingbase'):
-            with psycopg2.connect(host=conf.host, port=conf.port, database=conf.database, user=conf.username,
-                                  password=conf.password,
-                                  options=f"-c statement_timeout={conf.timeout * 1000}",
-                                  **extra_config_dict) as conn, conn.cursor() as cursor:
+            with get_native_connection(ds, conf, conf.timeout) as conn, conn.cursor() as cursor:
                 cursor.execute(sql.format(p1, p2))
                 res = cursor.fetchall()
                 res_list = [ColumnSchema(*item) for item in res]
@@ -448,116 +485,293 @@ def get_fields(ds: CoreDatasource, table_name: str = None):
 
 
 def exec_sql(ds: CoreDatasource | AssistantOutDsSchema, sql: str, origin_column=False):
+    return exec_sql_result(ds, sql, origin_column).to_dict()
+
+
+def _value_size(value) -> int:
+    # rough in-memory size of a cell, enough to bound a result
+    if isinstance(value, (str, bytes, bytearray)):
+        return len(value)
+    return 8
+
+
+def _fetch_rows(fetchmany: Callable[[int], Sequence], max_rows: Optional[int], max_bytes: Optional[int]):
+    """
+    fetch rows in SQL_FETCH_BATCH_SIZE batches until the result ends, max_rows rows are read or the values
+    exceed max_bytes, returns the rows and whether the result was cut
+    """
+    rows = []
+    size = 0
+    batch_size = settings.SQL_FETCH_BATCH_SIZE
+    while True:
+        # one row beyond max_rows tells whether the result is complete
+        batch = fetchmany(batch_size if max_rows is None else min(batch_size, max_rows - len(rows) + 1))
+        if not batch:
+            return rows, False
+        for row in batch:
+            if max_rows is not None and len(rows) >= max_rows:
+                return rows, True
+            if max_bytes is not None:
+                size += sum(_value_size(value) for value in row)
+                if size > max_bytes:
+                    return rows, True
+            rows.append(row)
+
+
+# raised by the drivers when the datasource cannot be reached or the connection is lost, OSError covers sockets,
+# requests (es) and the TimeoutError of the native pools
+_connection_errors = (OSError, psycopg2.OperationalError, psycopg2.InterfaceError, redshift_connector.InterfaceError,
+                      oracledb.OperationalError)
+if platform.system() != "Darwin":
+    _connection_errors += (getattr(dmPython, 'OperationalError', OSError),)
+
+
+def _is_connection_error(e: BaseException) -> bool:
+    """
+    whether running a query failed on the connection rather than on the sql (syntax, permissions, unknown tables
+    or columns, as generated sql often does)
+    """
+    if isinstance(e, ParseSQLResultError):
+        # the native drivers run the sql inside it, the driver error is its cause
+        e = e.__cause__
+    if isinstance(e, DBAPIError):
+        # the dialect tells a lost connection apart (is_disconnect)
+        if e.connection_invalidated:
+            return True
+        if not isinstance(e.orig, pymysql.err.MySQLError):
+            return isinstance(e, OperationalError)
+        e = e.orig
+    if isinstance(e, pymysql.err.MySQLError):
+        # server errors of the sql are OperationalError in pymysql too, client errors (can't connect, server
+        # gone away, lost connection) are numbered 2000-2999
+        code = e.args[0] if e.args else None
+        return isinstance(e, pymysql.err.InterfaceError) or (
+                isinstance(e, pymysql.err.OperationalError) and isinstance(code, int) and 2000 <= code < 3000)
+    return isinstance(e, _connection_errors)
+
+
+def _close_unread_result(conn: Any) -> bool:
+    """
+    the mysql protocol cannot stop the server sending an unbuffered (pymysql SSCursor) result, closing the cursor
+    reads it to the end. when fetching stopped early the socket is closed instead, which aborts the transfer.
+    the connection is unusable afterwards, its pool drops it (rollback fails on checkin). returns whether it was
+    closed
+    """
+    if not isinstance(conn, pymysql.connections.Connection):
+        return False
+    result = conn._result
+    if result is None or not result.unbuffered_active:
+        return False
+    # cursor.close() and the result's __del__ both drain a result that is still active and current
+    result.unbuffered_active = False
+    conn._result = None
+    conn._force_close()
+    return True
+
+
+def _drop_unread_result(session: Session):
+    connection = session.connection()
+    if _close_unread_result(connection.connection.dbapi_connection):
+        connection.invalidate()
+
+
+def exec_sql_result(ds: CoreDatasource | AssistantOutDsSchema, sql: str, origin_column=False,
+                    max_rows: Optional[int] = None, max_bytes: Optional[int] = None,
+                    cache_scope: Optional[str] = None) -> ColumnarResult:
+    """
+    run sql on the datasource, with max_rows or max_bytes the rows are read through a server-side cursor
+    (where the driver has one) and fetching stops at the cap, the result is then marked as truncated.
+    with cache_scope (the permission fingerprint of the caller) the result is served from the sql result cache
+    """
+    while sql.endswith(';'):
+        sql = sql[:-1]
+
+    try:
+        if cache_scope is not None and settings.SQL_RESULT_CACHE_ENABLED:
+            key = sql_result_cache.key(ds, sql, cache_scope, origin_column, max_rows, max_bytes)
+            result = sql_result_cache.get_or_execute(
+                ds, key, lambda: _exec_sql_result(ds, sql, origin_column, max_rows, max_bytes))
+        else:
+            result = _exec_sql_result(ds, sql, origin_column, max_rows, max_bytes)
+    except Exception as e:
+        # errors of the sql itself keep the cached health, probe again next time only when the connection failed
+        if _is_connection_error(e):
+            ds_health_cache.invalidate(_health_key(ds)[0])
+        raise
+    key, config = _health_key(ds)
+    ds_health_cache.mark(key, config, 'connection', True)
+    return result
+
+
+def _iter_batches(fetchmany: Callable[[int], Sequence]) -> Iterator[Sequence]:
+    while True:
+        batch = fetchmany(settings.SQL_FETCH_BATCH_SIZE)
+        if not batch:
+            return
+        yield batch
+
+
+def iter_sql_result(ds: CoreDatasource, sql: str, origin_column=False) -> Iterator[ColumnarResult]:
+    """
+    run sql on the datasource and yield its result in SQL_FETCH_BATCH_SIZE row batches, read through a
+    server-side cursor where the driver has one, so the whole result is never held at once (exports).
+    the connection stays open until the iterator is exhausted or closed, closing it early does not read the rest
+    of the result
+    """
     while sql.endswith(';'):
         sql = sql[:-1]
 
     db = DB.get_db(ds.type)
     if db.connect_type == ConnectType.sqlalchemy:
+        statement = text(sql).execution_options(yield_per=settings.SQL_FETCH_BATCH_SIZE)
         with get_session(ds) as session:
-            with session.execute(text(sql)) as result:
+            with session.execute(statement) as result:
+                columns = result.keys()._keys if origin_column else [item.lower() for item in result.keys()._keys]
+                try:
+                    for batch in _iter_batches(result.fetchmany):
+                        yield ColumnarResult.from_rows(columns, batch)
+                except GeneratorExit:
+                    # closed before the end of the result (export cap, client gone)
+                    _drop_unread_result(session)
+                    raise
+        return
+
+    conf = DatasourceConf(**json.loads(aes_decrypt(ds.configuration)))
+    if equals_ignore_case(ds.type, 'es'):
+        res, fields = get_es_data_by_http(conf, sql)
+        columns = [field.get('name') if origin_column else field.get('name').lower() for field in fields]
+        rows = iter(res)
+        for batch in _iter_batches(lambda size: list(islice(rows, size))):
+            yield ColumnarResult.from_rows(columns, batch)
+        return
+
+    if equals_ignore_case(ds.type, 'doris', 'starrocks'):
+        cursor_args = (pymysql.cursors.SSCursor,)
+    elif equals_ignore_case(ds.type, 'kingbase'):
+        cursor_args = (f'sqlbot_{uuid.uuid4().hex}',)
+    else:
+        # dm and redshift have no server-side cursor (redshift_connector buffers the whole result on execute),
+        # rows are still converted batch by batch
+        cursor_args = ()
+    with get_native_connection(ds, conf, conf.timeout) as conn, conn.cursor(*cursor_args) as cursor:
+        if equals_ignore_case(ds.type, 'dm'):
+            cursor.execute(sql, timeout=conf.timeout)
+        else:
+            cursor.execute(sql)
+        columns = None
+        try:
+            for batch in _iter_batches(cursor.fetchmany):
+                # kingbase only describes a named cursor after the first fetch
+                if columns is None:
+                    columns = [field[0] if origin_column else field[0].lower() for field in cursor.description]
+                yield ColumnarResult.from_rows(columns, batch)
+        except GeneratorExit:
+            _close_unread_result(conn)
+            raise
+
+
+def _exec_sql_result(ds: CoreDatasource | AssistantOutDsSchema, sql: str, origin_column: bool,
+                     max_rows: Optional[int], max_bytes: Optional[int]) -> ColumnarResult:
+
+    stream = max_rows is not None or max_bytes is not None
+    encoded_sql = bytes.decode(base64.b64encode(bytes(sql, 'utf-8')))
+    truncated = False
+    db = DB.get_db(ds.type)
+    if db.connect_type == ConnectType.sqlalchemy:
+        statement = text(sql)
+        if stream:
+            # server-side cursor: SSCursor for pymysql, named cursor for psycopg2, buffered for the others
+            statement = statement.execution_options(yield_per=settings.SQL_FETCH_BATCH_SIZE)
+        with get_session(ds) as session:
+            with session.execute(statement) as result:
                 try:
                     columns = result.keys()._keys if origin_column else [item.lower() for item in result.keys()._keys]
-                    res = result.fetchall()
-                    result_list = [
-                        {str(columns[i]): float(value) if isinstance(value, Decimal) else value for i, value in
-                         enumerate(tuple_item)}
-                        for tuple_item in res
-                    ]
-                    return {"fields": columns, "data": result_list,
-                            "sql": bytes.decode(base64.b64encode(bytes(sql, 'utf-8')))}
+                    if stream:
+                        res, truncated = _fetch_rows(result.fetchmany, max_rows, max_bytes)
+                        if truncated:
+                            _drop_unread_result(session)
+                    else:
+                        res = result.fetchall()
+                    return ColumnarResult.from_rows(columns, res, encoded_sql, truncated)
                 except Exception as ex:
-                    raise ParseSQLResultError(str(ex))
+                    raise ParseSQLResultError(str(ex)) from ex
     else:
         conf = DatasourceConf(**json.loads(aes_decrypt(ds.configuration)))
-        extra_config_dict = get_extra_config(conf)
         if equals_ignore_case(ds.type, 'dm'):
-            with dmPython.connect(user=conf.username, password=conf.password, server=conf.host,
-                                  port=conf.port, **extra_config_dict) as conn, conn.cursor() as cursor:
+            with get_native_connection(ds, conf, conf.timeout) as conn, conn.cursor() as cursor:
                 try:
                     cursor.execute(sql, timeout=conf.timeout)
-                    res = cursor.fetchall()
+                    if stream:
+                        res, truncated = _fetch_rows(cursor.fetchmany, max_rows, max_bytes)
+                    else:
+                        res = cursor.fetchall()
                     columns = [field[0] for field in cursor.description] if origin_column else [field[0].lower() for
                                                                                                 field in
                                                                                                 cursor.description]
-                    result_list = [
-                        {str(columns[i]): float(value) if isinstance(value, Decimal) else value for i, value in
-                         enumerate(tuple_item)}
-                        for tuple_item in res
-                    ]
-                    return {"fields": columns, "data": result_list,
-                            "sql": bytes.decode(base64.b64encode(bytes(sql, 'utf-8')))}
+                    return ColumnarResult.from_rows(columns, res, encoded_sql, truncated)
                 except Exception as ex:
-                    raise ParseSQLResultError(str(ex))
+                    raise ParseSQLResultError(str(ex)) from ex
         elif equals_ignore_case(ds.type, 'doris', 'starrocks'):
-            with pymysql.connect(user=conf.username, passwd=conf.password, host=conf.host,
-                                 port=conf.port, db=conf.database, connect_timeout=conf.timeout,
-                                 read_timeout=conf.timeout, **extra_config_dict) as conn, conn.cursor() as cursor:
+            with get_native_connection(ds, conf, conf.timeout) as conn, conn.cursor(
+                    pymysql.cursors.SSCursor if stream else None) as cursor:
                 try:
                     cursor.execute(sql)
-                    res = cursor.fetchall()
+                    if stream:
+                        res, truncated = _fetch_rows(cursor.fetchmany, max_rows, max_bytes)
+                        if truncated:
+                            _close_unread_result(conn)
+                    else:
+                        res = cursor.fetchall()
                     columns = [field[0] for field in cursor.description] if origin_column else [field[0].lower() for
                                                                                                 field in
                                                                                                 cursor.description]
-                    result_list = [
-                        {str(columns[i]): float(value) if isinstance(value, Decimal) else value for i, value in
-                         enumerate(tuple_item)}
-                        for tuple_item in res
-                    ]
-                    return {"fields": columns, "data": result_list,
-                            "sql": bytes.decode(base64.b64encode(bytes(sql, 'utf-8')))}
+                    return ColumnarResult.from_rows(columns, res, encoded_sql, truncated)
                 except Exception as ex:
-                    raise ParseSQLResultError(str(ex))
+                    raise ParseSQLResultError(str(ex)) from ex
         elif equals_ignore_case(ds.type, 'redshift'):
-            with redshift_connector.connect(host=conf.host, port=conf.port, database=conf.database, user=conf.username,
-                                            password=conf.password,
-                                            timeout=conf.timeout, **extra_config_dict) as conn, conn.cursor() as cursor:
+            # redshift_connector has no server-side cursor and buffers the whole result (_cached_rows) on
+            # execute, the caps only bound the rows kept, not the driver's memory
+            with get_native_connection(ds, conf, conf.timeout) as conn, conn.cursor() as cursor:
                 try:
                     cursor.execute(sql)
-                    res = cursor.fetchall()
+                    if stream:
+                        res, truncated = _fetch_rows(cursor.fetchmany, max_rows, max_bytes)
+                    else:
+                        res = cursor.fetchall()
                     columns = [field[0] for field in cursor.description] if origin_column else [field[0].lower() for
                                                                                                 field in
                                                                                                 cursor.description]
-                    result_list = [
-                        {str(columns[i]): float(value) if isinstance(value, Decimal) else value for i, value in
-                         enumerate(tuple_item)}
-                        for tuple_item in res
-                    ]
-                    return {"fields": columns, "data": result_list,
-                            "sql": bytes.decode(base64.b64encode(bytes(sql, 'utf-8')))}
+                    return ColumnarResult.from_rows(columns, res, encoded_sql, truncated)
                 except Exception as ex:
-                    raise ParseSQLResultError(str(ex))
+                    raise ParseSQLResultError(str(ex)) from ex
         elif equals_ignore_case(ds.type, 'kingbase'):
-            with psycopg2.connect(host=conf.host, port=conf.port, database=conf.database, user=conf.username,
-                                  password=conf.password,
-                                  options=f"-c statement_timeout={conf.timeout * 1000}",
-                                  **extra_config_dict) as conn, conn.cursor() as cursor:
+            # named cursor is declared on the server, description is only set after the first fetch
+            with get_native_connection(ds, conf, conf.timeout) as conn, conn.cursor(
+                    f'sqlbot_{uuid.uuid4().hex}' if stream else None) as cursor:
                 try:
                     cursor.execute(sql)
-                    res = cursor.fetchall()
+                    if stream:
+                        res, truncated = _fetch_rows(cursor.fetchmany, max_rows, max_bytes)
+                    else:
+                        res = cursor.fetchall()
                     columns = [field[0] for field in cursor.description] if origin_column else [field[0].lower() for
                                                                                                 field in
                                                                                                 cursor.description]
-                    result_list = [
-                        {str(columns[i]): float(value) if isinstance(value, Decimal) else value for i, value in
-                         enumerate(tuple_item)}
-                        for tuple_item in res
-                    ]
-                    return {"fields": columns, "data": result_list,
-                            "sql": bytes.decode(base64.b64encode(bytes(sql, 'utf-8')))}
+                    return ColumnarResult.from_rows(columns, res, encoded_sql, truncated)
                 except Exception as ex:
-                    raise ParseSQLResultError(str(ex))
+                    raise ParseSQLResultError(str(ex)) from ex
         elif equals_ignore_case(ds.type, 'es'):
             try:
                 res, columns = get_es_data_by_http(conf, sql)
+                if stream:
+                    rows = iter(res)
+                    res, truncated = _fetch_rows(lambda size: list(islice(rows, size)), max_rows, max_bytes)
                 columns = [field.get('name') for field in columns] if origin_column else [field.get('name').lower() for
                                                                                           field in
                                                                                           columns]
-                result_list = [
-                    {str(columns[i]): float(value) if isinstance(value, Decimal) else value for i, value in
-                     enumerate(tuple(tuple_item))}
-                    for tuple_item in res
-                ]
-                return {"fields": columns, "data": result_list,
-                        "sql": bytes.decode(base64.b64encode(bytes(sql, 'utf-8')))}
+                return ColumnarResult.from_rows(columns, res, encoded_sql, truncated)
+            except OSError:
+                # requests could not reach the datasource
+                raise
             except Exception as ex:
                 raise Exception(str(ex))
@@ -0,0 +1,319 @@
+# Author: Junjun
+# Date: 2025/10/17
+import hashlib
+import threading
+import time
+from collections import OrderedDict, deque
+from contextlib import contextmanager
+from typing import Any, Callable, Optional
+
+from sqlalchemy import Engine
+
+from common.core.config import settings
+from common.utils.utils import SQLBotLogUtil
+
+# (pool_size, max_overflow) per datasource type, others fall back to DS_POOL_SIZE / DS_MAX_OVERFLOW
+_pool_size_by_type: dict[str, tuple[int, int]] = {
+    # every excel datasource gets its own engine against the sqlbot pg, keep each pool small
+    'excel': (1, 2),
+    'ck': (2, 5),  # clickhouse+http, connection is a cheap http session
+    'oracle': (3, 5),
+    'sqlServer': (3, 5),
+}
+
+
+def get_pool_args(ds_type: str) -> dict:
+    pool_size, max_overflow = _pool_size_by_type.get(ds_type, (settings.DS_POOL_SIZE, settings.DS_MAX_OVERFLOW))
+    return {
+        'pool_size': pool_size,
+        'max_overflow': max_overflow,
+        'pool_recycle': settings.DS_POOL_RECYCLE,
+        'pool_pre_ping': True,
+    }
+
+
+def config_hash(ds_type: str, configuration: Optional[str], timeout: int = 0) -> str:
+    raw = f'{ds_type}|{timeout}|{configuration or ""}'
+    return hashlib.sha256(raw.encode('utf-8')).hexdigest()
+
+
+class DsEngineRegistry:
+    """
+    process-wide registry of pooled engines, keyed by (datasource id, configuration hash)
+    """
+
+    def __init__(self, max_size: int):
+        self.max_size = max_size
+        self._engines: OrderedDict[tuple[int, str], Engine] = OrderedDict()
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.creates = 0
+        self.evictions = 0
+        self.invalidations = 0
+
+    def get(self, ds_id: int, key_hash: str, factory: Callable[[], Engine]) -> Engine:
+        key = (ds_id, key_hash)
+        with self._lock:
+            engine = self._engines.get(key)
+            if engine is not None:
+                self._engines.move_to_end(key)
+                self.hits += 1
+                return engine
+
+        # build outside the lock, create_engine does not connect
+        new_engine = factory()
+        evicted: list[Engine] = []
+        with self._lock:
+            engine = self._engines.get(key)
+            if engine is not None:
+                self.hits += 1
+                evicted.append(new_engine)
+            else:
+                engine = new_engine
+                self._engines[key] = engine
+                self.creates += 1
+                while len(self._engines) > self.max_size:
+                    _, old = self._engines.popitem(last=False)
+                    evicted.append(old)
+                    self.evictions += 1
+        for old in evicted:
+            _dispose(old)
+        return engine
+
+    def invalidate(self, ds_id: int):
+        with self._lock:
+            keys = [key for key in self._engines if key[0] == ds_id]
+            removed = [self._engines.pop(key) for key in keys]
+            if removed:
+                self.invalidations += 1
+        for old in removed:
+            _dispose(old)
+
+    def clear(self):
+        with self._lock:
+            removed = list(self._engines.values())
+            self._engines.clear()
+        for old in removed:
+            _dispose(old)
+
+    def stats(self) -> dict:
+        with self._lock:
+            engines = list(self._engines.items())
+            result = {
+                'size': len(engines),
+                'max_size': self.max_size,
+                'hits': self.hits,
+                'creates': self.creates,
+                'evictions': self.evictions,
+                'invalidations': self.invalidations,
+            }
+        pools = []
+        checked_out = 0
+        for (ds_id, _), engine in engines:
+            pool = engine.pool
+            _checked_out = pool.checkedout() if hasattr(pool, 'checkedout') else 0
+            checked_out += _checked_out
+            pools.append({'ds_id': ds_id, 'checked_out': _checked_out,
+                          'checked_in': pool.checkedin() if hasattr(pool, 'checkedin') else 0})
+        result['checked_out'] = checked_out
+        result['pools'] = pools
+        return result
+
+
+def _dispose(engine: Engine):
+    try:
+        engine.dispose()
+    except Exception as e:
+        SQLBotLogUtil.warning(f"dispose datasource engine failed: {e}")
+
+
+def _close(conn: Any):
+    try:
+        conn.close()
+    except Exception:
+        pass
+
+
+def _is_alive(conn: Any) -> bool:
+    try:
+        if hasattr(conn, 'ping'):  # pymysql
+            conn.ping(reconnect=False)
+            return True
+        cursor = conn.cursor()
+        try:
+            cursor.execute('select 1')
+            cursor.fetchall()
+        finally:
+            cursor.close()
+        conn.rollback()
+        return True
+    except Exception:
+        return False
+
+
+class NativeConnectionPool:
+    """
+    bounded pool of py_driver connections (dm, doris, starrocks, redshift, kingbase) for one datasource
+    """
+
+    def __init__(self, factory: Callable[[], Any], max_size: int, idle_timeout: int, wait_timeout: int):
+        self.factory = factory
+        self.max_size = max_size
+        self.idle_timeout = idle_timeout
+        self.wait_timeout = wait_timeout
+        self._idle: deque[tuple[Any, float]] = deque()
+        self._lock = threading.Lock()
+        self._slots = threading.BoundedSemaphore(max_size)
+        self._closed = False
+        self.hits = 0
+        self.creates = 0
+        self.discards = 0
+        self.checked_out = 0
+
+    def _take_idle(self) -> Optional[Any]:
+        now = time.monotonic()
+        while True:
+            with self._lock:
+                if not self._idle:
+                    return None
+                conn, last_used = self._idle.pop()
+            if now - last_used > self.idle_timeout or not _is_alive(conn):
+                _close(conn)
+                with self._lock:
+                    self.discards += 1
+                continue
+            return conn
+
+    def checkout(self) -> Any:
+        if not self._slots.acquire(timeout=self.wait_timeout if self.wait_timeout > 0 else None):
+            raise TimeoutError(f'no available connection in pool (size {self.max_size}) after {self.wait_timeout}s')
+        try:
+            conn = self._take_idle()
+            if conn is None:
+                conn = self.factory()
+                with self._lock:
+                    self.creates += 1
+            else:
+                with self._lock:
+                    self.hits += 1
+        except Exception:
+            self._slots.release()
+            raise
+        with self._lock:
+            self.checked_out += 1
+        return conn
+
+    def checkin(self, conn: Any, broken: bool = False):
+        try:
+            if not broken and not self._closed:
+                try:
+                    conn.rollback()
+                except Exception:
+                    broken = True
+            if broken or self._closed:
+                _close(conn)
+                with self._lock:
+                    self.discards += 1
+            else:
+                with self._lock:
+                    self._idle.append((conn, time.monotonic()))
+        finally:
+            with self._lock:
+                self.checked_out -= 1
+            self._slots.release()
+
+    @contextmanager
+    def connection(self):
+        conn = self.checkout()
+        broken = False
+        try:
+            yield conn
+        except Exception:
+            broken = True
+            raise
+        finally:
+            self.checkin(conn, broken)
+
+    def dispose(self):
+        with self._lock:
+            self._closed = True
+            idle = list(self._idle)
+            self._idle.clear()
+        for conn, _ in idle:
+            _close(conn)
+
+    def stats(self) -> dict:
+        with self._lock:
+            return {'idle': len(self._idle), 'checked_out': self.checked_out, 'hits': self.hits,
+                    'creates': self.creates, 'discards': self.discards, 'max_size': self.max_size}
+
+
+class NativePoolRegistry:
+    """
+    LRU of NativeConnectionPool keyed by (datasource id, configuration hash)
+    """
+
+    def __init__(self, max_size: int):
+        self.max_size = max_size
+        self._pools: OrderedDict[tuple[int, str], NativeConnectionPool] = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, ds_id: int, key_hash: str, factory: Callable[[], Any], wait_timeout: int) -> NativeConnectionPool:
+        key = (ds_id, key_hash)
+        evicted: list[NativeConnectionPool] = []
+        with self._lock:
+            pool = self._pools.get(key)
+            if pool is not None:
+                self._pools.move_to_end(key)
+                return pool
+            pool = NativeConnectionPool(factory, settings.DS_NATIVE_POOL_SIZE, settings.DS_NATIVE_POOL_IDLE_TIMEOUT,
+                                        wait_timeout)
+            self._pools[key] = pool
+            while len(self._pools) > self.max_size:
+                _, old = self._pools.popitem(last=False)
+                evicted.append(old)
+        for old in evicted:
+            old.dispose()
+        return pool
+
+    def invalidate(self, ds_id: int):
+        with self._lock:
+            keys = [key for key in self._pools if key[0] == ds_id]
+            removed = [self._pools.pop(key) for key in keys]
+        for old in removed:
+            old.dispose()
+
+    def stats(self) -> dict:
+        with self._lock:
+            pools = list(self._pools.items())
+        return {'size': len(pools), 'max_size': self.max_size,
+                'pools': [{'ds_id': ds_id, **pool.stats()} for (ds_id, _), pool in pools]}
+
+
+engine_registry = DsEngineRegistry(settings.DS_ENGINE_CACHE_MAX_SIZE)
+native_registry = NativePoolRegistry(settings.DS_ENGINE_CACHE_MAX_SIZE)
+
+
+@contextmanager
+def native_connection(ds_id: Optional[int], key_hash: str, factory: Callable[[], Any], wait_timeout: int = 30):
+    """
+    borrow a pooled py_driver connection, the connection is returned (or discarded on error) on exit
+    """
+    if not settings.DS_ENGINE_CACHE_ENABLED or ds_id is None:
+        conn = factory()
+        try:
+            yield conn
+        finally:
+            _close(conn)
+        return
+    with native_registry.get(ds_id, key_hash, factory, wait_timeout).connection() as conn:
+        yield conn
+
+
+def invalidate_ds_engine(ds_id: int):
+    engine_registry.invalidate(ds_id)
+    native_registry.invalidate(ds_id)
+
+
+def get_ds_engine_stats() -> dict:
+    return {'engines': engine_registry.stats(), 'native': native_registry.stats()}
@@ -0,0 +1,94 @@
+# Author: Junjun
+# Date: 2025/10/17
+import time
+from io import StringIO
+from typing import Iterator
+
+import pandas as pd
+from pandas.api.types import is_numeric_dtype, is_bool_dtype
+from sqlalchemy import Engine
+
+from common.core.config import settings
+from common.utils.utils import SQLBotLogUtil
+
+
+def _fix_dtypes(df: pd.DataFrame) -> pd.DataFrame:
+    # fix field type, postgres has no unsigned bigint
+    for i in range(len(df.dtypes)):
+        if str(df.dtypes.iloc[i]) == 'uint64':
+            df[df.columns[i]] = df[df.columns[i]].astype('string')
+    return df
+
+
+def _merge_dtype(a, b):
+    if a == b:
+        return a
+    if is_numeric_dtype(a) and is_numeric_dtype(b) and not is_bool_dtype(a) and not is_bool_dtype(b):
+        return 'float64'
+    return 'object'
+
+
+def _create_table(cursor, df: pd.DataFrame, table_name: str, engine: Engine):
+    # same column types as DataFrame.to_sql, without writing any row
+    cursor.execute(pd.io.sql.get_schema(df, table_name, con=engine))
+
+
+def _copy_chunks(cursor, chunks: Iterator[pd.DataFrame], table_name: str) -> int:
+    rows = 0
+    start_time = time.time()
+    for chunk in chunks:
+        output = StringIO()
+        _fix_dtypes(chunk).to_csv(output, sep='\t', header=False, index=False)
+        output.seek(0)
+        cursor.copy_expert(sql=f"""COPY "{table_name}" FROM STDIN WITH CSV DELIMITER E'\t'""", file=output)
+        rows += len(chunk)
+        elapsed = time.time() - start_time
+        SQLBotLogUtil.info(f"load {table_name}: {rows} rows, {rows / elapsed if elapsed > 0 else 0:.0f} rows/s")
+    return rows
+
+
+def _load(engine: Engine, table_name: str, schema_df: pd.DataFrame, chunks: Iterator[pd.DataFrame]) -> int:
+    conn = engine.raw_connection()
+    cursor = conn.cursor()
+    try:
+        _create_table(cursor, schema_df, table_name, engine)
+        rows = _copy_chunks(cursor, chunks, table_name)
+        conn.commit()
+        return rows
+    except Exception:
+        conn.rollback()
+        raise
+    finally:
+        cursor.close()
+        conn.close()
+
+
+def load_csv(path: str, table_name: str, engine: Engine, chunksize: int = None) -> int:
+    """
+    create table_name from the column types of the csv and COPY it in chunks, memory stays bounded by chunksize.
+    the column types are inferred over all chunks in a first pass, so a column that only turns into float or
+    text late in the file does not break the COPY
+    """
+    chunksize = chunksize or settings.EXCEL_LOAD_CHUNK_SIZE
+    columns = None
+    dtypes = {}
+    for chunk in pd.read_csv(path, engine='c', chunksize=chunksize):
+        chunk = _fix_dtypes(chunk)
+        if columns is None:
+            columns = list(chunk.columns)
+        for col in columns:
+            dtypes[col] = _merge_dtype(dtypes[col], chunk[col].dtype) if col in dtypes else chunk[col].dtype
+    if columns is None:
+        columns = list(pd.read_csv(path, engine='c', nrows=0).columns)
+    schema_df = pd.DataFrame({col: pd.Series(dtype=dtypes.get(col, 'object')) for col in columns})
+    return _load(engine, table_name, schema_df, pd.read_csv(path, engine='c', chunksize=chunksize))
+
+
+def load_dataframe(df: pd.DataFrame, table_name: str, engine: Engine, chunksize: int = None) -> int:
+    """
+    create table_name from the column types of df and COPY it in chunks
+    """
+    chunksize = chunksize or settings.EXCEL_LOAD_CHUNK_SIZE
+    df = _fix_dtypes(df)
+    chunks = (df.iloc[i:i + chunksize] for i in range(0, len(df), chunksize))
+    return _load(engine, table_name, df, chunks)
@@ -0,0 +1,87 @@
+# Author: Junjun
+# Date: 2025/10/17
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from dataclasses import dataclass, field
+from typing import Any, Callable
+
+from common.core.config import settings
+from common.utils.utils import SQLBotLogUtil
+
+_refresh_executor = ThreadPoolExecutor(max_workers=4, thread_name_prefix='ds-health')
+
+
+@dataclass
+class DsHealth:
+    config: str  # configuration hash the values were probed with
+    values: dict[str, tuple[Any, float]] = field(default_factory=dict)  # name -> (value, probe time)
+    refreshing: set[str] = field(default_factory=set)
+
+
+class DsHealthCache:
+    """
+    process-local cache of datasource probes (version string, last successful connection).
+    a value younger than DS_HEALTH_CACHE_TTL is served without probing, past half the ttl it is refreshed in
+    the background; an entry is reset when the datasource configuration changes and dropped by invalidate()
+    """
+
+    def __init__(self):
+        self._entries: dict[tuple, DsHealth] = {}
+        self._lock = threading.Lock()
+
+    def _get_entry(self, key: tuple, config: str) -> DsHealth:
+        entry = self._entries.get(key)
+        if entry is None or entry.config != config:
+            entry = self._entries[key] = DsHealth(config)
+        return entry
+
+    def _store(self, key: tuple, config: str, name: str, value: Any):
+        with self._lock:
+            self._get_entry(key, config).values[name] = (value, time.time())
+
+    def _refresh(self, key: tuple, config: str, name: str, probe: Callable[[], Any], keep: Callable[[Any], bool]):
+        try:
+            value = probe()
+            if keep(value):
+                self._store(key, config, name, value)
+            else:
+                with self._lock:
+                    self._get_entry(key, config).values.pop(name, None)
+        except Exception as e:
+            SQLBotLogUtil.warning(f"refresh datasource {key} {name} failed: {e}")
+        finally:
+            with self._lock:
+                self._get_entry(key, config).refreshing.discard(name)
+
+    def get(self, key: tuple, config: str, name: str, probe: Callable[[], Any],
+            keep: Callable[[Any], bool] = bool) -> Any:
+        """
+        cached value of probe(), only values accepted by keep are cached (e.g. a failed probe is retried next time)
+        """
+        ttl = settings.DS_HEALTH_CACHE_TTL
+        if ttl <= 0:
+            return probe()
+        now = time.time()
+        with self._lock:
+            entry = self._get_entry(key, config)
+            cached = entry.values.get(name)
+            if cached is not None and now - cached[1] < ttl:
+                if now - cached[1] >= ttl / 2 and name not in entry.refreshing:
+                    entry.refreshing.add(name)
+                    _refresh_executor.submit(self._refresh, key, config, name, probe, keep)
+                return cached[0]
+        value = probe()
+        if keep(value):
+            self._store(key, config, name, value)
+        return value
+
+    def mark(self, key: tuple, config: str, name: str, value: Any):
+        self._store(key, config, name, value)
+
+    def invalidate(self, key: tuple):
+        with self._lock:
+            self._entries.pop(key, None)
+
+
+ds_health_cache = DsHealthCache()
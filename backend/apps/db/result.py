@@ -0,0 +1,121 @@
+# Author: Junjun
+# Date: 2025/10/17
+import base64
+from decimal import Decimal
+from typing import Any, Optional, Sequence
+
+import numpy as np
+import pandas as pd
+
+
+def _format_float_without_scientific(value: float) -> str:
+    if value == 0:
+        return "0"
+    formatted = f"{value:.15f}"
+    if '.' in formatted:
+        formatted = formatted.rstrip('0').rstrip('.')
+    return formatted
+
+
+def _prepare_value_for_json(value):
+    if isinstance(value, bytes):
+        return base64.b64encode(value).decode('utf-8')
+    elif isinstance(value, dict):
+        return {k: _prepare_value_for_json(v) for k, v in value.items()}
+    elif isinstance(value, (list, tuple)):
+        return [_prepare_value_for_json(item) for item in value]
+    return value
+
+
+class ColumnarResult:
+    """
+    query result held as one value list per column, as returned by every driver branch of exec_sql.
+    normalisation works column by column and skips columns that cannot contain affected values;
+    rows are only materialised as dicts by rows()/to_dict() at the API or storage edge
+    """
+
+    def __init__(self, fields: list[str], columns: list[list], sql: str = '', truncated: bool = False):
+        self.fields = fields
+        self.columns = columns
+        self.sql = sql
+        # fetching stopped at the row or byte cap, more rows exist
+        self.truncated = truncated
+
+    @classmethod
+    def from_rows(cls, fields: Sequence[Any], rows: Sequence[Sequence[Any]], sql: str = '',
+                  truncated: bool = False) -> 'ColumnarResult':
+        fields = [str(field) for field in fields]
+        columns = [list(column) for column in zip(*rows)] if rows else [[] for _ in fields]
+        for i, column in enumerate(columns):
+            if any(issubclass(t, Decimal) for t in set(map(type, column))):
+                columns[i] = [float(value) if isinstance(value, Decimal) else value for value in column]
+        return cls(fields, columns, sql, truncated)
+
+    @property
+    def row_count(self) -> int:
+        return len(self.columns[0]) if self.columns else 0
+
+    def convert_large_numbers(self, int_threshold=1e15, float_threshold=1e10) -> 'ColumnarResult':
+        """
+        same conversion as DataFormat.convert_large_numbers_in_object_array: ints >= int_threshold and floats
+        >= float_threshold or < 1e-6 (absolute) become strings, dict/list cells are processed recursively
+        """
+        for i, column in enumerate(self.columns):
+            # text, date and null columns are skipped after one pass over the value types
+            if not any(t is not bool and issubclass(t, (int, float, dict, list)) for t in set(map(type, column))):
+                continue
+            number_index = []
+            number_values = []
+            is_int = []
+            nested_index = []
+            for j, value in enumerate(column):
+                if isinstance(value, (int, float)) and not isinstance(value, bool):
+                    number_index.append(j)
+                    number_values.append(value)
+                    is_int.append(isinstance(value, int))
+                elif isinstance(value, (dict, list)):
+                    nested_index.append(j)
+            if not number_index and not nested_index:
+                continue
+            column = list(column)
+            if number_index:
+                # ints too large for a float only need to compare as "large"
+                values = np.abs(np.array([float(v) if -1e300 < v < 1e300 else np.inf for v in number_values],
+                                         dtype=np.float64))
+                ints = np.array(is_int, dtype=bool)
+                mask = (ints & (values >= int_threshold)) | (~ints & ((values >= float_threshold) | (values < 1e-6)))
+                for k in np.flatnonzero(mask):
+                    value = number_values[k]
+                    column[number_index[k]] = str(value) if is_int[k] else _format_float_without_scientific(value)
+            if nested_index:
+                from common.utils.data_format import DataFormat
+            for j in nested_index:
+                value = column[j]
+                column[j] = DataFormat.convert_large_numbers_in_object_array([value])[0] if isinstance(
+                    value, dict) else DataFormat.convert_large_numbers_in_object_array(value)
+            self.columns[i] = column
+        return self
+
+    def prepare_for_json(self) -> 'ColumnarResult':
+        """
+        bytes become base64 text so the result can be serialised by orjson, like prepare_for_orjson
+        """
+        for i, column in enumerate(self.columns):
+            if any(issubclass(t, (bytes, dict, list, tuple)) for t in set(map(type, column))):
+                self.columns[i] = [_prepare_value_for_json(value) for value in column]
+        return self
+
+    def rows(self, limit: Optional[int] = None) -> list[dict]:
+        columns = self.columns if limit is None else [column[:limit] for column in self.columns]
+        return [dict(zip(self.fields, row)) for row in zip(*columns)]
+
+    def to_dict(self, limit: Optional[int] = None) -> dict:
+        data = {"fields": self.fields, "data": self.rows(limit), "sql": self.sql}
+        if self.truncated:
+            data["truncated"] = True
+        return data
+
+    def to_dataframe(self, columns: Optional[list[str]] = None) -> pd.DataFrame:
+        df = pd.DataFrame({i: column for i, column in enumerate(self.columns)})
+        df.columns = columns if columns is not None else self.fields
+        return df
@@ -0,0 +1,144 @@
+# Author: Junjun
+# Date: 2025/10/17
+import hashlib
+import threading
+import time
+from collections import OrderedDict
+from typing import Any, Callable, Optional
+
+import orjson
+
+from apps.db.engine_pool import config_hash
+from apps.db.result import ColumnarResult
+from common.core.config import settings
+from common.utils.utils import SQLBotLogUtil
+
+_redis_prefix = 'sqlbot-cache:sql_result:'
+
+
+def _dumps(result: ColumnarResult) -> Optional[bytes]:
+    # values are kept in their json form, as the result is stored with the record (dates as iso text, bytes as
+    # base64), None when the result has values orjson cannot write (e.g. ints beyond 64 bits)
+    result.prepare_for_json()
+    try:
+        return orjson.dumps({'fields': result.fields, 'columns': result.columns, 'sql': result.sql,
+                             'truncated': result.truncated}, default=str, option=orjson.OPT_NON_STR_KEYS)
+    except orjson.JSONEncodeError:
+        return None
+
+
+def _loads(data: bytes) -> ColumnarResult:
+    obj = orjson.loads(data)
+    return ColumnarResult(obj['fields'], obj['columns'], obj['sql'], obj['truncated'])
+
+
+def get_result_cache_ttl(ds: Any) -> int:
+    """
+    SQL_RESULT_CACHE_DS_TTL overrides SQL_RESULT_CACHE_TTL by datasource id or type, e.g. {"12": 60, "redshift": 1800},
+    0 disables the cache for the datasource
+    """
+    ttl_map = settings.SQL_RESULT_CACHE_DS_TTL
+    return ttl_map.get(str(ds.id), ttl_map.get(ds.type, settings.SQL_RESULT_CACHE_TTL))
+
+
+class SqlResultCache:
+    """
+    query results of exec_sql_result keyed by (ds id, configuration hash, sql, permission scope, fetch caps).
+    first tier is a process-local LRU bounded by entry count and serialised size, with CACHE_TYPE redis the
+    results are also shared between workers through redis; entries expire after the datasource ttl
+    """
+
+    def __init__(self):
+        self._entries: OrderedDict[str, tuple[bytes, float]] = OrderedDict()
+        self._bytes = 0
+        self._lock = threading.Lock()
+        self._redis = None
+        self.hits = 0
+        self.misses = 0
+
+    @staticmethod
+    def key(ds: Any, sql: str, scope: str, *options) -> str:
+        raw = '\n'.join([str(ds.id), config_hash(ds.type, ds.configuration), scope, *map(str, options), sql])
+        return f'{ds.id}:{hashlib.sha256(raw.encode("utf-8")).hexdigest()}'
+
+    def _get_redis(self):
+        if not settings.CACHE_TYPE or settings.CACHE_TYPE.lower() != 'redis':
+            return None
+        if self._redis is None:
+            import redis
+            self._redis = redis.Redis.from_url(settings.CACHE_REDIS_URL or "redis://localhost:6379/0")
+        return self._redis
+
+    def _get_local(self, key: str) -> Optional[bytes]:
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None:
+                return None
+            if time.time() >= entry[1]:
+                self._remove(key)
+                return None
+            self._entries.move_to_end(key)
+            return entry[0]
+
+    def _put_local(self, key: str, data: bytes, expire_time: float):
+        with self._lock:
+            if key in self._entries:
+                self._remove(key)
+            self._entries[key] = (data, expire_time)
+            self._bytes += len(data)
+            while self._entries and (len(self._entries) > settings.SQL_RESULT_CACHE_MAX_SIZE
+                                     or self._bytes > settings.SQL_RESULT_CACHE_MAX_BYTES):
+                self._remove(next(iter(self._entries)))
+
+    def _remove(self, key: str):
+        data, _ = self._entries.pop(key)
+        self._bytes -= len(data)
+
+    def get_or_execute(self, ds: Any, key: str, execute: Callable[[], ColumnarResult]) -> ColumnarResult:
+        ttl = get_result_cache_ttl(ds)
+        if ttl <= 0:
+            return execute()
+
+        data = self._get_local(key)
+        if data is None:
+            redis_client = self._get_redis()
+            if redis_client is not None:
+                try:
+                    data = redis_client.get(_redis_prefix + key)
+                    if data is not None:
+                        self._put_local(key, data, time.time() + max(redis_client.ttl(_redis_prefix + key), 1))
+                except Exception as e:
+                    SQLBotLogUtil.warning(f"read sql result cache from redis failed: {e}")
+        if data is not None:
+            with self._lock:
+                self.hits += 1
+            SQLBotLogUtil.info("sql result cache hit on ds_id %s", ds.id)
+            # every hit gets its own copy, the result is normalised in place by the caller
+            return _loads(data)
+
+        with self._lock:
+            self.misses += 1
+        result = execute()
+        data = _dumps(result)
+        if data is None or len(data) > settings.SQL_RESULT_CACHE_MAX_ENTRY_BYTES:
+            return result
+        self._put_local(key, data, time.time() + ttl)
+        redis_client = self._get_redis()
+        if redis_client is not None:
+            try:
+                redis_client.set(_redis_prefix + key, data, ex=ttl)
+            except Exception as e:
+                SQLBotLogUtil.warning(f"write sql result cache to redis failed: {e}")
+        return result
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+            self._bytes = 0
+
+    def stats(self) -> dict:
+        with self._lock:
+            return {'entries': len(self._entries), 'bytes': self._bytes, 'hits': self.hits, 'misses': self.misses}
+
+
+sql_result_cache = SqlResultCache()
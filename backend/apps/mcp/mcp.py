@@ -5,6 +5,7 @@ from datetime import timedelta
 
 import jwt
 from fastapi import HTTPException, status, APIRouter
+from fastapi.responses import JSONResponse
 # from fastapi.security import OAuth2PasswordBearer
 from jwt.exceptions import InvalidTokenError
 from pydantic import ValidationError
@@ -110,7 +111,8 @@ async def mcp_start(session: SessionDep, chat: ChatStart):
     return {"access_token": t.access_token, "chat_id": c.id}
 
 
-@router.post("/mcp_question", operation_id="mcp_question")
+# answered without the envelope, as the mcp client reads the result directly
+@router.post("/mcp_question", operation_id="mcp_question", response_class=JSONResponse)
 async def mcp_question(session: SessionDep, chat: McpQuestion):
     session_user = get_user(session, chat.token)
 
@@ -120,7 +122,7 @@ async def mcp_question(session: SessionDep, chat: McpQuestion):
                                        in_chat=False, stream=chat.stream)
 
 
-@router.post("/mcp_assistant", operation_id="mcp_assistant")
+@router.post("/mcp_assistant", operation_id="mcp_assistant", response_class=JSONResponse)
 async def mcp_assistant(session: SessionDep, chat: McpAssistant):
     session_user = BaseUserDTO(**{
         "id": -1, "account": 'sqlbot-mcp-assistant', "oid": 1, "assistant_id": -1, "password": '', "language": "zh-CN"
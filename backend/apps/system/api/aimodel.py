@@ -2,7 +2,7 @@ import json
 from typing import List, Union
 
 from fastapi.responses import StreamingResponse
-from apps.ai_model.model_factory import LLMConfig, LLMFactory
+from apps.ai_model.model_factory import LLMConfig, LLMFactory, llm_registry
 from apps.swagger.i18n import PLACEHOLDER_PREFIX
 from apps.system.schemas.ai_model_schema import AiModelConfigItem, AiModelCreator, AiModelEditor, AiModelGridItem
 from fastapi import APIRouter, Path, Query
@@ -75,6 +75,7 @@ async def set_default(session: SessionDep, id: int = Path(description="ID")):
     except Exception as e:
         session.rollback()
         raise e
+    llm_registry.invalidate()
 
 @router.get("", response_model=list[AiModelGridItem], summary=f"{PLACEHOLDER_PREFIX}system_model_grid", description=f"{PLACEHOLDER_PREFIX}system_model_grid")
 @require_permissions(permission=SqlbotPermission(role=['admin'])) 
@@ -95,6 +96,11 @@ async def query(
     items = session.exec(statement).all()
     return items
 
+@router.get("/clientStats", include_in_schema=False)
+@require_permissions(permission=SqlbotPermission(role=['admin']))
+async def client_stats():
+    return llm_registry.stats()
+
 @router.get("/{id}", response_model=AiModelEditor, summary=f"{PLACEHOLDER_PREFIX}system_model_query", description=f"{PLACEHOLDER_PREFIX}system_model_query")
 @require_permissions(permission=SqlbotPermission(role=['admin'])) 
 async def get_model_by_id(
@@ -141,6 +147,8 @@ async def add_model(
         detail.default_model = True
     session.add(detail)
     session.commit()
+    if detail.default_model:
+        llm_registry.invalidate()
     return detail
 
 @router.put("", summary=f"{PLACEHOLDER_PREFIX}system_model_update", description=f"{PLACEHOLDER_PREFIX}system_model_update")
@@ -159,6 +167,7 @@ async def update_model(
     db_model.sqlmodel_update(data)
     session.add(db_model)
     session.commit()
+    llm_registry.invalidate(id)
 
 @router.delete("/{id}", summary=f"{PLACEHOLDER_PREFIX}system_model_del", description=f"{PLACEHOLDER_PREFIX}system_model_del")
 @require_permissions(permission=SqlbotPermission(role=['admin']))
@@ -173,6 +182,7 @@ async def delete_model(
         raise Exception(trans('i18n_llm.delete_default_error', key = item.name))
     session.delete(item)
     session.commit()
+    llm_registry.invalidate(id)
     
 
     
\ No newline at end of file
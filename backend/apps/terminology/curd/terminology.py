@@ -14,7 +14,7 @@ from apps.template.generate_chart.generator import get_base_terminology_template
 from apps.terminology.models.terminology_model import Terminology, TerminologyInfo
 from common.core.config import settings
 from common.core.deps import SessionDep, Trans
-from common.utils.embedding_threads import run_save_terminology_embeddings
+from common.utils.embedding_threads import embed_and_save, run_save_terminology_embeddings
 
 
 def get_terminology_base_query(oid: int, name: Optional[str] = None):
@@ -663,17 +663,7 @@ def save_embeddings(session_maker, ids: List[int]):
         session = session_maker()
         _list = session.query(Terminology).filter(or_(Terminology.id.in_(ids), Terminology.pid.in_(ids))).all()
 
-        _words_list = [item.word for item in _list]
-
-        model = EmbeddingModelCache.get_model()
-
-        results = model.embed_documents(_words_list)
-
-        for index in range(len(results)):
-            item = results[index]
-            stmt = update(Terminology).where(and_(Terminology.id == _list[index].id)).values(embedding=item)
-            session.execute(stmt)
-            session.commit()
+        embed_and_save(session, Terminology.__tablename__, [(item.id, item.word) for item in _list])
 
     except Exception:
         traceback.print_exc()
@@ -756,9 +746,7 @@ def select_terminology_by_word(session: SessionDep, word: str, oid: int, datasou
     if settings.EMBEDDING_ENABLED:
         with session.begin_nested():
             try:
-                model = EmbeddingModelCache.get_model()
-
-                embedding = model.embed_query(word)
+                embedding = EmbeddingModelCache.embed_query(word)
 
                 if datasource is not None:
                     results = session.execute(text(embedding_sql_with_datasource),
@@ -63,6 +63,8 @@ class Settings(BaseSettings):
     LOG_LEVEL: str = "INFO"  # DEBUG, INFO, WARNING, ERROR
     LOG_DIR: str = "logs"
     LOG_FORMAT: str = "%(asctime)s - %(name)s - %(levelname)s:%(lineno)d - %(message)s"
+    # format and write log records in a background thread instead of the thread that logs
+    LOG_QUEUE_ENABLED: bool = False
     SQL_DEBUG: bool = False
     BASE_DIR: str = "/opt/sqlbot"
     SCRIPT_DIR: str = f"{BASE_DIR}/scripts"
@@ -85,10 +87,27 @@ class Settings(BaseSettings):
 
     MCP_IMAGE_PATH: str = '/opt/sqlbot/images'
     EXCEL_PATH: str = '/opt/sqlbot/data/excel'
+    EXCEL_LOAD_CHUNK_SIZE: int = 50000
     MCP_IMAGE_HOST: str = 'http://localhost:3000'
     SERVER_IMAGE_HOST: str = 'http://YOUR_SERVE_IP:MCP_PORT/images/'
     SERVER_IMAGE_TIMEOUT: int = 15
 
+    CHAT_STREAM_QUEUE_SIZE: int = 256
+    CHAT_PREPARE_WORKERS: int = 32
+    # run chat tasks on the event loop with llm.astream instead of one worker thread per stream
+    CHAT_ASYNC_PIPELINE_ENABLED: bool = False
+    CHAT_DB_WORKERS: int = 64
+    # merge streamed chunks into one frame per CHAT_STREAM_COALESCE_MS or CHAT_STREAM_COALESCE_CHARS, 0 disables
+    CHAT_STREAM_COALESCE_MS: int = 30
+    CHAT_STREAM_COALESCE_CHARS: int = 256
+    CHAT_ANSWER_CACHE_ENABLED: bool = False
+    CHAT_ANSWER_CACHE_TTL: int = 3600
+    CHAT_ANSWER_CACHE_MAX_SIZE: int = 1024
+    # decrypted default model config is reused for this many seconds, 0 reads it on every question
+    LLM_CONFIG_CACHE_TTL: int = 300
+    # rows of a chat result export that re-runs the record's sql, 0 disables the cap (xlsx still stops at 1048575)
+    CHAT_EXPORT_MAX_ROWS: int = 1000000
+
     LOCAL_MODEL_PATH: str = '/opt/sqlbot/models'
     DEFAULT_EMBEDDING_MODEL: str = 'shibing624/text2vec-base-chinese'
     EMBEDDING_ENABLED: bool = True
@@ -98,9 +117,23 @@ class Settings(BaseSettings):
     EMBEDDING_DEFAULT_TOP_COUNT: int = 5
     EMBEDDING_TERMINOLOGY_TOP_COUNT: int = EMBEDDING_DEFAULT_TOP_COUNT
     EMBEDDING_DATA_TRAINING_TOP_COUNT: int = EMBEDDING_DEFAULT_TOP_COUNT
+    EMBEDDING_BATCH_SIZE: int = 64
+    EMBEDDING_QUERY_CACHE_SIZE: int = 1024
+    EMBEDDING_QUERY_CACHE_TTL: int = 3600
 
     # 是否启用SQL查询行数限制，默认值，可被参数配置覆盖
     GENERATE_SQL_QUERY_LIMIT_ENABLED: bool = True
+    # hard caps of a chat query result, fetched through server-side cursors, 0 disables the cap
+    SQL_RESULT_MAX_ROWS: int = 100000
+    SQL_RESULT_MAX_BYTES: int = 64 * 1024 * 1024
+    SQL_FETCH_BATCH_SIZE: int = 1000
+    # cache of chat query results, ttl in seconds, SQL_RESULT_CACHE_DS_TTL overrides it by ds id or type
+    SQL_RESULT_CACHE_ENABLED: bool = False
+    SQL_RESULT_CACHE_TTL: int = 300
+    SQL_RESULT_CACHE_DS_TTL: dict[str, int] = {}
+    SQL_RESULT_CACHE_MAX_SIZE: int = 256
+    SQL_RESULT_CACHE_MAX_BYTES: int = 256 * 1024 * 1024
+    SQL_RESULT_CACHE_MAX_ENTRY_BYTES: int = 16 * 1024 * 1024
 
     PARSE_REASONING_BLOCK_ENABLED: bool = True
     DEFAULT_REASONING_CONTENT_START: str = '<think>'
@@ -111,9 +144,23 @@ class Settings(BaseSettings):
     PG_POOL_RECYCLE: int = 3600
     PG_POOL_PRE_PING: bool = True
 
+    # datasource engine pool
+    DS_ENGINE_CACHE_ENABLED: bool = True
+    DS_ENGINE_CACHE_MAX_SIZE: int = 64
+    DS_POOL_SIZE: int = 5
+    DS_MAX_OVERFLOW: int = 10
+    DS_POOL_RECYCLE: int = 1800
+    DS_NATIVE_POOL_SIZE: int = 5
+    DS_NATIVE_POOL_IDLE_TIMEOUT: int = 300
+    DS_HEALTH_CACHE_TTL: int = 60
+
     TABLE_EMBEDDING_ENABLED: bool = True
     TABLE_EMBEDDING_COUNT: int = 10
     DS_EMBEDDING_COUNT: int = 10
+    EMBEDDING_RANK_IN_DB: bool = True
+    EMBEDDING_MATRIX_CACHE_TTL: int = 600
+    SCHEMA_PROMPT_CACHE_TTL: int = 600
+    SCHEMA_PROMPT_CACHE_MAX_SIZE: int = 256
 
     ORACLE_CLIENT_PATH: str = '/opt/sqlbot/db_client/oracle_instant_client'
 
@@ -123,6 +170,12 @@ class Settings(BaseSettings):
                      'PARSE_REASONING_BLOCK_ENABLED',
                      'PG_POOL_PRE_PING',
                      'TABLE_EMBEDDING_ENABLED',
+                     'DS_ENGINE_CACHE_ENABLED',
+                     'EMBEDDING_RANK_IN_DB',
+                     'CHAT_ANSWER_CACHE_ENABLED',
+                     'SQL_RESULT_CACHE_ENABLED',
+                     'CHAT_ASYNC_PIPELINE_ENABLED',
+                     'LOG_QUEUE_ENABLED',
                      mode='before')
     @classmethod
     def lowercase_bool(cls, v: Any) -> Any:
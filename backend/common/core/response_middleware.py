@@ -1,83 +1,111 @@
 import json
+from typing import Any
 
+import orjson
 from starlette.exceptions import HTTPException
-from starlette.middleware.base import BaseHTTPMiddleware
 from starlette.requests import Request
 from starlette.responses import JSONResponse
+from starlette.types import ASGIApp, Message, Receive, Scope, Send
 
 from common.core.config import settings
 from common.utils.utils import SQLBotLogUtil
 
-
-class ResponseMiddleware(BaseHTTPMiddleware):
-    def __init__(self, app):
-        super().__init__(app)
-
-    async def dispatch(self, request, call_next):
-        response = await call_next(request)
-
-        direct_paths = [
-            f"{settings.API_V1_STR}/mcp/mcp_question",
-            f"{settings.API_V1_STR}/mcp/mcp_assistant",
-            "/openapi.json",
-            "/docs",
-            "/redoc"
-        ]
-
-        route = request.scope.get("route")
-        # 获取定义的路径模式，例如 '/items/{item_id}'
-        path_pattern = '' if not route else route.path_format
-
-        if (isinstance(response, JSONResponse)
-                or request.url.path == f"{settings.API_V1_STR}/openapi.json"
-                or path_pattern in direct_paths):
-            return response
-        if response.status_code != 200:
-            return response
-        if response.headers.get("content-type") == "application/json":
+# scope key set once a response carries the envelope, the fallback middleware leaves those alone
+ENVELOPED_SCOPE_KEY = 'sqlbot.enveloped'
+
+direct_paths = [
+    f"{settings.API_V1_STR}/mcp/mcp_question",
+    f"{settings.API_V1_STR}/mcp/mcp_assistant",
+    f"{settings.API_V1_STR}/openapi.json",
+    "/openapi.json",
+    "/docs",
+    "/redoc"
+]
+
+
+def is_enveloped(content: Any) -> bool:
+    return isinstance(content, dict) and all(k in content for k in ["code", "data", "msg"])
+
+
+def dump_json(content: Any) -> bytes:
+    try:
+        return orjson.dumps(content, option=orjson.OPT_NON_STR_KEYS)
+    except (orjson.JSONEncodeError, TypeError):
+        # e.g. integers beyond 64 bits, keep what JSONResponse would send
+        return json.dumps(content, ensure_ascii=False, allow_nan=False, indent=None,
+                          separators=(",", ":")).encode("utf-8")
+
+
+class EnvelopeResponse(JSONResponse):
+    """
+    default response class of the app: a 200 body is wrapped into {"code": 0, "data": ..., "msg": null} while it
+    is serialized, a body already holding code/data/msg is sent as is
+    """
+
+    def render(self, content: Any) -> bytes:
+        if self.status_code == 200 and not is_enveloped(content):
+            content = {"code": 0, "data": content, "msg": None}
+        return dump_json(content)
+
+    async def __call__(self, scope: Scope, receive: Receive, send: Send) -> None:
+        scope[ENVELOPED_SCOPE_KEY] = True
+        await super().__call__(scope, receive, send)
+
+
+class ResponseMiddleware:
+    """
+    fallback for application/json responses not built by EnvelopeResponse (a JSONResponse returned by an
+    endpoint or a mounted router), those are still parsed and wrapped here. everything else is passed through
+    without buffering
+    """
+
+    def __init__(self, app: ASGIApp):
+        self.app = app
+
+    async def __call__(self, scope: Scope, receive: Receive, send: Send) -> None:
+        if scope["type"] != "http" or scope.get("path") in direct_paths:
+            await self.app(scope, receive, send)
+            return
+
+        start_message: Message = {}
+        body = bytearray()
+
+        async def send_wrapper(message: Message):
+            nonlocal start_message
+            if message["type"] == "http.response.start":
+                route = scope.get("route")
+                # 获取定义的路径模式，例如 '/items/{item_id}'
+                path_pattern = '' if not route else route.path_format
+                content_type = next((v for k, v in message.get("headers", []) if k.lower() == b"content-type"), b"")
+                if (message["status"] != 200 or content_type != b"application/json"
+                        or scope.get(ENVELOPED_SCOPE_KEY) or path_pattern in direct_paths):
+                    await send(message)
+                else:
+                    start_message = message
+                return
+            if not start_message or message["type"] != "http.response.body":
+                await send(message)
+                return
+
+            body.extend(message.get("body", b""))
+            if message.get("more_body", False):
+                return
+            headers = [(k, v) for k, v in start_message.get("headers", [])
+                       if k.lower() not in (b"content-length", b"content-type")]
             try:
-                body = b""
-                async for chunk in response.body_iterator:
-                    body += chunk
-
-                raw_data = json.loads(body.decode())
-
-                if isinstance(raw_data, dict) and all(k in raw_data for k in ["code", "data", "msg"]):
-                    return JSONResponse(
-                        content=raw_data,
-                        status_code=response.status_code,
-                        headers={
-                            k: v for k, v in response.headers.items()
-                            if k.lower() not in ("content-length", "content-type")
-                        }
-                    )
-
-                wrapped_data = {
-                    "code": 0,
-                    "data": raw_data,
-                    "msg": None
-                }
-
-                return JSONResponse(
-                    content=wrapped_data,
-                    status_code=response.status_code,
-                    headers={
-                        k: v for k, v in response.headers.items()
-                        if k.lower() not in ("content-length", "content-type")
-                    }
-                )
+                raw_data = orjson.loads(body)
+                content = raw_data if is_enveloped(raw_data) else {"code": 0, "data": raw_data, "msg": None}
+                status = 200
+                data = dump_json(content)
             except Exception as e:
                 SQLBotLogUtil.error(f"Response processing error: {str(e)}", exc_info=True)
-                return JSONResponse(
-                    status_code=500,
-                    content=str(e),
-                    headers={
-                        k: v for k, v in response.headers.items()
-                        if k.lower() not in ("content-length", "content-type")
-                    }
-                )
-
-        return response
+                status = 500
+                data = dump_json(str(e))
+            headers += [(b"content-length", str(len(data)).encode()), (b"content-type", b"application/json")]
+            await send({**start_message, "status": status, "headers": headers})
+            await send({"type": "http.response.body", "body": data})
+
+        await self.app(scope, receive, send_wrapper)
 
 
 class exception_handler():
@@ -0,0 +1,59 @@
+# Author: Junjun
+# Date: 2025/10/17
+import csv
+import io
+from typing import Any, Iterable, Iterator
+
+import xlsxwriter
+
+# data rows of a worksheet below the header row
+XLSX_MAX_ROWS = 1048575
+CSV_CHUNK_SIZE = 64 * 1024
+
+
+def _cell(value: Any) -> Any:
+    # xlsxwriter only writes plain values, nested json cells are written as their text
+    if value is None or isinstance(value, (str, int, float, bool)):
+        return value
+    return str(value)
+
+
+def csv_stream(header: list[str], rows: Iterable[list]) -> Iterator[bytes]:
+    """
+    csv with a utf-8 bom (read as utf-8 by excel), encoded in CSV_CHUNK_SIZE chunks as the rows are read
+    """
+    buffer = io.StringIO()
+    writer = csv.writer(buffer)
+    buffer.write('\ufeff')
+    writer.writerow(header)
+    for row in rows:
+        writer.writerow(row)
+        if buffer.tell() >= CSV_CHUNK_SIZE:
+            yield buffer.getvalue().encode('utf-8')
+            buffer.seek(0)
+            buffer.truncate()
+    if buffer.tell():
+        yield buffer.getvalue().encode('utf-8')
+
+
+def write_xlsx(path: str, header: list[str], rows: Iterable[list], sheet_name: str = 'Sheet1') -> int:
+    """
+    write the rows to an xlsx file in constant_memory mode, each row is flushed to disk once the next one is
+    written. rows beyond XLSX_MAX_ROWS are left out, returns the number of data rows written
+    """
+    workbook = xlsxwriter.Workbook(path, {'constant_memory': True, 'strings_to_numbers': False,
+                                          'nan_inf_to_errors': True})
+    count = 0
+    try:
+        worksheet = workbook.add_worksheet(sheet_name)
+        # header style of pandas to_excel, which wrote these exports before
+        header_format = workbook.add_format({'bold': True, 'border': 1, 'align': 'center', 'valign': 'top'})
+        worksheet.write_row(0, 0, header, header_format)
+        for row in rows:
+            if count >= XLSX_MAX_ROWS:
+                break
+            count += 1
+            worksheet.write_row(count, 0, [_cell(value) for value in row])
+    finally:
+        workbook.close()
+    return count
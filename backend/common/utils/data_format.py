@@ -79,7 +79,7 @@ class DataFormat:
         return md_data, _fields_list
 
     @staticmethod
-    def convert_data_fields_for_pandas(chart: dict, fields: list, data: list):
+    def chart_field_names(chart: dict, fields: list) -> list:
         _fields = {}
         if chart.get('columns'):
             for _column in chart.get('columns'):
@@ -93,10 +93,13 @@ class DataFormat:
             if chart.get('axis').get('series'):
                 _fields[chart.get('axis').get('series').get('value')] = chart.get('axis').get('series').get(
                     'name')
+        return [field if not _fields.get(field) else _fields.get(field) for field in fields]
+
+    @staticmethod
+    def convert_data_fields_for_pandas(chart: dict, fields: list, data: list):
         _column_list = []
-        for field in fields:
-            _column_list.append(
-                AxisObj(name=field if not _fields.get(field) else _fields.get(field), value=field))
+        for name, field in zip(DataFormat.chart_field_names(chart, fields), fields):
+            _column_list.append(AxisObj(name=name, value=field))
 
         md_data, _fields_list = DataFormat.convert_object_array_for_pandas(_column_list, data)
 
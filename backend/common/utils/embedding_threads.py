@@ -1,11 +1,15 @@
+import time
 from concurrent.futures import ThreadPoolExecutor
-from typing import List
+from typing import List, Sequence
 
+from sqlalchemy import text
 from sqlalchemy.orm import sessionmaker, scoped_session
 
 executor = ThreadPoolExecutor(max_workers=200)
 
+from common.core.config import settings
 from common.core.db import engine
+from common.utils.utils import SQLBotLogUtil
 
 session_maker = scoped_session(sessionmaker(bind=engine))
 
@@ -13,6 +17,54 @@ session_maker = scoped_session(sessionmaker(bind=engine))
 # session = session_maker()
 
 
+def _bulk_update_embeddings(session, table_name: str, ids: Sequence[int], embeddings: Sequence[List[float]]):
+    values = []
+    params = {}
+    for index, (_id, emb) in enumerate(zip(ids, embeddings)):
+        values.append(f"(CAST(:id_{index} AS BIGINT), CAST(:emb_{index} AS vector))")
+        params[f'id_{index}'] = _id
+        params[f'emb_{index}'] = str(emb)
+    sql = f"""
+UPDATE {table_name} AS t SET embedding = v.embedding
+FROM (VALUES {', '.join(values)}) AS v(id, embedding)
+WHERE t.id = v.id
+"""
+    session.execute(text(sql), params)
+
+
+def embed_and_save(session, table_name: str, items: Sequence[tuple[int, str]], batch_size: int = None) -> int:
+    """
+    embed (id, text) pairs with embed_documents in batches of EMBEDDING_BATCH_SIZE and write each batch
+    with one UPDATE ... FROM VALUES and one commit, logging progress and throughput.
+    table_name is one of our own tables with an id and a vector embedding column
+    """
+    from apps.ai_model.embedding import EmbeddingModelCache
+
+    total = len(items)
+    if total == 0:
+        return 0
+    batch_size = batch_size or settings.EMBEDDING_BATCH_SIZE
+    model = EmbeddingModelCache.get_model()
+    start_time = time.time()
+    embed_cost = 0.0
+    done = 0
+    for offset in range(0, total, batch_size):
+        batch = items[offset:offset + batch_size]
+        embed_start = time.time()
+        embeddings = model.embed_documents([item[1] for item in batch])
+        embed_cost += time.time() - embed_start
+        _bulk_update_embeddings(session, table_name, [item[0] for item in batch], embeddings)
+        session.commit()
+        done += len(batch)
+        elapsed = time.time() - start_time
+        SQLBotLogUtil.info(f"{table_name} embedding: {done}/{total}, {elapsed:.2f} seconds, "
+                           f"{done / elapsed if elapsed > 0 else 0:.1f} rows/s")
+    elapsed = time.time() - start_time
+    SQLBotLogUtil.info(f"{table_name} embedding finished: {total} rows in {elapsed:.2f} seconds "
+                       f"(model {embed_cost:.2f} seconds, database {elapsed - embed_cost:.2f} seconds)")
+    return total
+
+
 def run_save_terminology_embeddings(ids: List[int]):
     from apps.terminology.curd.terminology import save_embeddings
     executor.submit(save_embeddings, session_maker, ids)
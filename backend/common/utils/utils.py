@@ -1,10 +1,12 @@
+import atexit
 import base64
 import hashlib
-import inspect
 import json
 import logging
+import queue
+import sys
 from datetime import datetime, timedelta, timezone
-from logging.handlers import RotatingFileHandler
+from logging.handlers import RotatingFileHandler, QueueHandler, QueueListener
 from pathlib import Path
 import re
 from urllib.parse import urlparse
@@ -86,6 +88,20 @@ def string_to_numeric_hash(text: str, bits: Optional[int] = 64) -> int:
     return hash_num % max_bigint
 
 
+class _LogQueueHandler(QueueHandler):
+    # the record is formatted by the listener thread, not by the thread that logged it
+    def prepare(self, record: logging.LogRecord) -> logging.LogRecord:
+        return record
+
+
+class _LogQueueListener(QueueListener):
+    # merge the message once instead of once per handler
+    def prepare(self, record: logging.LogRecord) -> logging.LogRecord:
+        record.msg = record.getMessage()
+        record.args = None
+        return record
+
+
 def setup_logging():
     # 确保日志目录存在
     log_dir = Path(settings.LOG_DIR)
@@ -112,9 +128,7 @@ def setup_logging():
     # 主日志记录器
     root_logger = logging.getLogger()
     root_logger.setLevel(logging.DEBUG)  # 设置最低级别
-    
-    # 添加控制台处理器
-    root_logger.addHandler(console_handler)
+    handlers: list[logging.Handler] = [console_handler]
     
     # 为每个级别创建文件处理器
     for level_name, level in file_handlers.items():
@@ -138,7 +152,18 @@ def setup_logging():
         elif level_name == 'error':
             handler.addFilter(lambda record: record.levelno >= logging.ERROR)
         
-        root_logger.addHandler(handler)
+        handlers.append(handler)
+
+    if settings.LOG_QUEUE_ENABLED:
+        # console and file writes happen in the listener thread, logging only enqueues the record
+        log_queue = queue.SimpleQueue()
+        listener = _LogQueueListener(log_queue, *handlers, respect_handler_level=True)
+        listener.start()
+        atexit.register(listener.stop)
+        root_logger.addHandler(_LogQueueHandler(log_queue))
+    else:
+        for handler in handlers:
+            root_logger.addHandler(handler)
     
     # SQL日志特殊处理
     if settings.LOG_LEVEL == "DEBUG" and settings.SQL_DEBUG:
@@ -157,70 +182,56 @@ def setup_logging():
 setup_logging()
 
 
-class CallerLogger(logging.Logger):
-    def __init__(self, logger: logging.Logger):
-        self.logger = logger
-        super().__init__(logger.name, logger.level)
+_caller_loggers: dict[str, logging.Logger] = {}
+
+
+def _caller_logger() -> logging.Logger:
+    # logger of the module calling SQLBotLogUtil, frame 0 is this function and 1 the SQLBotLogUtil method
+    name = sys._getframe(2).f_globals.get('__name__', '__main__')
+    logger = _caller_loggers.get(name)
+    if logger is None:
+        logger = _caller_loggers.setdefault(name, logging.getLogger(name))
+    return logger
 
-    def _log(self, level, msg, args, exc_info=None, extra=None, stacklevel=3):
-        if self.logger.isEnabledFor(level):
-            self.logger._log(level, msg, args, exc_info=exc_info, extra=extra, stacklevel=stacklevel)
 
 class SQLBotLogUtil:
-    
-    @staticmethod
-    def _get_logger() -> logging.Logger:
-        frame = inspect.currentframe()
-        try:
-            caller_frame = frame.f_back.f_back
-            module_name = caller_frame.f_globals.get('__name__', '__main__')
-            return CallerLogger(logging.getLogger(module_name))
-        finally:
-            del frame
-        
+    """
+    logs to the logger of the calling module. the level is checked before the caller is looked up and
+    args are only merged into msg when the record is written, e.g. SQLBotLogUtil.info('sql on ds %s: %s', ds_id, sql)
+    """
 
     @staticmethod
     def debug(msg: str, *args, **kwargs):
-        logger = SQLBotLogUtil._get_logger()
-        if logger.isEnabledFor(logging.DEBUG):
-            logger._log(logging.DEBUG, msg, args, **kwargs)
+        if logging.root.isEnabledFor(logging.DEBUG):
+            _caller_logger().log(logging.DEBUG, msg, *args, stacklevel=2, **kwargs)
 
     @staticmethod
     def info(msg: str, *args, **kwargs):
-        logger = SQLBotLogUtil._get_logger()
-        if logger.isEnabledFor(logging.INFO):
-            logger._log(logging.INFO, msg, args, **kwargs)
+        if logging.root.isEnabledFor(logging.INFO):
+            _caller_logger().log(logging.INFO, msg, *args, stacklevel=2, **kwargs)
 
     @staticmethod
     def warning(msg: str, *args, **kwargs):
-        logger = SQLBotLogUtil._get_logger()
-        if logger.isEnabledFor(logging.WARNING):
-            logger._log(logging.WARNING, msg, args, **kwargs)
+        if logging.root.isEnabledFor(logging.WARNING):
+            _caller_logger().log(logging.WARNING, msg, *args, stacklevel=2, **kwargs)
 
     @staticmethod
     def error(msg: str, *args, exc_info: Optional[bool] = None, **kwargs):
-        logger = SQLBotLogUtil._get_logger()
-        if logger.isEnabledFor(logging.ERROR):
-            logger._log(
-                logging.ERROR, 
-                msg, 
-                args, 
-                exc_info=exc_info if exc_info is not None else True,
-                **kwargs
-            )
+        if logging.root.isEnabledFor(logging.ERROR):
+            _caller_logger().log(logging.ERROR, msg, *args, exc_info=exc_info if exc_info is not None else True,
+                                 stacklevel=2, **kwargs)
 
     @staticmethod
     def exception(msg: str, *args, **kwargs):
-        logger = SQLBotLogUtil._get_logger()
-        if logger.isEnabledFor(logging.ERROR):
-            logger._log(logging.ERROR, msg, args, exc_info=True, **kwargs)
+        if logging.root.isEnabledFor(logging.ERROR):
+            _caller_logger().log(logging.ERROR, msg, *args, exc_info=True, stacklevel=2, **kwargs)
 
     @staticmethod
     def critical(msg: str, *args, **kwargs):
-        logger = SQLBotLogUtil._get_logger()
-        if logger.isEnabledFor(logging.CRITICAL):
-            logger._log(logging.CRITICAL, msg, args, **kwargs)
-            
+        if logging.root.isEnabledFor(logging.CRITICAL):
+            _caller_logger().log(logging.CRITICAL, msg, *args, stacklevel=2, **kwargs)
+
+
 def prepare_for_orjson(data):
     if not data:
         return data
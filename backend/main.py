@@ -23,7 +23,7 @@ from apps.system.middleware.auth import TokenMiddleware
 from apps.system.schemas.permission import RequestContextMiddleware
 from common.audit.schemas.request_context import RequestContextMiddlewareCommon
 from common.core.config import settings
-from common.core.response_middleware import ResponseMiddleware, exception_handler
+from common.core.response_middleware import EnvelopeResponse, ResponseMiddleware, exception_handler
 from common.core.sqlbot_cache import init_sqlbot_cache
 from common.utils.embedding_threads import fill_empty_terminology_embeddings, fill_empty_data_training_embeddings, \
     fill_empty_table_and_ds_embeddings
@@ -73,6 +73,7 @@ app = FastAPI(
     openapi_url=f"{settings.API_V1_STR}/openapi.json",
     generate_unique_id_function=custom_generate_unique_id,
     lifespan=lifespan,
+    default_response_class=EnvelopeResponse,
     docs_url=None,
     redoc_url=None
 )
@@ -0,0 +1,110 @@
+"""
+Peak python memory and time of exporting chat result rows: previous export_excel (DataFrame written to a
+BytesIO, copied once more for the response) vs the rows written one by one by write_xlsx (xlsxwriter
+constant_memory, to a temp file) and csv_stream. rows are produced lazily as a re-run sql feeds them, the
+previous export gets them as the list it held. peak memory is measured with tracemalloc.
+
+usage (from backend/): python -m scripts.benchmark.chat_export --rows 1000 20000 100000
+"""
+import argparse
+import io
+import os
+import tempfile
+import time
+import tracemalloc
+
+import pandas as pd
+from openpyxl import load_workbook
+
+from apps.chat.models.chat_model import AxisObj
+from common.utils.data_export import csv_stream, write_xlsx
+from common.utils.data_format import DataFormat
+
+fields = [AxisObj(name='订单编号', value='id'), AxisObj(name='客户', value='name'),
+          AxisObj(name='城市', value='city'), AxisObj(name='金额', value='amount'),
+          AxisObj(name='已支付', value='paid'), AxisObj(name='下单时间', value='created')]
+
+
+def _rows(count: int):
+    for i in range(count):
+        yield {'id': i, 'name': f'customer {i}', 'city': '上海' if i % 2 else 'Berlin', 'amount': i * 1.25,
+               'paid': i % 3 == 0, 'created': f'2025-10-{i % 28 + 1:02d}T12:00:00'}
+
+
+def _previous(count: int) -> bytes:
+    # export_excel before the streaming export
+    _data = list(_rows(count))
+    data_list = DataFormat.convert_large_numbers_in_object_array(_data)
+    md_data, _fields_list = DataFormat.convert_object_array_for_pandas(fields, data_list)
+    df = pd.DataFrame(md_data, columns=_fields_list)
+    buffer = io.BytesIO()
+    with pd.ExcelWriter(buffer, engine='xlsxwriter',
+                        engine_kwargs={'options': {'strings_to_numbers': False}}) as writer:
+        df.to_excel(writer, sheet_name='Sheet1', index=False)
+    buffer.seek(0)
+    return io.BytesIO(buffer.getvalue()).getvalue()
+
+
+def _export_rows(count: int):
+    for row in _rows(count):
+        row = DataFormat.convert_large_numbers_in_object_array([row])[0]
+        yield [row.get(field.value) for field in fields]
+
+
+def _xlsx(count: int, path: str) -> int:
+    return write_xlsx(path, [field.name for field in fields], _export_rows(count))
+
+
+def _csv(count: int) -> int:
+    return sum(len(chunk) for chunk in csv_stream([field.name for field in fields], _export_rows(count)))
+
+
+def _measure(func, *args):
+    # timed apart from the traced run, tracemalloc slows allocations down several times
+    start = time.perf_counter()
+    func(*args)
+    cost = time.perf_counter() - start
+    tracemalloc.start()
+    result = func(*args)
+    peak = tracemalloc.get_traced_memory()[1]
+    tracemalloc.stop()
+    return result, cost, peak
+
+
+def _sheet_rows(path: str) -> list[tuple]:
+    workbook = load_workbook(path, read_only=True)
+    rows = list(workbook.active.iter_rows(values_only=True))
+    workbook.close()
+    return rows
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--rows', type=int, nargs='+', default=[1000, 20000, 100000])
+    parser.add_argument('--check-rows', type=int, default=20000, help='compare the xlsx contents up to this size')
+    args = parser.parse_args()
+
+    print(f'{"rows":>8} {"export":<9} {"time":>9} {"peak mem":>10} {"size":>11}')
+    for count in args.rows:
+        previous, cost, peak = _measure(_previous, count)
+        print(f'{count:8d} {"previous":<9} {cost * 1000:7.0f}ms {peak / 1048576:8.1f}MB {len(previous):11d}')
+
+        fd, path = tempfile.mkstemp(suffix='.xlsx')
+        os.close(fd)
+        try:
+            written, cost, peak = _measure(_xlsx, count, path)
+            print(f'{count:8d} {"xlsx":<9} {cost * 1000:7.0f}ms {peak / 1048576:8.1f}MB {os.path.getsize(path):11d}')
+            if count <= args.check_rows:
+                with tempfile.NamedTemporaryFile(suffix='.xlsx') as f:
+                    f.write(previous)
+                    f.flush()
+                    print(f'{"":8} same rows as previous: {_sheet_rows(f.name) == _sheet_rows(path)}')
+        finally:
+            os.remove(path)
+
+        size, cost, peak = _measure(_csv, count)
+        print(f'{count:8d} {"csv":<9} {cost * 1000:7.0f}ms {peak / 1048576:8.1f}MB {size:11d}')
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,185 @@
+"""
+Latency of the chat history queries on a large history, without and with the indexes of migration 061.
+seeds chat, chat_record and chat_log into a schema of their own on the sqlbot postgres (records of all chats
+interleaved in time, as written by concurrent users), runs the crud functions behind opening a chat and the
+recent question lists, and prints p50/p99 per query plus the scans postgres chose (EXPLAIN ANALYZE).
+
+usage (from backend/): python -m scripts.benchmark.chat_history_indexes --chats 100000 --records-per-chat 20
+    (2M records and 8M logs, seeding takes a few minutes; pass --keep to reuse the schema with --skip-seed)
+"""
+import argparse
+import random
+import statistics
+import time
+from types import SimpleNamespace
+from typing import Callable
+
+from sqlalchemy import event, text
+from sqlmodel import Session
+
+from apps.chat.curd.chat import get_chat_with_records, get_last_execute_sql_error, get_old_questions, \
+    list_generate_sql_logs, list_recent_questions
+from apps.chat.models.chat_model import Chat, ChatLog, ChatRecord
+from apps.datasource.models.datasource import CoreDatasource
+from common.core.db import engine
+
+indexes = ['ix_chat_record_chat_id_create_time', 'ix_chat_record_datasource_create_time',
+           'ix_chat_log_pid_type_operate', 'ix_chat_create_by_oid_create_time', 'ix_chat_datasource']
+
+
+def _seed(schema: str, chats: int, records_per_chat: int, users: int, datasources: int):
+    bench_engine = engine.execution_options(schema_translate_map={None: schema})
+    with engine.begin() as conn:
+        conn.execute(text(f'DROP SCHEMA IF EXISTS {schema} CASCADE'))
+        conn.execute(text(f'CREATE SCHEMA {schema}'))
+    # opening a chat also looks up its datasource, left empty here
+    for table in (Chat.__table__, ChatRecord.__table__, ChatLog.__table__, CoreDatasource.__table__):
+        table.create(bench_engine)
+
+    start = time.perf_counter()
+    with engine.begin() as conn:
+        conn.execute(text(f'SET LOCAL search_path TO {schema}'))
+        conn.execute(text("""
+            INSERT INTO chat (oid, create_time, create_by, brief, chat_type, datasource, engine_type, origin,
+                              brief_generate, recommended_generate)
+            SELECT 1, now() - interval '1 second' * (:chats - g), (g - 1) % :users + 1, 'chat ' || g, 'chat',
+                   (g - 1) % :datasources + 1, 'PostgreSQL', 0, true, false
+            FROM generate_series(1, :chats) g"""), {'chats': chats, 'users': users, 'datasources': datasources})
+        conn.execute(text("""
+            INSERT INTO chat_record (chat_id, first_chat, create_time, finish_time, create_by, datasource,
+                                     engine_type, question, sql_answer, sql, chart, finish, error)
+            SELECT c, false, now() - interval '1 second' * (:records - g), now(), (c - 1) % :users + 1,
+                   (c - 1) % :datasources + 1, 'PostgreSQL', 'question ' || g % 5000,
+                   repeat('answer ', 40), 'SELECT * FROM orders LIMIT 1000', '{"type": "table"}', true,
+                   CASE WHEN g % 50 = 0 THEN '{"type": "exec-sql-err", "traceback": "error"}' END
+            FROM generate_series(1, :records) g, LATERAL (SELECT (g - 1) % :chats + 1 AS c) owner"""),
+                     {'records': chats * records_per_chat, 'chats': chats, 'users': users,
+                      'datasources': datasources})
+        conn.execute(text("""
+            INSERT INTO chat_log (type, operate, pid, ai_modal_id, base_modal, reasoning_content, start_time,
+                                  finish_time)
+            SELECT '0', op, r.id, 1, 'qwen', 'reasoning ' || r.id, r.create_time, r.finish_time
+            FROM chat_record r, (VALUES ('0'), ('1'), ('4'), ('6')) ops(op)"""))
+    with engine.connect() as conn:
+        conn = conn.execution_options(isolation_level='AUTOCOMMIT')
+        for table in ('chat', 'chat_record', 'chat_log'):
+            conn.execute(text(f'VACUUM ANALYZE {schema}.{table}'))
+    print(f'seeded {chats} chats, {chats * records_per_chat} records, {chats * records_per_chat * 4} logs '
+          f'in {time.perf_counter() - start:.0f}s')
+
+
+def _set_indexes(schema: str, create: bool):
+    with engine.begin() as conn:
+        for name in indexes:
+            conn.execute(text(f'DROP INDEX IF EXISTS {schema}.{name}'))
+        if create:
+            conn = conn.execution_options(schema_translate_map={None: schema})
+            for table in (Chat.__table__, ChatRecord.__table__, ChatLog.__table__):
+                for index in table.indexes:
+                    index.create(conn)
+        for table in ('chat', 'chat_record', 'chat_log'):
+            conn.execute(text(f'ANALYZE {schema}.{table}'))
+
+
+def _queries(chats: int, users: int, datasources: int) -> dict[str, Callable[[Session, random.Random], object]]:
+    def open_chat(session: Session, rnd: random.Random):
+        chat_id = rnd.randint(1, chats)
+        user = SimpleNamespace(id=(chat_id - 1) % users + 1)
+        return get_chat_with_records(session, chat_id, user, None)
+
+    return {
+        'get_chat_with_records': open_chat,
+        'get_last_execute_sql_error': lambda session, rnd: get_last_execute_sql_error(session,
+                                                                                      rnd.randint(1, chats)),
+        'list_generate_sql_logs': lambda session, rnd: list_generate_sql_logs(session, rnd.randint(1, chats)),
+        'get_old_questions': lambda session, rnd: get_old_questions(session, rnd.randint(1, datasources)),
+        'list_recent_questions': lambda session, rnd: list_recent_questions(session, None,
+                                                                            rnd.randint(1, datasources)),
+    }
+
+
+def _scans(plan: dict) -> list[str]:
+    scans = []
+    if 'Scan' in plan['Node Type']:
+        scans.append(f"{plan['Node Type']}{' using ' + plan['Index Name'] if plan.get('Index Name') else ''}"
+                     f" on {plan.get('Relation Name')}")
+    for child in plan.get('Plans', []):
+        scans += _scans(child)
+    return scans
+
+
+def _run(schema: str, queries: dict, runs: int) -> dict[str, tuple[list[float], list[str]]]:
+    bench_engine = engine.execution_options(schema_translate_map={None: schema})
+    results = {}
+    for name, query in queries.items():
+        rnd = random.Random(0)
+        cost = []
+        for _ in range(runs):
+            with Session(bench_engine) as session:
+                start = time.perf_counter()
+                query(session, rnd)
+                cost.append((time.perf_counter() - start) * 1000)
+
+        # plan of the last statement the query ran
+        statements = []
+
+        def capture(conn, cursor, statement, parameters, context, executemany):
+            statements.append((statement, parameters))
+
+        event.listen(engine, 'before_cursor_execute', capture)
+        try:
+            with Session(bench_engine) as session:
+                query(session, random.Random(1))
+        finally:
+            event.remove(engine, 'before_cursor_execute', capture)
+        statement, parameters = statements[-1]
+        with engine.connect() as conn:
+            plan = conn.exec_driver_sql(f'EXPLAIN (ANALYZE, FORMAT JSON) {statement}', parameters).scalar()
+        results[name] = (cost, sorted(set(_scans(plan[0]['Plan']))))
+    return results
+
+
+def _p(cost: list[float], q: float) -> float:
+    cost = sorted(cost)
+    return cost[min(int(len(cost) * q), len(cost) - 1)]
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--schema', default='sqlbot_index_bench')
+    parser.add_argument('--chats', type=int, default=100000)
+    parser.add_argument('--records-per-chat', type=int, default=20)
+    parser.add_argument('--users', type=int, default=1000)
+    parser.add_argument('--datasources', type=int, default=200)
+    parser.add_argument('--runs', type=int, default=200)
+    parser.add_argument('--skip-seed', action='store_true', help='reuse the schema of a previous --keep run')
+    parser.add_argument('--keep', action='store_true', help='keep the seeded schema')
+    args = parser.parse_args()
+
+    if not args.skip_seed:
+        _seed(args.schema, args.chats, args.records_per_chat, args.users, args.datasources)
+    queries = _queries(args.chats, args.users, args.datasources)
+    try:
+        _set_indexes(args.schema, False)
+        before = _run(args.schema, queries, args.runs)
+        _set_indexes(args.schema, True)
+        after = _run(args.schema, queries, args.runs)
+    finally:
+        if not args.keep:
+            with engine.begin() as conn:
+                conn.execute(text(f'DROP SCHEMA IF EXISTS {args.schema} CASCADE'))
+
+    print(f'{"query":<28} {"p50 before":>11} {"p99 before":>11} {"p50 after":>10} {"p99 after":>10}')
+    for name in queries:
+        cost_before, scans_before = before[name]
+        cost_after, scans_after = after[name]
+        print(f'{name:<28} {_p(cost_before, 0.5):9.2f}ms {_p(cost_before, 0.99):9.2f}ms '
+              f'{_p(cost_after, 0.5):8.2f}ms {_p(cost_after, 0.99):8.2f}ms')
+        print(f'    before: {"; ".join(scans_before)}')
+        print(f'    after:  {"; ".join(scans_after)}')
+    print(f'mean over all queries {statistics.mean(c for cost, _ in before.values() for c in cost):.2f}ms -> '
+          f'{statistics.mean(c for cost, _ in after.values() for c in cost):.2f}ms')
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,109 @@
+"""
+Concurrent streaming chats against a running server: time to first token, total time per stream, and the
+server's peak RSS and thread count (read from /proc, pass --pid when the server runs on this machine).
+compare a run with CHAT_ASYNC_PIPELINE_ENABLED=false against one with true.
+
+usage (from backend/): python -m scripts.benchmark.chat_stream_load --url http://localhost:8000 --token <jwt>
+    --ds-id 1 --question "top 10 products by sales" -c 100 --pid <server pid>
+"""
+import argparse
+import asyncio
+import statistics
+import time
+from typing import Optional
+
+import httpx
+import orjson
+
+
+def _proc_status(pid: int) -> dict[str, int]:
+    status = {}
+    with open(f'/proc/{pid}/status') as f:
+        for line in f:
+            key, _, value = line.partition(':')
+            if key in ('VmRSS', 'Threads'):
+                status[key] = int(value.split()[0])
+    return status
+
+
+async def _sample(pid: int, peak: dict[str, int], stop: asyncio.Event):
+    while not stop.is_set():
+        for key, value in _proc_status(pid).items():
+            peak[key] = max(peak.get(key, 0), value)
+        try:
+            await asyncio.wait_for(stop.wait(), 0.2)
+        except asyncio.TimeoutError:
+            pass
+
+
+async def _chat(client: httpx.AsyncClient, ds_id: int, question: str) -> tuple[Optional[float], float, bool]:
+    res = await client.post('/chat/start', json={'datasource': ds_id})
+    res.raise_for_status()
+    chat_id = res.json()['data']['id'] if 'data' in res.json() else res.json()['id']
+
+    start = time.perf_counter()
+    first_token = None
+    success = True
+    async with client.stream('POST', '/chat/question', json={'chat_id': chat_id, 'question': question}) as res:
+        async for line in res.aiter_lines():
+            if not line.startswith('data:'):
+                continue
+            data = orjson.loads(line[5:])
+            if first_token is None and data.get('type') in ('sql-result', 'datasource-result') and (
+                    data.get('content') or data.get('reasoning_content')):
+                first_token = time.perf_counter() - start
+            if data.get('type') == 'error':
+                success = False
+    return first_token, time.perf_counter() - start, success
+
+
+def _ms(values: list[float], q: float) -> str:
+    if not values:
+        return '-'
+    values = sorted(values)
+    return f'{values[min(int(len(values) * q), len(values) - 1)] * 1000:.0f}ms'
+
+
+async def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--url', default='http://localhost:8000')
+    parser.add_argument('--token', required=True, help='jwt of a user allowed to chat on the datasource')
+    parser.add_argument('--ds-id', type=int, required=True)
+    parser.add_argument('--question', required=True)
+    parser.add_argument('-c', '--concurrency', type=int, default=100)
+    parser.add_argument('--pid', type=int, help='server process to sample RSS and threads from')
+    args = parser.parse_args()
+
+    peak: dict[str, int] = {}
+    stop = asyncio.Event()
+    sampler = asyncio.create_task(_sample(args.pid, peak, stop)) if args.pid else None
+
+    limits = httpx.Limits(max_connections=args.concurrency * 2)
+    async with httpx.AsyncClient(base_url=args.url.rstrip('/') + '/api/v1', limits=limits, timeout=None,
+                                 headers={'X-SQLBOT-TOKEN': f'Bearer {args.token}'}) as client:
+        start = time.perf_counter()
+        results = await asyncio.gather(*[_chat(client, args.ds_id, args.question) for _ in range(args.concurrency)],
+                                       return_exceptions=True)
+        cost = time.perf_counter() - start
+
+    stop.set()
+    if sampler:
+        await sampler
+
+    done = [r for r in results if not isinstance(r, BaseException)]
+    errors = [r for r in results if isinstance(r, BaseException)]
+    ttft = [r[0] for r in done if r[0] is not None]
+    total = [r[1] for r in done]
+    print(f'{args.concurrency} concurrent streams in {cost:.1f} s, {sum(r[2] for r in done)} succeeded, '
+          f'{len(done) - sum(r[2] for r in done)} answered with an error, {len(errors)} failed')
+    if errors:
+        print(f'first failure: {errors[0]!r}')
+    print(f'time to first token  p50 {_ms(ttft, 0.5)}  p95 {_ms(ttft, 0.95)}  max {_ms(ttft, 1)}')
+    print(f'stream total         p50 {_ms(total, 0.5)}  p95 {_ms(total, 0.95)}  '
+          f'mean {statistics.mean(total) * 1000 if total else 0:.0f}ms')
+    if peak:
+        print(f'server peak RSS {peak.get("VmRSS", 0) / 1024:.0f} MB, peak threads {peak.get("Threads", 0)}')
+
+
+if __name__ == '__main__':
+    asyncio.run(main())
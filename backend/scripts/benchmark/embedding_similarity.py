@@ -0,0 +1,62 @@
+"""
+Table/datasource ranking cost: pure-Python cosine_similarity + sort vs matmul + argpartition,
+at 100 / 1k / 10k candidates of 768-dim normalized vectors, including the json.loads of stored text.
+
+usage (from backend/): python -m scripts.benchmark.embedding_similarity
+"""
+import argparse
+import json
+import time
+
+import numpy as np
+
+from apps.datasource.embedding.utils import cosine_similarity, rank_embeddings
+
+
+def _normalized(n: int, dim: int) -> np.ndarray:
+    m = np.random.default_rng(0).standard_normal((n, dim)).astype(np.float32)
+    return m / np.linalg.norm(m, axis=1, keepdims=True)
+
+
+def _python_rank(q, stored: list[str], k: int):
+    scored = [(i, cosine_similarity(q, json.loads(item))) for i, item in enumerate(stored)]
+    scored.sort(key=lambda x: x[1], reverse=True)
+    return scored[:k]
+
+
+def _numpy_rank(q, stored: list[str], k: int):
+    return rank_embeddings(q, [json.loads(item) for item in stored], k)
+
+
+def _time(func, repeat: int) -> float:
+    start = time.perf_counter()
+    for _ in range(repeat):
+        func()
+    return (time.perf_counter() - start) * 1000 / repeat
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--dim', type=int, default=768)
+    parser.add_argument('-k', type=int, default=10)
+    parser.add_argument('--repeat', type=int, default=5)
+    args = parser.parse_args()
+
+    for n in (100, 1000, 10000):
+        matrix = _normalized(n, args.dim)
+        stored = [json.dumps(row.tolist()) for row in matrix]
+        q = _normalized(1, args.dim)[0].tolist()
+
+        expected = [i for i, _ in _python_rank(q, stored, args.k)]
+        actual = [i for i, _ in _numpy_rank(q, stored, args.k)]
+        assert expected == actual, 'ranking mismatch'
+
+        python_ms = _time(lambda: _python_rank(q, stored, args.k), args.repeat)
+        numpy_ms = _time(lambda: _numpy_rank(q, stored, args.k), args.repeat)
+        score_ms = _time(lambda: rank_embeddings(q, matrix, args.k), args.repeat)
+        print(f'n={n:<6} python {python_ms:9.2f} ms  numpy {numpy_ms:9.2f} ms  '
+              f'numpy (no json) {score_ms:7.2f} ms  x{python_ms / numpy_ms:.1f}')
+
+
+if __name__ == '__main__':
+    main()
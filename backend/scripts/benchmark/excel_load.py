@@ -0,0 +1,87 @@
+"""
+Excel/CSV ingestion throughput into the excel datasource database: previous to_sql + COPY (every row
+written twice, whole frame buffered) vs chunked COPY loader, on a generated csv (1M rows by default).
+
+usage (from backend/): python -m scripts.benchmark.excel_load --rows 1000000
+"""
+import argparse
+import hashlib
+import os
+import tempfile
+import time
+import tracemalloc
+import uuid
+from io import StringIO
+
+import numpy as np
+import pandas as pd
+from sqlalchemy import text
+
+from apps.db.engine import get_engine_conn
+from apps.db.excel_loader import load_csv
+
+
+def _generate(rows: int, file_path: str):
+    rng = np.random.default_rng(0)
+    pd.DataFrame({
+        'id': np.arange(rows),
+        'amount': rng.random(rows) * 1000,
+        'category': rng.choice(['a', 'b', 'c', 'd'], rows),
+        'note': [f'row {i}' for i in range(rows)],
+    }).to_csv(file_path, index=False)
+
+
+def _previous(file_path: str, table_name: str, engine):
+    df = pd.read_csv(file_path, engine='c')
+    conn = engine.raw_connection()
+    cursor = conn.cursor()
+    try:
+        df.to_sql(table_name, engine, if_exists='replace', index=False)
+        output = StringIO()
+        df.to_csv(output, sep='\t', header=False, index=False)
+        output.seek(0)
+        cursor.copy_expert(sql=f"""COPY "{table_name}" FROM STDIN WITH CSV DELIMITER E'\t'""", file=output)
+        conn.commit()
+    finally:
+        cursor.close()
+        conn.close()
+
+
+def _measure(name: str, func, table_name: str, engine):
+    tracemalloc.start()
+    start = time.perf_counter()
+    func()
+    cost = time.perf_counter() - start
+    _, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    with engine.connect() as conn:
+        count = conn.execute(text(f'SELECT count(*) FROM "{table_name}"')).scalar()
+        conn.execute(text(f'DROP TABLE "{table_name}"'))
+        conn.commit()
+    print(f'{name:<10} {cost:8.2f} s  {count / cost:10.0f} rows/s  rows in table {count}  '
+          f'peak python memory {peak / 1024 / 1024:8.1f} MB')
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--rows', type=int, default=1000000)
+    parser.add_argument('--chunksize', type=int, default=None)
+    args = parser.parse_args()
+
+    engine = get_engine_conn()
+    file_path = os.path.join(tempfile.gettempdir(), f'excel_load_{args.rows}.csv')
+    try:
+        _generate(args.rows, file_path)
+        print(f'{args.rows} rows, {os.path.getsize(file_path) / 1024 / 1024:.1f} MB csv')
+
+        table_name = f'bench_{hashlib.sha256(uuid.uuid4().bytes).hexdigest()[:10]}'
+        _measure('previous', lambda: _previous(file_path, table_name, engine), table_name, engine)
+        table_name = f'bench_{hashlib.sha256(uuid.uuid4().bytes).hexdigest()[:10]}'
+        _measure('chunked', lambda: load_csv(file_path, table_name, engine, args.chunksize), table_name, engine)
+    finally:
+        os.remove(file_path)
+        engine.dispose()
+
+
+if __name__ == '__main__':
+    main()
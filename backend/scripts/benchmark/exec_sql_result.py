@@ -0,0 +1,75 @@
+"""
+exec_sql result handling on a synthetic driver result (100k rows by default): previous list-of-dicts pipeline
+(Decimal conversion per cell, convert_large_numbers_in_object_array, prepare_for_orjson, orjson) vs ColumnarResult.
+no database is needed, the rows are generated as a driver would return them.
+
+usage (from backend/): python -m scripts.benchmark.exec_sql_result --rows 100000
+"""
+import argparse
+import datetime
+import time
+import tracemalloc
+from decimal import Decimal
+
+import orjson
+
+from apps.db.result import ColumnarResult
+from common.utils.data_format import DataFormat
+from common.utils.utils import prepare_for_orjson
+
+
+def _generate(rows: int):
+    fields = ['id', 'amount', 'total', 'ratio', 'name', 'created', 'payload']
+    day = datetime.date(2025, 1, 1)
+    res = [(i, Decimal(f'{i}.25'), 10 ** 16 + i if i % 10 == 0 else i, i / 3, f'name {i}',
+            day + datetime.timedelta(days=i % 365), b'\x00\x01' if i % 100 == 0 else None)
+           for i in range(rows)]
+    return fields, res
+
+
+def _previous(fields, res, limit):
+    result_list = [
+        {str(fields[i]): float(value) if isinstance(value, Decimal) else value for i, value in
+         enumerate(tuple_item)}
+        for tuple_item in res
+    ]
+    data = {"fields": fields, "data": result_list, "sql": ''}
+    data["data"] = DataFormat.convert_large_numbers_in_object_array(data.get('data'))
+    data_result = prepare_for_orjson(data["data"])
+    data['data'] = data_result[:limit]
+    return orjson.dumps(data, option=orjson.OPT_PASSTHROUGH_DATETIME, default=str)
+
+
+def _columnar(fields, res, limit):
+    result = ColumnarResult.from_rows(fields, res)
+    result.convert_large_numbers()
+    result.prepare_for_json()
+    return orjson.dumps(result.to_dict(limit), option=orjson.OPT_PASSTHROUGH_DATETIME, default=str)
+
+
+def _measure(name: str, func):
+    tracemalloc.start()
+    start = time.perf_counter()
+    out = func()
+    cost = time.perf_counter() - start
+    _, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    print(f'{name:<10} {cost:8.3f} s  peak python memory {peak / 1024 / 1024:8.1f} MB  output {len(out)} bytes')
+    return out
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--rows', type=int, default=100000)
+    parser.add_argument('--limit', type=int, default=1000)
+    args = parser.parse_args()
+
+    fields, res = _generate(args.rows)
+    print(f'{args.rows} rows, {len(fields)} columns, stored rows limited to {args.limit}')
+    previous = _measure('previous', lambda: _previous(fields, res, args.limit))
+    columnar = _measure('columnar', lambda: _columnar(fields, res, args.limit))
+    print(f'same output: {previous == columnar}')
+
+
+if __name__ == '__main__':
+    main()
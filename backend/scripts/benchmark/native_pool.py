@@ -0,0 +1,66 @@
+"""
+Per-query latency of py_driver datasources (dm, doris, starrocks, redshift, kingbase),
+fresh connection per query vs pooled connection.
+
+usage (from backend/): python -m scripts.benchmark.native_pool --ds-id 1 -n 200
+"""
+import argparse
+import json
+import statistics
+import time
+
+from sqlmodel import Session
+
+from apps.datasource.models.datasource import CoreDatasource, DatasourceConf
+from apps.datasource.utils.utils import aes_decrypt
+from apps.db.db import get_native_connect, get_native_connection
+from common.core.db import engine
+
+
+def _run(n: int, sql: str, borrow) -> list[float]:
+    cost = []
+    for _ in range(n):
+        start = time.perf_counter()
+        borrow(sql)
+        cost.append((time.perf_counter() - start) * 1000)
+    return cost
+
+
+def _report(name: str, cost: list[float]):
+    cost = sorted(cost)
+    print(f'{name:<10} p50 {statistics.median(cost):8.2f} ms  '
+          f'p99 {cost[int(len(cost) * 0.99) - 1]:8.2f} ms  mean {statistics.mean(cost):8.2f} ms')
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--ds-id', type=int, required=True)
+    parser.add_argument('-n', type=int, default=200)
+    parser.add_argument('--sql', default='select 1')
+    args = parser.parse_args()
+
+    with Session(engine) as session:
+        ds = session.get(CoreDatasource, args.ds_id)
+    conf = DatasourceConf(**json.loads(aes_decrypt(ds.configuration)))
+
+    def fresh(sql):
+        conn = get_native_connect(ds.type, conf, conf.timeout)
+        try:
+            cursor = conn.cursor()
+            cursor.execute(sql)
+            cursor.fetchall()
+            cursor.close()
+        finally:
+            conn.close()
+
+    def pooled(sql):
+        with get_native_connection(ds, conf, conf.timeout) as conn, conn.cursor() as cursor:
+            cursor.execute(sql)
+            cursor.fetchall()
+
+    _report('fresh', _run(args.n, args.sql, fresh))
+    _report('pooled', _run(args.n, args.sql, pooled))
+
+
+if __name__ == '__main__':
+    main()
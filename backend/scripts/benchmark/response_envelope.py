@@ -0,0 +1,116 @@
+"""
+Cost of the {"code", "data", "msg"} envelope on large json payloads (rows like a datasource preview), served
+through an in-process app: previous ResponseMiddleware (body buffered, json.loads and dumped again) vs
+EnvelopeResponse, which wraps the body once while it is serialized. an endpoint returning its own
+JSONResponse shows the remaining fallback path of ResponseMiddleware. the /rows timings include fastapi's
+jsonable_encoder, which both variants run before rendering. first checks that the schema routes of main.py
+are served without the envelope.
+
+usage (from backend/): python -m scripts.benchmark.response_envelope --rows 1000 10000 50000
+"""
+import argparse
+import asyncio
+import json
+import logging
+import time
+
+import httpx
+from fastapi import FastAPI
+from starlette.middleware.base import BaseHTTPMiddleware
+from starlette.responses import JSONResponse
+
+from common.core.config import settings
+from common.core.response_middleware import EnvelopeResponse, ResponseMiddleware
+
+
+class _PreviousResponseMiddleware(BaseHTTPMiddleware):
+    # ResponseMiddleware before EnvelopeResponse, without the direct paths
+    async def dispatch(self, request, call_next):
+        response = await call_next(request)
+        if response.status_code != 200 or response.headers.get("content-type") != "application/json":
+            return response
+        body = b""
+        async for chunk in response.body_iterator:
+            body += chunk
+        raw_data = json.loads(body.decode())
+        if not (isinstance(raw_data, dict) and all(k in raw_data for k in ["code", "data", "msg"])):
+            raw_data = {"code": 0, "data": raw_data, "msg": None}
+        return JSONResponse(content=raw_data, status_code=response.status_code,
+                            headers={k: v for k, v in response.headers.items()
+                                     if k.lower() not in ("content-length", "content-type")})
+
+
+def _rows(count: int) -> list[dict]:
+    return [{'id': i, 'name': f'customer {i}', 'city': '上海' if i % 2 else 'Berlin', 'amount': i * 1.25,
+             'paid': i % 3 == 0, 'created': f'2025-10-{i % 28 + 1:02d} 12:00:00', 'note': None}
+            for i in range(count)]
+
+
+def _app(previous: bool) -> FastAPI:
+    if previous:
+        app = FastAPI()
+        app.add_middleware(_PreviousResponseMiddleware)
+    else:
+        # schema routes as in main.py
+        app = FastAPI(openapi_url=f"{settings.API_V1_STR}/openapi.json", default_response_class=EnvelopeResponse)
+        app.add_middleware(ResponseMiddleware)
+
+        @app.get('/openapi.json', include_in_schema=False)
+        async def custom_openapi():
+            return JSONResponse(app.openapi())
+
+    @app.get('/rows')
+    async def rows(count: int):
+        return _rows(count)
+
+    @app.get('/explicit')
+    async def explicit(count: int):
+        return JSONResponse(_rows(count))
+
+    return app
+
+
+async def _measure(app: FastAPI, path: str, count: int, repeat: int) -> tuple[float, bytes]:
+    transport = httpx.ASGITransport(app=app)
+    async with httpx.AsyncClient(transport=transport, base_url='http://bench') as client:
+        best = None
+        body = b''
+        for _ in range(repeat):
+            start = time.perf_counter()
+            res = await client.get(path, params={'count': count})
+            cost = time.perf_counter() - start
+            res.raise_for_status()
+            body = res.content
+            best = cost if best is None else min(best, cost)
+    return best, body
+
+
+async def _check_schema_routes(app: FastAPI):
+    transport = httpx.ASGITransport(app=app)
+    async with httpx.AsyncClient(transport=transport, base_url='http://bench') as client:
+        for path in (f'{settings.API_V1_STR}/openapi.json', '/openapi.json'):
+            res = await client.get(path)
+            res.raise_for_status()
+            print(f'{path} served without envelope: {"openapi" in res.json()}')
+
+
+async def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--rows', type=int, nargs='+', default=[1000, 10000, 50000])
+    parser.add_argument('--repeat', type=int, default=5)
+    args = parser.parse_args()
+    logging.getLogger('httpx').setLevel(logging.WARNING)
+
+    previous, current = _app(True), _app(False)
+    await _check_schema_routes(current)
+    print(f'{"rows":>7} {"endpoint":<10} {"previous":>10} {"current":>10} {"bytes":>10}  same payload')
+    for count in args.rows:
+        for path in ('/rows', '/explicit'):
+            before, before_body = await _measure(previous, path, count, args.repeat)
+            after, after_body = await _measure(current, path, count, args.repeat)
+            print(f'{count:7d} {path:<10} {before * 1000:8.1f}ms {after * 1000:8.1f}ms {len(after_body):10d}  '
+                  f'{json.loads(before_body) == json.loads(after_body)}')
+
+
+if __name__ == '__main__':
+    asyncio.run(main())
@@ -0,0 +1,181 @@
+"""
+Per-chunk cost of turning a recorded llm stream (5k tokens by default, a <think> block followed by the answer)
+into SSE frames: previous process_stream (log line per chunk, tag scan on the accumulated text) vs
+ReasoningStreamParser, with and without coalescing chunks into frames. log lines are formatted and written to
+/dev/null as they would be with the server's INFO logging.
+
+usage (from backend/): python -m scripts.benchmark.stream_parser --tokens 5000
+"""
+import argparse
+import asyncio
+import logging
+import os
+import random
+import time
+
+import orjson
+from langchain_core.messages import AIMessageChunk
+
+from apps.chat.task.stream_parser import aprocess_stream, coalesce_chunks, get_token_usage
+from common.utils.utils import SQLBotLogUtil
+
+START_TAG = '<think>'
+END_TAG = '</think>'
+
+
+def _record(tokens: int) -> list[AIMessageChunk]:
+    rnd = random.Random(0)
+    words = ['the', 'orders', 'table', ' joins', ' customers', ' on', ' customer_id', ',', ' so', ' I', ' should',
+             ' group', ' by', ' month', '\n', ' SUM', '(amount)', ' WHERE', ' status', " = 'paid'"]
+    thinking = tokens * 3 // 5
+    chunks = [AIMessageChunk(content=START_TAG[:3]), AIMessageChunk(content=START_TAG[3:])]
+    chunks += [AIMessageChunk(content=rnd.choice(words)) for _ in range(thinking)]
+    chunks.append(AIMessageChunk(content='</think>\n\n{"success": true, "sql": "'))
+    chunks += [AIMessageChunk(content=rnd.choice(words).replace('\n', ' ')) for _ in range(tokens - thinking - 4)]
+    chunks.append(AIMessageChunk(content='"}'))
+    chunks.append(AIMessageChunk(content='', usage_metadata={'input_tokens': 1200, 'output_tokens': tokens,
+                                                              'total_tokens': 1200 + tokens}))
+    return chunks
+
+
+def _previous(res, token_usage=None, enable_tag_parsing=True, start_tag=START_TAG, end_tag=END_TAG):
+    # process_stream before ReasoningStreamParser
+    if token_usage is None:
+        token_usage = {}
+    in_thinking_block = False
+    current_thinking = ''
+    pending_start_tag = ''
+
+    for chunk in res:
+        SQLBotLogUtil.info(chunk)
+        reasoning_content_chunk = ''
+        content = chunk.content
+        output_content = ''
+
+        if 'reasoning_content' in chunk.additional_kwargs:
+            reasoning_content = chunk.additional_kwargs.get('reasoning_content', '')
+            if reasoning_content is None:
+                reasoning_content = ''
+            current_thinking += reasoning_content
+            reasoning_content_chunk = reasoning_content
+
+        if not in_thinking_block and current_thinking.strip() != '':
+            output_content = content
+            yield {'content': output_content, 'reasoning_content': reasoning_content_chunk}
+            get_token_usage(chunk, token_usage)
+            continue
+
+        if pending_start_tag:
+            content = pending_start_tag + content
+            pending_start_tag = ''
+
+        if enable_tag_parsing and not in_thinking_block and start_tag:
+            if start_tag in content:
+                start_idx = content.index(start_tag)
+                if start_idx == 0 or content[:start_idx].strip() == '':
+                    output_content += content[:start_idx]
+                    content = content[start_idx + len(start_tag):]
+                    in_thinking_block = True
+                else:
+                    output_content += content
+                    content = ''
+            else:
+                for i in range(1, len(start_tag)):
+                    if content.endswith(start_tag[:i]):
+                        if content[:-i].strip() == '':
+                            pending_start_tag = start_tag[:i]
+                            content = content[:-i]
+                            output_content += content
+                            content = ''
+                        break
+
+        if enable_tag_parsing and in_thinking_block and end_tag:
+            if end_tag in content:
+                end_idx = content.index(end_tag)
+                current_thinking += content[:end_idx]
+                reasoning_content_chunk += current_thinking
+                content = content[end_idx + len(end_tag):]
+                current_thinking = ''
+                in_thinking_block = False
+                output_content += content
+            else:
+                current_thinking += content
+                reasoning_content_chunk += content
+                content = ''
+        else:
+            output_content += content
+
+        yield {'content': output_content, 'reasoning_content': reasoning_content_chunk}
+        get_token_usage(chunk, token_usage)
+
+
+def _frame(chunk: dict) -> str:
+    return 'data:' + orjson.dumps({'content': chunk.get('content'), 'reasoning_content': chunk.get('reasoning_content'),
+                                   'type': 'sql-result'}).decode() + '\n\n'
+
+
+async def _replay(chunks):
+    # every chunk arrives on its own, as from the network
+    for chunk in chunks:
+        await asyncio.sleep(0)
+        yield chunk
+
+
+def _run_previous(chunks) -> list[str]:
+    async def run():
+        return [_frame(chunk) for chunk in _previous([chunk async for chunk in _replay(chunks)])]
+
+    return asyncio.run(run())
+
+
+def _run_parser(chunks, coalesce_chars: int = 0) -> list[str]:
+    async def run():
+        parsed = aprocess_stream(_replay(chunks), {}, True, START_TAG, END_TAG)
+        if coalesce_chars:
+            parsed = coalesce_chunks(parsed, max_delay=1, max_chars=coalesce_chars)
+        return [_frame(chunk) async for chunk in parsed]
+
+    return asyncio.run(run())
+
+
+def _measure(name: str, func, repeat: int) -> list[str]:
+    best = None
+    frames = []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        frames = func()
+        cost = time.perf_counter() - start
+        best = cost if best is None else min(best, cost)
+    size = sum(len(frame) for frame in frames)
+    print(f'{name:<22} {best * 1000:8.1f} ms  {len(frames):6d} frames  {size:8d} bytes sent')
+    return frames
+
+
+def _text(frames: list[str], key: str) -> str:
+    return ''.join(orjson.loads(frame[5:]).get(key) or '' for frame in frames)
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--tokens', type=int, default=5000)
+    parser.add_argument('--repeat', type=int, default=5)
+    parser.add_argument('--coalesce-chars', type=int, default=256)
+    args = parser.parse_args()
+
+    logging.basicConfig(level=logging.INFO, stream=open(os.devnull, 'w'),
+                        format='%(asctime)s - %(name)s - %(levelname)s - %(message)s')
+    chunks = _record(args.tokens)
+    print(f'{len(chunks)} recorded chunks')
+    previous = _measure('previous', lambda: _run_previous(chunks), args.repeat)
+    current = _measure('parser', lambda: _run_parser(chunks), args.repeat)
+    coalesced = _measure('parser + coalesce', lambda: _run_parser(chunks, args.coalesce_chars), args.repeat)
+
+    print(f'same content: {_text(previous, "content") == _text(current, "content") == _text(coalesced, "content")}')
+    # the previous parser repeated the whole think block with the chunk holding the end tag
+    print(f'same reasoning: {_text(current, "reasoning_content") == _text(coalesced, "reasoning_content")}, '
+          f'previous sent {len(_text(previous, "reasoning_content"))} reasoning chars for '
+          f'{len(_text(current, "reasoning_content"))}')
+
+
+if __name__ == '__main__':
+    main()